@@ -1,17 +1,20 @@
 import streamlit as st
 import os
-from dotenv import load_dotenv
+import time
+from typing import Optional
 from llm_service import LLMService
+from llm_backend import requires_api_key
+from cache import normalize_query
+from singleflight import SingleFlight
 from ui_components import (
     render_suggestion_card, 
     render_content_card, 
+    render_content_cards,
     render_book_recommendation,
-    render_analysis_debug
+    render_analysis_debug,
+    APP_CSS
 )
-from models import QueryType
-
-# Load environment variables for local development
-load_dotenv()
+from models import QueryType, SearchResponse, BookRecommendation
 
 # Page configuration
 st.set_page_config(
@@ -21,112 +24,111 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
-# Custom CSS for Notion-like minimalistic styling
-st.markdown("""
-<style>
-    .main .block-container {
-        max-width: 800px;
-        padding-top: 2rem;
-        padding-bottom: 2rem;
-    }
-    
-    .main-header {
-        text-align: center;
-        background: #f7f6f3;
-        padding: 24px;
-        border-radius: 8px;
-        border: 1px solid #e9e9e7;
-        margin-bottom: 24px;
-    }
-    
-    .main-header h1 {
-        margin: 0;
-        font-size: 2.2em;
-        color: #2d2d2d;
-        font-weight: 600;
-    }
-    
-    .main-header p {
-        margin: 8px 0 0 0;
-        font-size: 1em;
-        color: #6b6b6b;
-    }
-    
-    .stTextInput input {
-        border-radius: 6px;
-        border: 1px solid #e9e9e7;
-        padding: 12px 16px;
-        font-size: 14px;
-        height: 44px;
-        background-color: white;
-    }
-    
-    .stTextInput input:focus {
-        border-color: #2383e2;
-        box-shadow: 0 0 0 1px #2383e2;
-    }
-    
-    .stButton button {
-        background: #2383e2;
-        color: white;
-        border: none;
-        border-radius: 6px;
-        padding: 10px 16px;
-        font-weight: 500;
-        font-size: 14px;
-        width: 100%;
-        height: 44px;
-        transition: background-color 0.2s;
-    }
-    
-    .stButton button:hover {
-        background: #1a73d1;
-    }
-    
-    .results-section {
-        margin-top: 32px;
-    }
-    
-    /* Make overall content more compact */
-    .element-container {
-        margin-bottom: 0.75rem !important;
-    }
-    
-    .stMarkdown {
-        margin-bottom: 0.75rem !important;
-    }
-    
-    /* Footer styling */
-    .footer {
-        text-align: center;
-        color: #8b8b8b;
-        font-size: 14px;
-        margin: 40px 0 20px 0;
-        padding-top: 24px;
-        border-top: 1px solid #e9e9e7;
-    }
-</style>
-""", unsafe_allow_html=True)
+# Styles live in ui_components, which is imported once per process rather than every rerun
+st.markdown(APP_CSS, unsafe_allow_html=True)
 
-def main():
-    # Check for API key - try Streamlit secrets first, then environment variables
-    try:
-        api_key = st.secrets["OPENAI_API_KEY"]
-    except (KeyError, FileNotFoundError):
-        api_key = os.getenv("OPENAI_API_KEY")
+@st.cache_resource
+def get_llm_service() -> LLMService:
+    """One LLMService per process, shared by every session.
+
+    Its client, caches, index and classifier are thread-safe, so sessions share
+    one connection pool and memory stays flat as sessions are added.
+    """
+    service = LLMService()
+    print(f"LLMService ready in {service.startup_seconds * 1000:.0f} ms")
+    return service
+
+@st.cache_resource
+def get_search_flights() -> SingleFlight:
+    """Process-wide registry of in-flight searches, shared by every session"""
+    return SingleFlight()
+
+def reset_search():
+    """Clear the results and the search box for a new search"""
+    for key in ('search_results', 'search_trace', 'time_to_first_card', 'last_submitted_query'):
+        st.session_state.pop(key, None)
+    st.session_state.search_input = ""
+
+def render_search_results(results: SearchResponse, time_to_first_card: Optional[float] = None):
+    """Render a completed search response"""
+    st.markdown('<div class="results-section">', unsafe_allow_html=True)
     
-    if not api_key or api_key == "your_openai_api_key_here":
-        st.error("🔑 Please set your OpenAI API key!")
-        st.info("For local development: Edit the `.env` file and replace `your_openai_api_key_here` with your actual OpenAI API key.")
-        st.info("For Streamlit Cloud: Add the API key to your app's secrets in the dashboard.")
-        st.stop()
+    # Show analysis debug info (collapsible)
+    render_analysis_debug(results.analysis, time_to_first_card, st.session_state.get('search_trace'))
     
-    # Set the API key in environment for the LLM service
-    os.environ["OPENAI_API_KEY"] = api_key
+    # Display results based on query type
+    if results.analysis.query_type == QueryType.SPECIFIC_BOOK and results.book_recommendation:
+        st.markdown("### 📖 Content Recommendation")
+        render_book_recommendation(results.book_recommendation)
+        
+    elif results.content_cards:
+        # Display all cards returned by the LLM (1-5 cards that form a cohesive progression) as one element
+        render_content_cards(results.content_cards)
     
-    # Initialize LLM service
-    if 'llm_service' not in st.session_state:
-        st.session_state.llm_service = LLMService()
+    st.markdown('</div>', unsafe_allow_html=True)
+
+def stream_search_results(llm_service: LLMService, user_query: str) -> SearchResponse:
+    """Render each result as soon as it streams in and return the assembled response"""
+    start = time.perf_counter()
+    # Sessions searching the same query at the same time share one upstream request
+    flight = get_search_flights().join(user_query, lambda: llm_service.stream_search_query(user_query))
+    stream = flight.subscribe()
+    
+    with st.spinner("Analyzing your query and finding relevant content..."):
+        analysis = next(stream)
+    
+    st.markdown('<div class="results-section">', unsafe_allow_html=True)
+    # Filled in once the stream finishes so it can show the time to first card
+    debug_placeholder = st.empty()
+    
+    book_recommendation = None
+    content_cards = []
+    time_to_first_card = None
+    for item in stream:
+        if time_to_first_card is None:
+            time_to_first_card = time.perf_counter() - start
+        if isinstance(item, BookRecommendation):
+            book_recommendation = item
+            st.markdown("### 📖 Content Recommendation")
+            render_book_recommendation(item)
+        else:
+            render_content_card(item, is_main=not content_cards)
+            content_cards.append(item)
+    
+    st.markdown('</div>', unsafe_allow_html=True)
+    # The flight has finished, so its trace is complete
+    trace = flight.trace
+    with debug_placeholder.container():
+        render_analysis_debug(analysis, time_to_first_card, trace)
+    
+    st.session_state.time_to_first_card = time_to_first_card
+    st.session_state.search_trace = trace
+    return SearchResponse(
+        analysis=analysis,
+        book_recommendation=book_recommendation,
+        content_cards=content_cards
+    )
+
+def main():
+    # Check for API key - try Streamlit secrets first, then environment variables.
+    # Compatible and mock backends (LLM_BACKEND) bring their own credentials.
+    if requires_api_key():
+        try:
+            api_key = st.secrets["OPENAI_API_KEY"]
+        except (KeyError, FileNotFoundError):
+            api_key = os.getenv("OPENAI_API_KEY")
+
+        if not api_key or api_key == "your_openai_api_key_here":
+            st.error("🔑 Please set your OpenAI API key!")
+            st.info("For local development: Edit the `.env` file and replace `your_openai_api_key_here` with your actual OpenAI API key.")
+            st.info("For Streamlit Cloud: Add the API key to your app's secrets in the dashboard.")
+            st.stop()
+
+        # Set the API key in environment for the LLM service
+        os.environ["OPENAI_API_KEY"] = api_key
+    
+    # Built on the first session of the process; later sessions reuse it
+    llm_service = get_llm_service()
     
     # Header
     st.markdown("""
@@ -154,47 +156,30 @@ def main():
     if not user_query and 'search_results' not in st.session_state:
         render_suggestion_card()
     
-    # Process search when button clicked or Enter pressed
-    if (search_clicked or user_query) and user_query.strip():
-        with st.spinner("Analyzing your query and finding relevant content..."):
-            try:
-                # Process the search query
-                search_results = st.session_state.llm_service.process_search_query(user_query)
-                st.session_state.search_results = search_results
-                
-                # Don't try to clear the input - this causes the error
-                
-            except Exception as e:
-                st.error(f"❌ Search failed: {str(e)}")
-                st.info("💡 Make sure your OpenAI API key is valid and you have sufficient credits.")
-                return
+    # Search on an explicit submit or when the text changed since the last search,
+    # not on every rerun triggered by other widgets
+    rendered_live = False
+    query = user_query.strip()
+    query_changed = normalize_query(query) != st.session_state.get('last_submitted_query')
+    if query and (search_clicked or query_changed):
+        try:
+            st.session_state.search_results = stream_search_results(llm_service, query)
+            st.session_state.last_submitted_query = normalize_query(query)
+            rendered_live = True
+        except Exception as e:
+            # Do not retry a failing query on every rerun
+            st.session_state.last_submitted_query = normalize_query(query)
+            st.error(f"❌ Search failed: {str(e)}")
+            st.info("💡 Make sure your OpenAI API key is valid and you have sufficient credits.")
+            return
     
     # Display results
     if 'search_results' in st.session_state:
-        results = st.session_state.search_results
-        
-        st.markdown('<div class="results-section">', unsafe_allow_html=True)
-        
-        # Show analysis debug info (collapsible)
-        render_analysis_debug(results.analysis)
-        
-        # Display results based on query type
-        if results.analysis.query_type == QueryType.SPECIFIC_BOOK and results.book_recommendation:
-            st.markdown("### 📖 Content Recommendation")
-            render_book_recommendation(results.book_recommendation)
-            
-        elif results.content_cards:
-            # Display all cards returned by the LLM (1-5 cards that form a cohesive progression)
-            for i, card in enumerate(results.content_cards):
-                render_content_card(card, is_main=(i == 0))
-        
-        st.markdown('</div>', unsafe_allow_html=True)
+        if not rendered_live:
+            render_search_results(st.session_state.search_results, st.session_state.get('time_to_first_card'))
         
         # Option to search again
-        if st.button("🔄 New Search", key="new_search"):
-            if 'search_results' in st.session_state:
-                del st.session_state.search_results
-            st.rerun()
+        st.button("🔄 New Search", key="new_search", on_click=reset_search)
     
     # Footer
     st.markdown("""
@@ -0,0 +1,365 @@
+import asyncio
+import os
+import time
+import weakref
+from typing import AsyncIterator, Optional, Union
+import openai
+from openai.types import CompletionUsage
+from dotenv import load_dotenv
+from models import (
+    QueryAnalysis, QueryType, UserIntentCategory,
+    SearchResponse, CombinedSearchResponse, BookRecommendation, ContentCard
+)
+from cache import ResponseCache, SemanticCache
+from llm_backend import create_async_client, create_client
+from tracing import Span, Tracer, span
+from routing import ModelRouter
+from resilience import UpstreamGuard
+from llm_service import (
+    SearchServiceBase, analysis_messages, combined_messages, recommendation_messages, card_messages,
+    fallback_analysis, fallback_recommendation, fallback_cards, same_branch, classify_batch,
+    response_items, streamed_cards
+)
+from rate_limit import estimate_tokens
+from lexical_index import LexicalIndex, recommendation_from_match
+from passage_index import PassageIndex, cards_from_passages, with_passages
+from response_parser import JsonArrayStreamParser, parse_query_analysis, parse_recommendation, parse_cards
+from intent_classifier import LocalIntentClassifier, classify_by_rules
+from vector_index import VectorIndex
+from retrieval import retrieve_candidates
+
+load_dotenv()
+
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 16))
+
+# The async HTTP pool is bound to the event loop it was created on, so the
+# process-wide client and semaphore are shared per running loop.
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, openai.AsyncOpenAI]" = weakref.WeakKeyDictionary()
+_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+def get_async_client() -> openai.AsyncOpenAI:
+    """Return the shared AsyncOpenAI client for the running event loop"""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        # Retries are handled per service by its UpstreamGuard
+        client = create_async_client(max_retries=0)
+        _clients[loop] = client
+    return client
+
+def get_request_semaphore(max_concurrency: int = DEFAULT_MAX_CONCURRENCY) -> asyncio.Semaphore:
+    """Return the shared semaphore limiting in-flight completions on the running event loop"""
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(max_concurrency)
+        _semaphores[loop] = semaphore
+    return semaphore
+
+class AsyncLLMService(SearchServiceBase):
+    """Async counterpart of LLMService sharing one pooled client per event loop.
+
+    Every instance on the same loop draws from the same connection pool and the
+    same concurrency semaphore, so many concurrent searches reuse keep-alive
+    connections instead of each opening their own. Cache, classification and
+    fallback decisions come from SearchServiceBase, as in LLMService.
+    """
+
+    def __init__(self, cache: Optional[ResponseCache] = None, max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 speculative: Optional[bool] = None, local_classifier: Optional[LocalIntentClassifier] = None,
+                 combined: Optional[bool] = None, vector_index: Optional[VectorIndex] = None,
+                 semantic_cache: Optional[SemanticCache] = None, model: Optional[str] = None,
+                 tracer: Optional[Tracer] = None, router: Optional[ModelRouter] = None,
+                 guard: Optional[UpstreamGuard] = None, batch_window_ms: Optional[float] = None,
+                 lexical_index: Optional[LexicalIndex] = None, passage_index: Optional[PassageIndex] = None,
+                 use_cache: bool = True):
+        self._configure(cache, speculative, local_classifier, combined, vector_index, semantic_cache, model,
+                        tracer, router, guard, lexical_index, passage_index, use_cache)
+        self.max_concurrency = max_concurrency
+        # Batches are sent from the batcher's threads, so they use a blocking client
+        self.batcher = self._create_batcher(batch_window_ms)
+        self._batch_client = create_client(max_retries=0) if self.batcher else None
+
+    async def _complete(self, messages: list[dict], temperature: float, stage: Span, model: str):
+        """Run one chat completion under the shared concurrency limit, returning (text, usage, seconds)"""
+        start = time.perf_counter()
+        response = await self.guard.acall(stage.name, lambda timeout: self._limited(
+            get_async_client().chat.completions.create,
+            stage,
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            timeout=timeout
+        ), stage, model=model, tokens=estimate_tokens(messages, stage.name, model))
+        stage.record_usage(response.usage)
+        return response.choices[0].message.content, response.usage, time.perf_counter() - start
+
+    async def _limited(self, request, stage: Span, **kwargs):
+        """One API attempt under the shared concurrency limit; retries wait outside it"""
+        queued = time.perf_counter()
+        async with get_request_semaphore(self.max_concurrency):
+            stage.set("queue_ms", (time.perf_counter() - queued) * 1000)
+            return await request(**kwargs)
+
+    async def _routed_completion(self, stage: Span, messages: list[dict], temperature: float, parse,
+                                 query: str, analysis: Optional[QueryAnalysis] = None):
+        """Run a completion on the routed model and parse it, escalating once to the large model if parsing fails"""
+        model = self.router.model_for(stage.name, query, analysis)
+        escalated = False
+        while True:
+            stage.model = model
+            response_text, usage, elapsed = await self._complete(messages, temperature, stage, model)
+            try:
+                result = parse(response_text)
+            except (ValueError, KeyError, TypeError) as e:
+                larger = self._escalation(stage, model, elapsed, usage, escalated, e)
+                if larger is None:
+                    raise
+                model, escalated = larger, True
+                continue
+            self.router.record(stage.name, model, elapsed, usage, escalated=escalated)
+            return result
+
+    async def analyze_query(self, user_query: str) -> QueryAnalysis:
+        """Analyze user query to determine type and intent category"""
+        local_analysis = self._classify_locally(user_query)
+        if local_analysis is not None:
+            return local_analysis
+        return await self._analyze_with_llm(user_query)
+
+    async def _analyze_with_llm(self, user_query: str) -> QueryAnalysis:
+        """Classify a query with the LLM, logging the result for classifier training"""
+        with span("analyze") as stage:
+            try:
+                analysis = await self._batched_analysis(user_query, stage) if self.batcher else None
+                if analysis is None:
+                    analysis = await self._routed_completion(stage, analysis_messages(user_query), 0.3, parse_query_analysis, user_query)
+            except Exception as e:
+                print(f"Error in query analysis: {str(e)}")
+                stage.fail(e)
+                return fallback_analysis(e)
+
+        await asyncio.to_thread(self._log_classification, user_query, analysis)
+        return analysis
+
+    async def close(self) -> None:
+        """Stop the batcher's threads once its waiting batches are sent; the shared async client stays open"""
+        if self.batcher:
+            await asyncio.to_thread(self.batcher.close)
+            self._batch_client.close()
+
+    def _classify_batch(self, queries: list[str]) -> list[tuple[Optional[QueryAnalysis], Optional[CompletionUsage]]]:
+        return classify_batch(self._batch_client, self.guard, self.router, queries)
+
+    async def _batched_analysis(self, user_query: str, stage: Span) -> Optional[QueryAnalysis]:
+        """Classify through the micro-batcher; None when the batch response left this query out"""
+        stage.model = self.router.model_for("analyze", user_query)
+        analysis, usage = await asyncio.wrap_future(self.batcher.submit(user_query))
+        stage.record_usage(usage)
+        stage.set("batched", True)
+        return analysis
+
+    async def generate_book_recommendation(self, query: str, analysis: Optional[QueryAnalysis] = None) -> BookRecommendation:
+        """Generate recommendation for specific content queries"""
+        match = self._lexical_match(query)
+        if match is not None and not self.lexical_personalize:
+            return recommendation_from_match(*match)
+
+        with span("recommend") as stage:
+            try:
+                candidates = [match[0]] if match is not None else await asyncio.to_thread(retrieve_candidates, self.vector_index, query)
+                stage.set("candidates", len(candidates))
+                return await self._routed_completion(
+                    stage, recommendation_messages(query, candidates), 0.4,
+                    lambda text: parse_recommendation(text, candidates), query, analysis
+                )
+            except Exception as e:
+                print(f"Error in recommendation generation: {str(e)}")
+                stage.fail(e)
+                return fallback_recommendation(e)
+
+    async def generate_content_cards(self, query: str, intent_category: UserIntentCategory,
+                                     analysis: Optional[QueryAnalysis] = None) -> list[ContentCard]:
+        """Generate relevant content cards based on query and intent"""
+        matches = self._passage_match(query, intent_category)
+
+        with span("cards") as stage:
+            try:
+                candidates = with_passages(matches, await asyncio.to_thread(retrieve_candidates, self.vector_index, query))
+                stage.set("candidates", len(candidates))
+                return await self._routed_completion(
+                    stage, card_messages(query, intent_category, candidates, matches), 0.6,
+                    lambda text: parse_cards(text, candidates), query, analysis
+                )
+            except Exception as e:
+                print(f"Error in content generation: {str(e)}")
+                stage.fail(e)
+                return cards_from_passages(matches) or fallback_cards()
+
+    async def stream_content_cards(self, query: str, intent_category: UserIntentCategory,
+                                   analysis: Optional[QueryAnalysis] = None) -> AsyncIterator[ContentCard]:
+        """Stream card generation and yield each card as soon as it is complete"""
+        matches = self._passage_match(query, intent_category)
+
+        yielded = False
+        model = self.router.model_for("cards", query, analysis)
+        with span("cards_stream", model=model) as stage:
+            start = time.perf_counter()
+            try:
+                candidates = with_passages(matches, await asyncio.to_thread(retrieve_candidates, self.vector_index, query))
+                stage.set("candidates", len(candidates))
+                by_id = {str(item["id"]): item for item in candidates}
+                messages = card_messages(query, intent_category, candidates, matches)
+                # The concurrency limit covers opening the stream, not reading it
+                stream = await self.guard.acall("cards_stream", lambda timeout: self._limited(
+                    get_async_client().chat.completions.create,
+                    stage,
+                    model=model,
+                    messages=messages,
+                    temperature=0.6,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    timeout=timeout
+                ), stage, hedge=False, model=model, tokens=estimate_tokens(messages, "cards", model))
+
+                parser = JsonArrayStreamParser()
+                async for chunk in stream:
+                    for card in streamed_cards(parser, chunk, stage, by_id):
+                        yielded = True
+                        yield card
+                if not yielded:
+                    raise ValueError("No content cards in streamed response")
+                self._stream_finished(stage, model, time.perf_counter() - start)
+            except Exception as e:
+                self._stream_finished(stage, model, time.perf_counter() - start, e)
+                if not yielded:
+                    for card in cards_from_passages(matches) or fallback_cards():
+                        yield card
+
+    async def stream_search_query(self, user_query: str) -> AsyncIterator[Union[QueryAnalysis, BookRecommendation, ContentCard]]:
+        """Yield the analysis, then the recommendation or each content card as it becomes ready"""
+        with self.tracer.trace(user_query):
+            start = time.perf_counter()
+
+            cached = await asyncio.to_thread(self._cached_response, user_query)
+            if cached is None and not self.guard.available():
+                cached = await asyncio.to_thread(self._degraded_response, user_query)
+            if cached is not None:
+                for item in response_items(cached):
+                    yield item
+                return
+
+            analysis = await self.analyze_query(user_query)
+            yield analysis
+
+            if analysis.query_type == QueryType.SPECIFIC_BOOK:
+                book_rec = await self.generate_book_recommendation(user_query, analysis)
+                yield book_rec
+                response = SearchResponse(analysis=analysis, book_recommendation=book_rec, content_cards=[])
+            else:
+                content_cards = []
+                async for card in self.stream_content_cards(user_query, analysis.user_intent_category, analysis):
+                    if not content_cards:
+                        self.first_card_latencies.append(time.perf_counter() - start)
+                    content_cards.append(card)
+                    yield card
+                response = SearchResponse(analysis=analysis, book_recommendation=None, content_cards=content_cards)
+
+            await asyncio.to_thread(self._store_response, user_query, response)
+
+    async def process_search_query(self, user_query: str) -> SearchResponse:
+        """Main method to process a search query end-to-end"""
+        with self.tracer.trace(user_query):
+            cached = await asyncio.to_thread(self._cached_response, user_query)
+            if cached is not None:
+                return cached
+
+            # While the upstream is unhealthy, answer locally instead of queueing behind failures
+            if not self.guard.available():
+                return await asyncio.to_thread(self._degraded_response, user_query)
+
+            if self.combined:
+                response = await self._process_combined(user_query)
+            elif self.speculative:
+                response = await self._process_speculatively(user_query)
+            else:
+                analysis = await self.analyze_query(user_query)
+                response = await self._generate_response(user_query, analysis)
+
+            await asyncio.to_thread(self._store_response, user_query, response)
+            return response
+
+    async def _generate_response(self, user_query: str, analysis: QueryAnalysis) -> SearchResponse:
+        """Run the generation stage selected by the analysis"""
+        if analysis.query_type == QueryType.SPECIFIC_BOOK:
+            return SearchResponse(
+                analysis=analysis,
+                book_recommendation=await self.generate_book_recommendation(user_query, analysis),
+                content_cards=[]
+            )
+        return SearchResponse(
+            analysis=analysis,
+            book_recommendation=None,
+            content_cards=await self.generate_content_cards(user_query, analysis.user_intent_category, analysis)
+        )
+
+    async def _process_combined(self, user_query: str) -> SearchResponse:
+        """Classify and generate in one structured-output round trip"""
+        local_analysis = self._classify_locally(user_query)
+        if local_analysis is not None:
+            return await self._generate_response(user_query, local_analysis)
+
+        model = self.router.model_for("combined", user_query, classify_by_rules(user_query))
+        with span("combined", model=model) as stage:
+            start = time.perf_counter()
+            messages = combined_messages(user_query)
+            try:
+                completion = await self.guard.acall("combined", lambda timeout: self._limited(
+                    get_async_client().chat.completions.parse,
+                    stage,
+                    model=model,
+                    messages=messages,
+                    response_format=CombinedSearchResponse,
+                    temperature=0.4,
+                    timeout=timeout
+                ), stage, model=model, tokens=estimate_tokens(messages, "combined", model))
+                response = self._combined_response(stage, completion, model, time.perf_counter() - start)
+            except Exception as e:
+                self._combined_failed(stage, e, model, time.perf_counter() - start)
+                return await self._generate_response(user_query, await self._analyze_with_llm(user_query))
+
+        await asyncio.to_thread(self._log_classification, user_query, response.analysis)
+        return response
+
+    async def _process_speculatively(self, user_query: str) -> SearchResponse:
+        """Run analysis alongside the generation predicted by the local rules, cancelling it on a miss.
+
+        Cancelling stops the generation at its next await, but a request it has
+        already sent is still billed, so a miss after it started counts as wasted.
+        """
+        local_analysis = self._classify_locally(user_query)
+        if local_analysis is not None:
+            return await self._generate_response(user_query, local_analysis)
+
+        predicted = classify_by_rules(user_query)
+        started = False
+
+        async def speculate() -> SearchResponse:
+            nonlocal started
+            started = True
+            return await self._generate_response(user_query, predicted)
+
+        speculative_task = asyncio.create_task(speculate())
+        try:
+            analysis = await self._analyze_with_llm(user_query)
+        except BaseException:
+            speculative_task.cancel()
+            raise
+
+        if same_branch(analysis, predicted):
+            self.speculation.record(True)
+            return (await speculative_task).model_copy(update={"analysis": analysis})
+
+        self.speculation.record(False, wasted=started)
+        speculative_task.cancel()
+        return await self._generate_response(user_query, analysis)
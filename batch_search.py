@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Bulk search over a JSONL file of queries.
+
+  run           search every query with bounded concurrency, appending one
+                SearchResponse per line; rerunning resumes from the output file
+  prepare-batch write an OpenAI Batch API request file (one combined
+                classify-and-generate request per query, half price)
+  import-batch  validate a Batch API output file into SearchResponse lines
+
+Every successful result also lands in the response caches, so running this
+over the top queries pre-warms them.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Iterator
+from openai.lib._parsing import type_to_response_format_param
+from models import CombinedSearchResponse
+from cache import ResponseCache, SemanticCache
+from llm_service import combined_messages, normalize_combined_response, is_fallback_response
+from response_parser import parse_search_response
+from async_llm_service import AsyncLLMService
+from llm_backend import LLM_MODEL
+from rate_limit import BACKGROUND, priority
+
+def read_queries(path: str, query_field: str = "query", id_field: str = "id") -> Iterator[tuple[str, str]]:
+    """Yield (id, query) pairs from JSONL objects or plain text lines"""
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                record = line
+            if isinstance(record, dict):
+                yield str(record.get(id_field, line_number)), str(record[query_field])
+            else:
+                yield str(line_number), str(record)
+
+def completed_ids(path: str) -> set[str]:
+    """Ids already present in an output file, tolerating a truncated last line"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["id"])
+            except (json.JSONDecodeError, KeyError):
+                continue
+    return done
+
+async def run_batch(input_path: str, output_path: str, concurrency: int, query_field: str, id_field: str) -> None:
+    """Search every pending query and append results to the output file as they complete"""
+    done = completed_ids(output_path)
+    pending = [(qid, query) for qid, query in read_queries(input_path, query_field, id_field) if qid not in done]
+    print(f"{len(done)} already done, {len(pending)} to search")
+
+    service = AsyncLLMService(max_concurrency=concurrency)
+    queue: asyncio.Queue = asyncio.Queue()
+    for item in pending:
+        queue.put_nowait(item)
+    counts = {"ok": 0, "fallback": 0}
+    start = time.perf_counter()
+
+    # Bulk searches yield to interactive ones for rate-limit quota; shed searches come back as
+    # fallbacks, which are not checkpointed, so a later run retries them
+    with open(output_path, "a") as out, priority(BACKGROUND):
+        async def worker():
+            while not queue.empty():
+                qid, query = queue.get_nowait()
+                query_start = time.perf_counter()
+                response = await service.process_search_query(query)
+                fallback = is_fallback_response(response)
+                if not fallback:
+                    out.write(json.dumps({
+                        "id": qid,
+                        "query": query,
+                        "elapsed_ms": round((time.perf_counter() - query_start) * 1000),
+                        "response": response.model_dump(mode="json"),
+                    }) + "\n")
+                    out.flush()
+                counts["fallback" if fallback else "ok"] += 1
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+        finally:
+            await service.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"Searched {len(pending)} queries in {elapsed:.1f}s: {counts['ok']} ok, {counts['fallback']} fallbacks (not checkpointed)")
+
+def prepare_batch(input_path: str, output_path: str, query_field: str, id_field: str, model: str) -> None:
+    """Write one Batch API chat completion request per query"""
+    response_format = type_to_response_format_param(CombinedSearchResponse)
+    count = 0
+    with open(output_path, "w") as out:
+        for qid, query in read_queries(input_path, query_field, id_field):
+            out.write(json.dumps({
+                "custom_id": qid,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": model,
+                    "messages": combined_messages(query),
+                    "response_format": response_format,
+                    "temperature": 0.4,
+                },
+            }) + "\n")
+            count += 1
+    print(f"Wrote {count} batch requests to {output_path}")
+    print("Upload it with purpose 'batch' and create a batch for the /v1/chat/completions endpoint")
+
+def import_batch(batch_output_path: str, input_path: str, output_path: str, query_field: str, id_field: str) -> None:
+    """Validate Batch API results into SearchResponse lines and warm the caches"""
+    queries = dict(read_queries(input_path, query_field, id_field))
+    caches = [cache for cache in (ResponseCache.from_env(), SemanticCache.from_env()) if cache]
+    done = completed_ids(output_path)
+    ok, failed = 0, 0
+    with open(batch_output_path) as f, open(output_path, "a") as out:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            qid = record["custom_id"]
+            if qid in done:
+                continue
+            try:
+                body = record["response"]["body"]
+                content = body["choices"][0]["message"]["content"]
+                response = normalize_combined_response(parse_search_response(content))
+            except Exception as e:
+                print(f"Skipping {qid}: {str(e)}")
+                failed += 1
+                continue
+            query = queries.get(qid, "")
+            if query and not is_fallback_response(response):
+                for cache in caches:
+                    cache.set(query, response)
+            out.write(json.dumps({"id": qid, "query": query, "response": response.model_dump(mode="json")}) + "\n")
+            ok += 1
+    print(f"Imported {ok} responses, skipped {failed}")
+
+def main():
+    fields = argparse.ArgumentParser(add_help=False)
+    fields.add_argument("--query-field", default="query", help="JSON field holding the query text")
+    fields.add_argument("--id-field", default="id", help="JSON field holding a stable query id (defaults to line number)")
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run = subparsers.add_parser("run", parents=[fields])
+    run.add_argument("input")
+    run.add_argument("output")
+    run.add_argument("--concurrency", type=int, default=8)
+
+    prepare = subparsers.add_parser("prepare-batch", parents=[fields])
+    prepare.add_argument("input")
+    prepare.add_argument("output")
+    prepare.add_argument("--model", default=LLM_MODEL)
+
+    imported = subparsers.add_parser("import-batch", parents=[fields])
+    imported.add_argument("batch_output", help="Output file downloaded from the Batch API")
+    imported.add_argument("input", help="The query file the batch was prepared from")
+    imported.add_argument("output")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        asyncio.run(run_batch(args.input, args.output, args.concurrency, args.query_field, args.id_field))
+    elif args.command == "prepare-batch":
+        prepare_batch(args.input, args.output, args.query_field, args.id_field, args.model)
+    else:
+        import_batch(args.batch_output, args.input, args.output, args.query_field, args.id_field)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+from tracing import percentile
+
+class MicroBatcher:
+    """Collects items submitted within a short window and processes them in one call.
+
+    The first item of a batch opens a window of ``window_ms``; the batch is sent
+    when the window closes or ``max_batch`` items are waiting, whichever comes
+    first. ``process`` receives the items and returns one result per item, which
+    is handed back through each caller's future. If ``process`` raises, every
+    future of the batch gets the exception, whatever its type. ``close`` sends
+    what is waiting and stops the batcher's threads. Each item carries its submitter's
+    context, and the batch runs in the context of its most urgent item (the
+    lowest priority level), so an interactive query is never sent, or shed, as
+    background work because it shares a batch with a bulk job.
+    """
+
+    def __init__(self, process: Callable[[list], list], window_ms: float = 30.0, max_batch: int = 16,
+                 max_in_flight: int = 4, name: str = "micro-batch"):
+        self.process = process
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.batches = 0
+        self.items = 0
+        self.failures = 0
+        # Seconds each item waited for its batch to be sent, and seconds per batch call
+        self.waits: deque[float] = deque(maxlen=1000)
+        self.call_latencies: deque[float] = deque(maxlen=1000)
+        self.sizes: deque[int] = deque(maxlen=1000)
+        self._pending: list[tuple[object, Future, float, contextvars.Context]] = []
+        self._condition = threading.Condition()
+        self._lock = threading.Lock()
+        self._closed = False
+        # Batches are sent from a pool so the next window fills while one is in flight
+        self._pool = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix=name)
+        self._collector = threading.Thread(target=self._collect, name=name, daemon=True)
+        self._collector.start()
+
+    @classmethod
+    def from_env(cls, process: Callable[[list], list], prefix: str = "ANALYZE_BATCH") -> Optional["MicroBatcher"]:
+        """Build a batcher from <prefix>_WINDOW_MS and <prefix>_MAX_SIZE; None while the window is 0 (the default)"""
+        window_ms = float(os.getenv(f"{prefix}_WINDOW_MS", 0))
+        if window_ms <= 0:
+            return None
+        return cls(process, window_ms=window_ms, max_batch=int(os.getenv(f"{prefix}_MAX_SIZE", 16)))
+
+    def submit(self, item) -> Future:
+        """Queue an item for the next batch; the future resolves to its result"""
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("MicroBatcher is closed")
+            self._pending.append((item, future, time.perf_counter(), contextvars.copy_context()))
+            self._condition.notify()
+        return future
+
+    def close(self) -> None:
+        """Send the items still waiting without waiting out their window, then stop the threads"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._collector.join()
+        self._pool.shutdown(wait=True)
+
+    def _collect(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                deadline = self._pending[0][2] + self.window
+                while len(self._pending) < self.max_batch and not self._closed:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+            self._pool.submit(self._run, batch)
+
+    def _run(self, batch: list[tuple[object, Future, float, contextvars.Context]]) -> None:
+        from rate_limit import current_priority
+        context = min((context for _, _, _, context in batch), key=lambda context: context.run(current_priority))
+        start = time.perf_counter()
+        results, error = None, None
+        try:
+            results = context.copy().run(self.process, [item for item, _, _, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"Batch of {len(batch)} returned {len(results)} results")
+        except BaseException as e:
+            error = e
+            with self._lock:
+                self.failures += 1
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            with self._lock:
+                self.batches += 1
+                self.items += len(batch)
+                self.sizes.append(len(batch))
+                self.call_latencies.append(time.perf_counter() - start)
+                self.waits.extend(start - queued for _, _, queued, _ in batch)
+            # Resolved here so that no caller is left waiting, even when process() raised SystemExit
+            for index, (_, future, _, _) in enumerate(batch):
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(results[index])
+
+    def stats(self) -> dict:
+        """Batch sizes, the wait added by the window and the latency of batch calls"""
+        with self._lock:
+            waits, calls, sizes = list(self.waits), list(self.call_latencies), list(self.sizes)
+            batches, items, failures = self.batches, self.items, self.failures
+        return {
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch,
+            "batches": batches,
+            "items": items,
+            "failures": failures,
+            "mean_batch_size": sum(sizes) / len(sizes) if sizes else 0.0,
+            "requests_saved": items - batches,
+            "wait_p50_ms": percentile(waits, 0.5) * 1000,
+            "wait_p95_ms": percentile(waits, 0.95) * 1000,
+            "call_p50_ms": percentile(calls, 0.5) * 1000,
+            "call_p95_ms": percentile(calls, 0.95) * 1000,
+        }
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Latency and throughput benchmark for the search pipeline.
+
+Drives process_search_query and each stage on its own (analyze_query,
+generate_book_recommendation, generate_content_cards, and JSON parsing plus
+pydantic validation) at a fixed concurrency. Reports p50/p95/p99 latency,
+throughput, tokens per request and cache hit rates. The default backend is the
+in-process mock server (see mock_llm_server.py), so runs are free and
+repeatable.
+
+  python benchmark.py --concurrency 8 --requests 200 --output bench.json
+  python benchmark.py --output new.json --compare bench.json   # exit 1 on regressions
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+from tracing import percentile
+
+DEFAULT_QUERIES = [
+    "How to deal with difficult colleagues",
+    "London autistic detective",
+    "Books about flow state",
+    "What is the book Atomic Habits about?",
+    "Like Harry Potter but for adults",
+    "books on confidence",
+    "that quote about the cave and the shadows",
+    "a story where a boy lives in a cupboard under the stairs",
+    "podcasts about building habits",
+    "feeling lost after graduating",
+]
+
+STAGES = ["pipeline", "analyze", "recommend", "cards", "parse"]
+
+def read_query_file(path: str) -> list[str]:
+    """Queries from a JSONL file of {"query": ...} objects or plain text lines"""
+    queries = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                record = line
+            queries.append(record["query"] if isinstance(record, dict) else str(record))
+    return queries
+
+def summarize(latencies: list[float], fallbacks: int, elapsed: float, tokens: Optional[dict] = None) -> dict:
+    """Latency percentiles in milliseconds, throughput and token usage of one stage"""
+    count = len(latencies)
+    result = {
+        "count": count,
+        "fallbacks": fallbacks,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "mean_ms": sum(latencies) / count * 1000 if count else 0.0,
+        "throughput_rps": count / elapsed if elapsed else 0.0,
+    }
+    if tokens is not None and count:
+        result["prompt_tokens_per_request"] = tokens["prompt_tokens"] / count
+        result["completion_tokens_per_request"] = tokens["completion_tokens"] / count
+    return result
+
+def token_counter() -> Callable[[], Optional[dict]]:
+    """Snapshot of tokens served by the mock backend, or None for real backends"""
+    from llm_backend import get_backend, get_mock_server
+    if get_backend() != "mock":
+        return lambda: None
+    server = get_mock_server()
+    return lambda: {"prompt_tokens": server.prompt_tokens, "completion_tokens": server.completion_tokens}
+
+def run_stage(call: Callable[[str], bool], queries: list[str], requests: int, concurrency: int,
+              tokens: Callable[[], Optional[dict]]) -> dict:
+    """Run ``requests`` calls cycling through the queries; ``call`` returns True for a fallback"""
+    def timed(query: str) -> tuple[float, bool]:
+        start = time.perf_counter()
+        fallback = call(query)
+        return time.perf_counter() - start, fallback
+
+    before = tokens()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, (queries[i % len(queries)] for i in range(requests))))
+    elapsed = time.perf_counter() - start
+    after = tokens()
+    used = {key: after[key] - before[key] for key in after} if after is not None else None
+    return summarize([latency for latency, _ in results], sum(fallback for _, fallback in results), elapsed, used)
+
+def parse_payloads(queries: list[str]) -> list[tuple[str, str]]:
+    """Representative raw model outputs for each response kind, synthesized like the mock backend"""
+    from llm_service import analysis_messages, combined_messages, card_messages
+    from intent_classifier import classify_by_rules
+    from mock_llm_server import synthesize_content
+    from models import UserIntentCategory
+
+    payloads = []
+    for query in queries:
+        category = classify_by_rules(query).user_intent_category or UserIntentCategory.EXPLORATION_DISCOVERY
+        payloads.append(("analysis", synthesize_content(analysis_messages(query))))
+        payloads.append(("cards", "```json\n" + synthesize_content(card_messages(query, category, [])) + "\n```"))
+        payloads.append(("combined", synthesize_content(combined_messages(query))))
+    return payloads
+
+def run_parse_stage(queries: list[str], iterations: int) -> dict:
+    """Time JSON extraction and model validation without any network"""
+    from response_parser import PARSERS as parsers
+
+    payloads = parse_payloads(queries)
+    latencies = []
+    start = time.perf_counter()
+    for i in range(iterations):
+        kind, text = payloads[i % len(payloads)]
+        parse_start = time.perf_counter()
+        parsers[kind](text)
+        latencies.append(time.perf_counter() - parse_start)
+    return summarize(latencies, 0, time.perf_counter() - start)
+
+def cache_stats(service) -> dict:
+    from llm_backend import get_backend, get_mock_server
+
+    stats = {}
+    if service.cache:
+        stats["response_cache"] = service.cache.stats()
+    if service.semantic_cache:
+        stats["semantic_cache"] = service.semantic_cache.stats()
+    if service.local_classifier:
+        stats["local_classifier"] = service.local_classifier.stats()
+    if service.speculative:
+        stats["speculation"] = service.speculation.as_dict()
+        if get_backend() == "mock" and not get_mock_server().independent_labels:
+            # The mock labels with the same rules speculation guesses with, so every guess would hit
+            stats["speculation"]["hit_rate"] = None
+    if service.lexical_index:
+        stats["lexical_index"] = service.lexical_index.stats()
+    if service.passage_index:
+        stats["passage_index"] = service.passage_index.stats()
+    if service.batcher:
+        stats["analysis_batching"] = service.batcher.stats()
+    stats["routing"] = service.router.stats()
+    stats["upstream"] = service.guard.stats()
+    return stats
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Latency percentiles that got slower than the baseline by more than ``tolerance``"""
+    regressions = []
+    for stage, current in results["stages"].items():
+        previous = baseline.get("stages", {}).get(stage)
+        if not previous:
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            old, new = previous[metric], current[metric]
+            change = (new - old) / old if old else 0.0
+            print(f"  {stage:<10} {metric:<7} {old:10.3f} -> {new:10.3f} ms ({change:+.1%})")
+            if change > tolerance:
+                regressions.append(f"{stage} {metric} {change:+.1%}")
+    return regressions
+
+def print_results(results: dict) -> None:
+    print(f"{'stage':<10} {'count':>6} {'fallbk':>6} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'req/s':>9} {'tok/req':>8}")
+    for stage, row in results["stages"].items():
+        tokens = row.get("prompt_tokens_per_request", 0) + row.get("completion_tokens_per_request", 0)
+        print(f"{stage:<10} {row['count']:>6} {row['fallbacks']:>6} {row['p50_ms']:>10.3f} {row['p95_ms']:>10.3f} "
+              f"{row['p99_ms']:>10.3f} {row['throughput_rps']:>9.1f} {tokens:>8.0f}")
+    for name, stats in results["caches"].items():
+        if name == "routing":
+            for route, row in stats["routes"].items():
+                print(f"route {route}: {row['calls']} calls, p50 {row['p50_ms']:.0f} ms, "
+                      f"{row['escalations']} escalations, ${row['cost_usd']:.4f}")
+            print(f"total cost: ${stats['total_cost_usd']:.4f}")
+        else:
+            print(f"{name}: {json.dumps(stats)}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", help="JSONL or text file of queries (defaults to a built-in set)")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per network stage")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"Comma-separated subset of {STAGES}")
+    parser.add_argument("--backend", choices=["mock", "compatible", "openai"], default="mock")
+    parser.add_argument("--latency-ms", type=float, default=400.0, help="Mock median latency")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Mock log-normal latency spread")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Mock share of 500 responses")
+    parser.add_argument("--recordings", help="Mock recordings file to replay")
+    parser.add_argument("--label-noise", type=float, default=0.2, help="Mock share of analyses disagreeing with the keyword rules")
+    parser.add_argument("--batch-window-ms", type=float, default=0.0, help="Micro-batch analyses arriving within this window (0 = off)")
+    parser.add_argument("--batch-size", type=int, default=16, help="Largest micro-batch")
+    parser.add_argument("--cache", action="store_true", help="Enable an in-memory response cache for the pipeline stage")
+    parser.add_argument("--parse-iterations", type=int, default=5000)
+    parser.add_argument("--output", help="Write results as JSON")
+    parser.add_argument("--compare", help="Baseline results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed slowdown before a percentile counts as a regression")
+    args = parser.parse_args()
+
+    # Backend configuration must be in place before the service creates its clients
+    os.environ["LLM_BACKEND"] = args.backend
+    os.environ["MOCK_LLM_LATENCY_MS"] = str(args.latency_ms)
+    os.environ["MOCK_LLM_LATENCY_SIGMA"] = str(args.latency_sigma)
+    os.environ["MOCK_LLM_ERROR_RATE"] = str(args.error_rate)
+    os.environ["MOCK_LLM_LABEL_NOISE"] = str(args.label_noise)
+    if args.recordings:
+        os.environ["MOCK_LLM_RECORDINGS"] = args.recordings
+    os.environ["LLM_MAX_CONCURRENCY"] = str(args.concurrency)
+    os.environ["ANALYZE_BATCH_WINDOW_MS"] = str(args.batch_window_ms)
+    os.environ["ANALYZE_BATCH_MAX_SIZE"] = str(args.batch_size)
+
+    from cache import ResponseCache
+    from intent_classifier import classify_by_rules
+    from llm_backend import LLM_MODEL
+    from llm_service import LLMService, is_fallback_response
+    from models import UserIntentCategory
+
+    queries = read_query_file(args.queries) if args.queries else DEFAULT_QUERIES
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Unknown stages: {sorted(unknown)}")
+
+    # Never touch the on-disk cache; the pipeline runs cold unless --cache is given
+    service = LLMService(cache=ResponseCache(":memory:") if args.cache else None, use_cache=args.cache)
+    tokens = token_counter()
+
+    def category_of(query: str) -> UserIntentCategory:
+        return classify_by_rules(query).user_intent_category or UserIntentCategory.EXPLORATION_DISCOVERY
+
+    calls = {
+        "pipeline": lambda q: is_fallback_response(service.process_search_query(q)),
+        "analyze": lambda q: service.analyze_query(q).reasoning.startswith("Error in analysis"),
+        "recommend": lambda q: service.generate_book_recommendation(q).author == "System",
+        "cards": lambda q: any(card.title == "Content Discovery" for card in service.generate_content_cards(q, category_of(q))),
+    }
+
+    results = {
+        "timestamp": time.time(),
+        "revision": git_revision(),
+        "config": {
+            "backend": args.backend,
+            "model": LLM_MODEL,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "queries": len(queries),
+            "cache": args.cache,
+            "batch_window_ms": args.batch_window_ms,
+            "startup_ms": service.startup_seconds * 1000,
+            "mock_latency_ms": args.latency_ms if args.backend == "mock" else None,
+            "mock_error_rate": args.error_rate if args.backend == "mock" else None,
+            "mock_label_noise": args.label_noise if args.backend == "mock" else None,
+        },
+        "stages": {},
+        "caches": {},
+    }
+    for stage in stages:
+        print(f"Running {stage}...")
+        if stage == "parse":
+            results["stages"][stage] = run_parse_stage(queries, args.parse_iterations)
+        else:
+            results["stages"][stage] = run_stage(calls[stage], queries, args.requests, args.concurrency, tokens)
+    results["caches"] = cache_stats(service)
+    service.close()
+
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"Compared with {args.compare} (revision {baseline.get('revision')}):")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("Regressions: " + ", ".join(regressions))
+            raise SystemExit(1)
+        print("No regressions")
+
+if __name__ == "__main__":
+    main()
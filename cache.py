@@ -0,0 +1,264 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+import numpy as np
+from models import SearchResponse, QueryType, UserIntentCategory
+from vector_index import EmbeddingFunction, get_embedder, normalize_rows
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a query so case, whitespace and punctuation variants share a cache key"""
+    text = _PUNCTUATION.sub(" ", query.casefold())
+    return " ".join(text.split())
+
+
+class ResponseCache:
+    """SQLite-backed cache of full SearchResponse objects keyed by normalized query.
+
+    Entries expire after ``ttl_seconds`` and the table is trimmed to ``max_entries``
+    by evicting the least recently used rows. The database file is shared by every
+    session and survives Streamlit restarts.
+    """
+
+    def __init__(self, path: str = "search_cache.sqlite3", ttl_seconds: float = 24 * 3600, max_entries: int = 5000):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                query TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._conn.commit()
+
+    @classmethod
+    def from_env(cls) -> Optional["ResponseCache"]:
+        """Build a cache from SEARCH_CACHE_* environment variables, or None if disabled"""
+        if os.getenv("SEARCH_CACHE_ENABLED", "1").lower() in ("0", "false", "no"):
+            return None
+        return cls(
+            path=os.getenv("SEARCH_CACHE_PATH", "search_cache.sqlite3"),
+            ttl_seconds=float(os.getenv("SEARCH_CACHE_TTL_SECONDS", 24 * 3600)),
+            max_entries=int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", 5000)),
+        )
+
+    def get(self, query: str) -> Optional[SearchResponse]:
+        """Return the cached response for a query, or None on a miss or expired entry"""
+        key = normalize_query(query)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return SearchResponse.model_validate_json(row[0])
+
+    def set(self, query: str, response: SearchResponse) -> None:
+        """Store a response and evict expired and least recently used entries"""
+        key = normalize_query(query)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, query, response, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, query, response.model_dump_json(), now, now)
+            )
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+            self._conn.execute("""
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+            self._conn.commit()
+
+    def clear(self) -> None:
+        """Remove every cached entry and reset the counters"""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and the current number of stored entries"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+        }
+
+
+# Memory-style intents need near-identical wording; advice-style intents tolerate paraphrase
+DEFAULT_SEMANTIC_THRESHOLDS = {
+    QueryType.SPECIFIC_BOOK.value: 0.95,
+    UserIntentCategory.QUOTE_CONCEPT_MEMORY.value: 0.95,
+    UserIntentCategory.PLOT_FRAGMENT_MEMORY.value: 0.95,
+    UserIntentCategory.CHARACTER_SCENE_DESCRIPTION.value: 0.93,
+    UserIntentCategory.COMPARATIVE_SEARCH.value: 0.93,
+    UserIntentCategory.PROBLEM_SOLVING.value: 0.88,
+    UserIntentCategory.EXPLORATION_DISCOVERY.value: 0.88,
+    UserIntentCategory.EMOTIONAL_THEME.value: 0.88,
+}
+
+
+def _threshold_key(response: SearchResponse) -> str:
+    if response.analysis.query_type == QueryType.SPECIFIC_BOOK or response.analysis.user_intent_category is None:
+        return response.analysis.query_type.value
+    return response.analysis.user_intent_category.value
+
+
+class SemanticCache:
+    """In-memory nearest-neighbour cache of SearchResponses keyed by query embeddings.
+
+    A lookup serves the stored response of the most similar previous query when
+    the similarity reaches the threshold of that response's intent category.
+    Storing a query again replaces its entry. Entries expire after ``ttl_seconds``
+    and the least recently used entry is evicted once ``max_entries`` is reached.
+    """
+
+    def __init__(self, embedder: EmbeddingFunction, default_threshold: float = 0.9,
+                 category_thresholds: Optional[dict[str, float]] = None,
+                 ttl_seconds: float = 6 * 3600, max_entries: int = 2000):
+        self.embedder = embedder
+        self.default_threshold = default_threshold
+        self.category_thresholds = {**DEFAULT_SEMANTIC_THRESHOLDS, **(category_thresholds or {})}
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._matrix: Optional[np.ndarray] = None
+        self._occupied = np.zeros(max_entries, dtype=bool)
+        self._created = np.zeros(max_entries)
+        self._last_access = np.zeros(max_entries)
+        self._entries: list[Optional[tuple[str, SearchResponse]]] = [None] * max_entries
+        # Slot of each stored normalized query
+        self._slots: dict[str, int] = {}
+        # Embeddings from recent misses, reused when the response is stored
+        self._recent_vectors: "OrderedDict[str, np.ndarray]" = OrderedDict()
+
+    @classmethod
+    def from_env(cls) -> Optional["SemanticCache"]:
+        """Build a cache from SEMANTIC_CACHE_* environment variables, or None if disabled"""
+        if os.getenv("SEMANTIC_CACHE_ENABLED", "0").lower() not in ("1", "true", "yes"):
+            return None
+        overrides = {}
+        for pair in filter(None, os.getenv("SEMANTIC_CACHE_THRESHOLDS", "").split(",")):
+            category, value = pair.split("=")
+            overrides[category.strip()] = float(value)
+        return cls(
+            get_embedder(os.getenv("SEMANTIC_CACHE_EMBEDDER", "openai-text-embedding-3-small")),
+            default_threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.9)),
+            category_thresholds=overrides,
+            ttl_seconds=float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", 6 * 3600)),
+            max_entries=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 2000)),
+        )
+
+    def _embed(self, query: str) -> np.ndarray:
+        key = normalize_query(query)
+        with self._lock:
+            vector = self._recent_vectors.pop(key, None)
+        if vector is None:
+            vector = normalize_rows(self.embedder([query]))[0]
+        with self._lock:
+            self._recent_vectors[key] = vector
+            if len(self._recent_vectors) > 256:
+                self._recent_vectors.popitem(last=False)
+        return vector
+
+    def _expire(self, now: float) -> None:
+        self._occupied &= (now - self._created) <= self.ttl_seconds
+
+    def threshold_for(self, response: SearchResponse) -> float:
+        return self.category_thresholds.get(_threshold_key(response), self.default_threshold)
+
+    def get(self, query: str) -> Optional[SearchResponse]:
+        """Return the response of the nearest previous query if it is similar enough"""
+        try:
+            vector = self._embed(query)
+        except Exception as e:
+            print(f"Error embedding query for semantic cache: {str(e)}")
+            with self._lock:
+                self.misses += 1
+            return None
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if self._matrix is None or not self._occupied.any():
+                self.misses += 1
+                return None
+            scores = np.where(self._occupied, self._matrix @ vector, -np.inf)
+            slot = int(np.argmax(scores))
+            _, response = self._entries[slot]
+            if scores[slot] < self.threshold_for(response):
+                self.misses += 1
+                return None
+            self._last_access[slot] = now
+            self.hits += 1
+            return response
+
+    def set(self, query: str, response: SearchResponse) -> None:
+        """Store a response, evicting expired and least recently used entries as needed"""
+        try:
+            vector = self._embed(query)
+        except Exception as e:
+            print(f"Error embedding query for semantic cache: {str(e)}")
+            return
+        now = time.time()
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+            self._expire(now)
+            key = normalize_query(query)
+            slot = self._slots.get(key)
+            if slot is None or not self._occupied[slot]:
+                free = np.flatnonzero(~self._occupied)
+                slot = int(free[0]) if len(free) else int(np.argmin(self._last_access))
+            if self._entries[slot] is not None:
+                self._slots.pop(normalize_query(self._entries[slot][0]), None)
+            self._slots[key] = slot
+            self._matrix[slot] = vector
+            self._entries[slot] = (query, response)
+            self._occupied[slot] = True
+            self._created[slot] = now
+            self._last_access[slot] = now
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._expire(time.time())
+            hits, misses, entries = self.hits, self.misses, int(self._occupied.sum())
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "entries": entries,
+        }
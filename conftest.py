@@ -0,0 +1,14 @@
+import pytest
+
+@pytest.fixture(autouse=True)
+def mock_backend(monkeypatch, tmp_path):
+    """Run every test against the in-process mock backend, without on-disk caches, indexes or models"""
+    monkeypatch.setenv("LLM_BACKEND", "mock")
+    monkeypatch.setenv("MOCK_LLM_LATENCY_MS", "5")
+    monkeypatch.setenv("SEARCH_CACHE_ENABLED", "0")
+    monkeypatch.setenv("SEMANTIC_CACHE_ENABLED", "0")
+    for name in ("VECTOR_INDEX_PATH", "PASSAGE_INDEX_PATH", "INTENT_MODEL_PATH", "LEXICAL_CATALOG_PATH"):
+        monkeypatch.setenv(name, str(tmp_path / "missing" / name.lower()))
+    for name in ("CLASSIFICATION_LOG_PATH", "SEARCH_SPECULATIVE", "SEARCH_COMBINED", "ANALYZE_BATCH_WINDOW_MS",
+                 "LLM_ROUTING", "TRACE_SINKS", "MOCK_LLM_RECORDINGS"):
+        monkeypatch.delenv(name, raising=False)
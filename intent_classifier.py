@@ -0,0 +1,378 @@
+import argparse
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from typing import Optional
+from models import QueryAnalysis, QueryType, UserIntentCategory
+
+SPECIFIC_BOOK_LABEL = QueryType.SPECIFIC_BOOK.value
+
+# Ordered (pattern, category) rules; the first match wins
+_SPECIFIC_BOOK_PATTERNS = [
+    re.compile(r"\bwhat(?:'s| is)(?: the)? (?:book|novel|podcast)\b.+\babout\b"),
+    re.compile(r"\b(?:summary|summarize|review) of\b"),
+    re.compile(r"^(?:who wrote|tell me about (?:the )?(?:book|novel))\b"),
+]
+
+_INTENT_PATTERNS = [
+    (re.compile(r"\b(?:like|similar to)\b.+\bbut\b|\bsimilar to\b|\bstyle but\b|\bif i liked\b"), UserIntentCategory.COMPARATIVE_SEARCH),
+    (re.compile(r"(?:^|\s)[\"'‘“][^\"'’”]+[\"'’”](?:\s|$|[?.!,])|\bquote\b|\bwhere does\b.+\bcome from\b|\bconcept of\b"), UserIntentCategory.QUOTE_CONCEPT_MEMORY),
+    (re.compile(r"\b(?:book|novel|story|movie) (?:with|where|about a)\b|\bwhere (?:everyone|a|the)\b"), UserIntentCategory.PLOT_FRAGMENT_MEMORY),
+    (re.compile(r"\b(?:make me (?:cry|laugh|feel)|cathartic|vibes|heartbreak|after (?:a )?(?:divorce|breakup|loss)|lonely|grief|comfort)\b"), UserIntentCategory.EMOTIONAL_THEME),
+    (re.compile(r"\b(?:detective|assassin|protagonist|character|hero|heroine|villain|wizard|school for)\b"), UserIntentCategory.CHARACTER_SCENE_DESCRIPTION),
+    (re.compile(r"\b(?:how to|how do i|dealing with|deal with|overcome|overcoming|cope|coping|fix|improve|stop)\b"), UserIntentCategory.PROBLEM_SOLVING),
+]
+
+def classify_by_rules(user_query: str) -> QueryAnalysis:
+    """Cheap keyword/regex guess at the query shape.
+
+    Confidence is high only when a rule fires; unmatched queries fall through to
+    a low-confidence EXPLORATION_DISCOVERY guess.
+    """
+    text = user_query.casefold().strip()
+    for pattern in _SPECIFIC_BOOK_PATTERNS:
+        if pattern.search(text):
+            return QueryAnalysis(
+                query_type=QueryType.SPECIFIC_BOOK,
+                user_intent_category=None,
+                confidence_score=0.9,
+                reasoning=f"Rule match: {pattern.pattern}"
+            )
+    for pattern, category in _INTENT_PATTERNS:
+        if pattern.search(text):
+            return QueryAnalysis(
+                query_type=QueryType.GENERAL,
+                user_intent_category=category,
+                confidence_score=0.8,
+                reasoning=f"Rule match: {pattern.pattern}"
+            )
+    return QueryAnalysis(
+        query_type=QueryType.GENERAL,
+        user_intent_category=UserIntentCategory.EXPLORATION_DISCOVERY,
+        confidence_score=0.3,
+        reasoning="No rule matched"
+    )
+
+def label_of(analysis: QueryAnalysis) -> str:
+    """Collapse an analysis to a single class label"""
+    if analysis.query_type == QueryType.SPECIFIC_BOOK:
+        return SPECIFIC_BOOK_LABEL
+    return (analysis.user_intent_category or UserIntentCategory.EXPLORATION_DISCOVERY).value
+
+def analysis_from_label(label: str, confidence: float, reasoning: str) -> QueryAnalysis:
+    """Expand a class label back into a QueryAnalysis"""
+    if label == SPECIFIC_BOOK_LABEL:
+        return QueryAnalysis(query_type=QueryType.SPECIFIC_BOOK, confidence_score=confidence, reasoning=reasoning)
+    return QueryAnalysis(
+        query_type=QueryType.GENERAL,
+        user_intent_category=UserIntentCategory(label),
+        confidence_score=confidence,
+        reasoning=reasoning
+    )
+
+_TOKEN = re.compile(r"[a-z0-9']+")
+
+def _terms(text: str) -> list[str]:
+    """Word unigrams and bigrams of a query"""
+    tokens = _TOKEN.findall(text.casefold())
+    return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+class TfidfLinearModel:
+    """TF-IDF features with a multinomial logistic regression, stored as plain JSON"""
+
+    def __init__(self, labels: list[str], vocabulary: dict[str, int], idf: list[float],
+                 weights: list[list[float]], bias: list[float]):
+        self.labels = labels
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.weights = weights
+        self.bias = bias
+
+    def vectorize(self, text: str) -> dict[int, float]:
+        """Sparse, L2-normalized TF-IDF vector of a query"""
+        counts = Counter(self.vocabulary[t] for t in _terms(text) if t in self.vocabulary)
+        vector = {i: c * self.idf[i] for i, c in counts.items()}
+        norm = math.sqrt(sum(v * v for v in vector.values())) or 1.0
+        return {i: v / norm for i, v in vector.items()}
+
+    def _scores(self, vector: dict[int, float]) -> list[float]:
+        return [b + sum(w[i] * v for i, v in vector.items()) for w, b in zip(self.weights, self.bias)]
+
+    def predict_proba(self, text: str) -> dict[str, float]:
+        """Class probabilities for a query"""
+        scores = self._scores(self.vectorize(text))
+        top = max(scores)
+        exps = [math.exp(s - top) for s in scores]
+        total = sum(exps)
+        return {label: e / total for label, e in zip(self.labels, exps)}
+
+    @classmethod
+    def train(cls, texts: list[str], labels: list[str], epochs: int = 30,
+              learning_rate: float = 0.5, l2: float = 1e-4, seed: int = 0) -> "TfidfLinearModel":
+        """Fit the model with plain SGD on the softmax loss"""
+        label_set = sorted(set(labels))
+        documents = [set(_terms(t)) for t in texts]
+        df = Counter(term for doc in documents for term in doc)
+        vocabulary = {term: i for i, term in enumerate(sorted(df))}
+        idf = [0.0] * len(vocabulary)
+        for term, i in vocabulary.items():
+            idf[i] = math.log((1 + len(texts)) / (1 + df[term])) + 1
+        model = cls(label_set, vocabulary, idf,
+                    [[0.0] * len(vocabulary) for _ in label_set], [0.0] * len(label_set))
+
+        examples = [(model.vectorize(t), label_set.index(l)) for t, l in zip(texts, labels)]
+        rng = random.Random(seed)
+        for epoch in range(epochs):
+            rng.shuffle(examples)
+            rate = learning_rate / (1 + epoch * 0.1)
+            for vector, target in examples:
+                scores = model._scores(vector)
+                top = max(scores)
+                exps = [math.exp(s - top) for s in scores]
+                total = sum(exps)
+                for k, e in enumerate(exps):
+                    gradient = e / total - (1.0 if k == target else 0.0)
+                    row = model.weights[k]
+                    for i, v in vector.items():
+                        row[i] -= rate * (gradient * v + l2 * row[i])
+                    model.bias[k] -= rate * gradient
+        return model
+
+    def save(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump({
+                "labels": self.labels,
+                "vocabulary": self.vocabulary,
+                "idf": self.idf,
+                "weights": self.weights,
+                "bias": self.bias,
+            }, f)
+
+    @classmethod
+    def load(cls, path: str) -> "TfidfLinearModel":
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data["labels"], data["vocabulary"], data["idf"], data["weights"], data["bias"])
+
+class LocalIntentClassifier:
+    """Fast path in front of the LLM classification call.
+
+    Combines the keyword rules with an optional trained TF-IDF model and returns a
+    QueryAnalysis only when its confidence reaches ``threshold``; otherwise the
+    caller falls back to the LLM. Without a trained model every query is deferred:
+    the rules alone are a guess (for speculation and degraded answers), not an
+    answer. So is a query with no term the model has seen, and every query for a
+    model trained on a single label, since their probabilities are the bias prior
+    alone. Counts how much traffic the fast path absorbs.
+    """
+
+    def __init__(self, model: Optional[TfidfLinearModel] = None, threshold: float = 0.85):
+        self.model = model
+        self.threshold = threshold
+        self.absorbed = 0
+        self.deferred = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> Optional["LocalIntentClassifier"]:
+        """Build a classifier from INTENT_* environment variables, or None if disabled"""
+        if os.getenv("INTENT_FAST_PATH_ENABLED", "1").lower() in ("0", "false", "no"):
+            return None
+        path = os.getenv("INTENT_MODEL_PATH", "intent_model.json")
+        model = TfidfLinearModel.load(path) if os.path.exists(path) else None
+        return cls(model, threshold=float(os.getenv("INTENT_FAST_PATH_THRESHOLD", 0.85)))
+
+    def predict(self, user_query: str) -> QueryAnalysis:
+        """Best local guess regardless of confidence"""
+        rule = classify_by_rules(user_query)
+        if not self.knows(user_query):
+            return rule
+        probabilities = self.predict_proba(user_query)
+        label = max(probabilities, key=probabilities.get)
+        confidence = probabilities[label]
+        if label == label_of(rule) and rule.reasoning != "No rule matched":
+            confidence = max(confidence, rule.confidence_score)
+        return analysis_from_label(label, confidence, f"Local classifier ({confidence:.0%})")
+
+    def predict_proba(self, user_query: str) -> dict[str, float]:
+        return self.model.predict_proba(user_query) if self.model else {}
+
+    def knows(self, user_query: str) -> bool:
+        """Whether the model can tell labels apart for this query rather than echo its prior"""
+        return (self.model is not None and len(self.model.labels) >= 2
+                and bool(self.model.vectorize(user_query)))
+
+    def classify(self, user_query: str) -> Optional[QueryAnalysis]:
+        """Return a confident local analysis, or None to defer to the LLM"""
+        analysis = self.predict(user_query)
+        confident = analysis.confidence_score >= self.threshold and self.knows(user_query)
+        with self._lock:
+            if confident:
+                self.absorbed += 1
+            else:
+                self.deferred += 1
+        return analysis if confident else None
+
+    def stats(self) -> dict:
+        total = self.absorbed + self.deferred
+        return {
+            "absorbed": self.absorbed,
+            "deferred": self.deferred,
+            "absorbed_fraction": self.absorbed / total if total else 0.0,
+        }
+
+def log_classification(path: str, user_query: str, analysis: QueryAnalysis) -> None:
+    """Append an LLM classification to a JSONL training log"""
+    record = {"query": user_query, "timestamp": time.time(), **analysis.model_dump(mode="json")}
+    with open(path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+def read_classification_log(path: str, min_confidence: float = 0.7) -> tuple[list[str], list[str]]:
+    """Load (queries, labels) from a classification log, skipping unsure and fallback rows"""
+    texts, labels = [], []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            analysis = QueryAnalysis.model_validate(record)
+            if analysis.confidence_score < min_confidence or analysis.reasoning.startswith("Error in analysis"):
+                continue
+            texts.append(record["query"])
+            labels.append(label_of(analysis))
+    return texts, labels
+
+def split_holdout(texts: list[str], labels: list[str], fraction: float = 0.2,
+                  seed: int = 0) -> tuple[tuple[list[str], list[str]], tuple[list[str], list[str]]]:
+    """Shuffle (texts, labels) into a training split and a held-out split of about ``fraction``.
+
+    Repeated queries stay on one side, so held-out agreement is never measured on
+    a query the model was trained on.
+    """
+    queries = sorted(set(texts))
+    random.Random(seed).shuffle(queries)
+    held_out = set(queries[:round(len(queries) * fraction)])
+    train, test = ([], []), ([], [])
+    for text, label in zip(texts, labels):
+        split = test if text in held_out else train
+        split[0].append(text)
+        split[1].append(label)
+    return train, test
+
+def evaluate(classifier: LocalIntentClassifier, texts: list[str], labels: list[str]) -> dict:
+    """Fast-path absorption and agreement with reference labels over labelled queries"""
+    absorbed, correct, predicted = 0, 0, 0
+    for text, label in zip(texts, labels):
+        predicted += label_of(classifier.predict(text)) == label
+        analysis = classifier.classify(text)
+        if analysis is not None:
+            absorbed += 1
+            correct += label_of(analysis) == label
+    return {
+        "queries": len(texts),
+        "absorbed": absorbed,
+        "absorbed_fraction": absorbed / len(texts) if texts else 0.0,
+        "agreement": predicted / len(texts) if texts else 0.0,
+        "absorbed_agreement": correct / absorbed if absorbed else 0.0,
+    }
+
+def holdout_path(model_path: str) -> str:
+    """Where ``train`` writes the held-out classifications for ``report``"""
+    return os.path.splitext(model_path)[0] + ".holdout.jsonl"
+
+def _read_queries(path: str) -> list[str]:
+    """Read queries from a JSONL file of {"query": ...} objects or plain lines"""
+    queries = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                queries.append(line)
+                continue
+            queries.append(record["query"] if isinstance(record, dict) else str(record))
+    return queries
+
+def main():
+    parser = argparse.ArgumentParser(description="Train and evaluate the local intent classifier")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    train = subparsers.add_parser("train", help="Fit the TF-IDF model on logged LLM classifications")
+    train.add_argument("log", help="JSONL log written via CLASSIFICATION_LOG_PATH")
+    train.add_argument("--model", default=os.getenv("INTENT_MODEL_PATH", "intent_model.json"))
+    train.add_argument("--min-confidence", type=float, default=0.7)
+    train.add_argument("--epochs", type=int, default=30)
+    train.add_argument("--holdout", type=float, default=0.2,
+                       help="Share of queries held out of training to measure agreement on")
+
+    report = subparsers.add_parser("report", help="Report what fraction of queries the fast path absorbs")
+    report.add_argument("queries", nargs="?",
+                        help="JSONL of queries; rows that are classification log entries are also scored "
+                             "(default: the split held out when the model was trained)")
+    report.add_argument("--model", default=os.getenv("INTENT_MODEL_PATH", "intent_model.json"))
+    report.add_argument("--threshold", type=float, default=float(os.getenv("INTENT_FAST_PATH_THRESHOLD", 0.85)))
+
+    args = parser.parse_args()
+
+    if args.command == "train":
+        texts, labels = read_classification_log(args.log, args.min_confidence)
+        if not texts:
+            parser.error(f"No usable classifications in {args.log}")
+        (train_texts, train_labels), (test_texts, test_labels) = split_holdout(texts, labels, args.holdout)
+        if not train_texts:
+            parser.error(f"Nothing left to train on after holding out {args.holdout:.0%}")
+        model = TfidfLinearModel.train(train_texts, train_labels, epochs=args.epochs)
+        model.save(args.model)
+        print(f"Trained on {len(train_texts)} queries across {len(model.labels)} labels -> {args.model}")
+        for label, count in sorted(Counter(train_labels).items()):
+            print(f"  {label}: {count}")
+        if test_texts:
+            with open(holdout_path(args.model), "w") as f:
+                for text, label in zip(test_texts, test_labels):
+                    analysis = analysis_from_label(label, 1.0, "Held out of training")
+                    f.write(json.dumps({"query": text, **analysis.model_dump(mode="json")}) + "\n")
+            result = evaluate(LocalIntentClassifier(model), test_texts, test_labels)
+            print(f"Held out {result['queries']} queries -> {holdout_path(args.model)}")
+            print(f"Held-out agreement: {result['agreement']:.1%}; fast path absorbed "
+                  f"{result['absorbed_fraction']:.1%} at {result['absorbed_agreement']:.1%} agreement")
+        return
+
+    model = TfidfLinearModel.load(args.model) if os.path.exists(args.model) else None
+    classifier = LocalIntentClassifier(model, threshold=args.threshold)
+    queries_path = args.queries or holdout_path(args.model)
+    if not os.path.exists(queries_path):
+        parser.error(f"No queries file given and no held-out split at {queries_path}; run train first")
+    queries = _read_queries(queries_path)
+    try:
+        reference = dict(zip(*read_classification_log(queries_path, min_confidence=0.0)))
+    except (KeyError, ValueError):
+        reference = {}
+
+    absorbed_labels, correct = Counter(), 0
+    start = time.perf_counter()
+    for query in queries:
+        analysis = classifier.classify(query)
+        if analysis is not None:
+            absorbed_labels[label_of(analysis)] += 1
+            correct += reference.get(query) == label_of(analysis)
+    elapsed = time.perf_counter() - start
+
+    stats = classifier.stats()
+    print(f"Model: {args.model if model else 'rules only'} | threshold {args.threshold}")
+    print(f"Fast path absorbed {stats['absorbed']}/{len(queries)} queries ({stats['absorbed_fraction']:.1%})")
+    print(f"Mean local latency: {elapsed / max(len(queries), 1) * 1e6:.0f} µs")
+    for label, count in absorbed_labels.most_common():
+        print(f"  {label}: {count}")
+    if reference and stats["absorbed"]:
+        print(f"Agreement with logged LLM labels on absorbed queries: {correct / stats['absorbed']:.1%}")
+
+if __name__ == "__main__":
+    main()
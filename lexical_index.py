@@ -0,0 +1,218 @@
+import argparse
+import bisect
+import math
+import os
+import re
+import threading
+import time
+from typing import Optional
+from models import BookRecommendation
+from retrieval import recommendation_from_candidate
+from vector_index import read_catalog
+
+_WORD = re.compile(r"[a-z0-9']+")
+
+# Question phrasing around a title; dropped from queries only, so titles made of them still match
+QUERY_STOPWORDS = frozenset("""
+    a an the of and or to in on for by about is are was what whats who which tell me
+    book books novel story called titled named author written wrote summary plot
+""".split())
+
+# Weight of a term matched through a prefix or a typo instead of exactly
+PREFIX_WEIGHT = 0.9
+FUZZY_WEIGHT = 0.7
+
+def _terms(text: str) -> list[str]:
+    return [word.replace("'", "") for word in _WORD.findall(text.casefold())]
+
+def _deletes(term: str) -> set[str]:
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+class LexicalIndex:
+    """In-memory BM25 inverted index over catalog titles and authors.
+
+    Query terms missing from the vocabulary are expanded to the words they
+    prefix (for the last term, which may still be being typed) and to words one
+    edit away (symmetric-delete lookup), at reduced weight. ``match`` returns the
+    top item only when the query covers its title and the title covers the
+    query, so a confident match can be answered without the LLM.
+    """
+
+    def __init__(self, items: list[dict], field_weights: Optional[dict[str, float]] = None,
+                 threshold: float = 0.8, k1: float = 1.2, b: float = 0.75):
+        start = time.perf_counter()
+        self.items = items
+        self.field_weights = field_weights or {"title": 3.0, "author": 2.0}
+        self.threshold = threshold
+        self.k1 = k1
+        self.b = b
+        self.postings: dict[str, list[tuple[int, float]]] = {}
+        self.lengths: list[float] = []
+        self.titles: list[frozenset[str]] = []
+        for doc, item in enumerate(items):
+            frequencies: dict[str, float] = {}
+            for field, weight in self.field_weights.items():
+                for term in _terms(str(item.get(field) or "")):
+                    frequencies[term] = frequencies.get(term, 0.0) + weight
+            self.lengths.append(sum(frequencies.values()))
+            # Function words in a title are not expected in queries ("power habit" names The Power of Habit)
+            title = frozenset(_terms(str(item.get("title") or "")))
+            self.titles.append(title - QUERY_STOPWORDS or title)
+            for term, frequency in frequencies.items():
+                self.postings.setdefault(term, []).append((doc, frequency))
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        count = len(items)
+        self.idf = {term: math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5)) for term, docs in self.postings.items()}
+        self.max_idf = math.log(1 + (count + 0.5) / 0.5)
+        self.vocabulary = sorted(self.postings)
+        self._deleted: dict[str, list[str]] = {}
+        for term in self.vocabulary:
+            if len(term) >= 4:
+                for variant in _deletes(term):
+                    self._deleted.setdefault(variant, []).append(term)
+        self.build_seconds = time.perf_counter() - start
+        self.lookups = 0
+        self.matches = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, vector_index=None) -> Optional["LexicalIndex"]:
+        """Index the vector index's catalog, or LEXICAL_CATALOG_PATH; None when disabled or there is no catalog"""
+        if os.getenv("LEXICAL_INDEX_ENABLED", "1").lower() in ("0", "false", "no"):
+            return None
+        threshold = float(os.getenv("LEXICAL_MATCH_THRESHOLD", 0.8))
+        if vector_index is not None and len(vector_index):
+            return cls(vector_index.items, threshold=threshold)
+        path = os.getenv("LEXICAL_CATALOG_PATH")
+        if path and os.path.exists(path):
+            return cls(read_catalog(path), threshold=threshold)
+        return None
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def _expand(self, term: str, last: bool) -> list[tuple[str, float]]:
+        """Vocabulary terms a query term stands for, with their weights"""
+        if term in self.postings:
+            return [(term, 1.0)]
+        expansions: dict[str, float] = {}
+        if last and len(term) >= 2:
+            position = bisect.bisect_left(self.vocabulary, term)
+            for candidate in self.vocabulary[position:position + 50]:
+                if not candidate.startswith(term):
+                    break
+                expansions[candidate] = PREFIX_WEIGHT
+        if len(term) >= 4:
+            variants = _deletes(term)
+            candidates = set(self._deleted.get(term, ()))
+            for variant in variants:
+                if variant in self.postings:
+                    candidates.add(variant)
+                candidates.update(self._deleted.get(variant, ()))
+            for candidate in candidates:
+                expansions.setdefault(candidate, FUZZY_WEIGHT)
+        return list(expansions.items())
+
+    def _score(self, query: str) -> tuple[dict[int, float], list[dict[int, tuple[str, float]]], list[float]]:
+        """BM25 per document, the best matched term per query term and document, and each query term's idf"""
+        terms = [term for term in _terms(query) if term not in QUERY_STOPWORDS]
+        scores: dict[int, float] = {}
+        matched: list[dict[int, tuple[str, float]]] = []
+        weights: list[float] = []
+        for i, term in enumerate(terms):
+            best: dict[int, tuple[str, float]] = {}
+            best_score: dict[int, float] = {}
+            expansions = self._expand(term, last=i == len(terms) - 1)
+            for candidate, weight in expansions:
+                idf = self.idf[candidate]
+                for doc, frequency in self.postings[candidate]:
+                    norm = self.k1 * (1 - self.b + self.b * self.lengths[doc] / self.average_length)
+                    score = weight * idf * frequency * (self.k1 + 1) / (frequency + norm)
+                    if score > best_score.get(doc, 0.0):
+                        best_score[doc] = score
+                        best[doc] = (candidate, weight)
+            for doc, score in best_score.items():
+                scores[doc] = scores.get(doc, 0.0) + score
+            matched.append(best)
+            weights.append(max((self.idf[candidate] for candidate, _ in expansions), default=self.max_idf))
+        return scores, matched, weights
+
+    def search(self, query: str, k: int = 10) -> list[tuple[dict, float]]:
+        """Top-k catalog items by BM25 score"""
+        scores, _, _ = self._score(query)
+        ranked = sorted(scores.items(), key=lambda pair: pair[1], reverse=True)[:k]
+        return [(self.items[doc], score) for doc, score in ranked]
+
+    def _confidence(self, doc: int, matched: list[dict[int, tuple[str, float]]], weights: list[float]) -> float:
+        """How much of the query the item explains and how much of its title the query names"""
+        total = sum(weights)
+        if not total or not self.titles[doc]:
+            return 0.0
+        covered = sum(weight * match[doc][1] for weight, match in zip(weights, matched) if doc in match)
+        title_terms = {match[doc][0] for match in matched if doc in match}
+        return min(covered / total, len(self.titles[doc] & title_terms) / len(self.titles[doc]))
+
+    def match(self, query: str) -> Optional[tuple[dict, float]]:
+        """The catalog item the query names and the match confidence, or None if unsure"""
+        scores, matched, weights = self._score(query)
+        ranked = sorted(scores, key=scores.get, reverse=True)[:5]
+        result = None
+        if ranked:
+            confidences = sorted(((self._confidence(doc, matched, weights), doc) for doc in ranked), reverse=True)
+            confidence, doc = confidences[0]
+            # Another item that fits as well (same title, different author) makes the answer ambiguous
+            rival = next((c for c, other in confidences[1:] if self._identity(other) != self._identity(doc)), 0.0)
+            if confidence >= self.threshold and rival < confidence - 0.05:
+                result = (self.items[doc], confidence)
+        with self._lock:
+            self.lookups += 1
+            self.matches += result is not None
+        return result
+
+    def _identity(self, doc: int) -> tuple[str, str]:
+        item = self.items[doc]
+        return str(item.get("title", "")).casefold(), str(item.get("author", "")).casefold()
+
+    def stats(self) -> dict:
+        return {
+            "indexed_books": len(self.items),
+            "vocabulary": len(self.vocabulary),
+            "build_ms": self.build_seconds * 1000,
+            "lookups": self.lookups,
+            "matches": self.matches,
+            "match_rate": self.matches / self.lookups if self.lookups else 0.0,
+        }
+
+def recommendation_from_match(item: dict, confidence: float) -> BookRecommendation:
+    """Recommendation for a confident lexical match, explained by the catalog summary"""
+    return recommendation_from_candidate({
+        "catalog_id": item["id"],
+        "reason": item.get("summary") or "Exact catalog match for your query.",
+        "relevance_score": round(confidence, 2),
+    }, [item])
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the lexical title/author index of a catalog")
+    parser.add_argument("query")
+    parser.add_argument("--catalog", default=os.getenv("LEXICAL_CATALOG_PATH"), help="JSONL catalog (title, author, summary, ...)")
+    parser.add_argument("-k", type=int, default=5)
+    args = parser.parse_args()
+    if not args.catalog:
+        parser.error("--catalog or LEXICAL_CATALOG_PATH is required")
+
+    index = LexicalIndex(read_catalog(args.catalog))
+    print(f"Indexed {len(index)} items in {index.build_seconds * 1000:.1f} ms")
+    start = time.perf_counter()
+    results = index.search(args.query, args.k)
+    match = index.match(args.query)
+    elapsed = (time.perf_counter() - start) * 1000
+    for item, score in results:
+        print(f"{score:.3f}  {item.get('title')} — {item.get('author')}")
+    if match:
+        print(f"Confident match: {match[0].get('title')} ({match[1]:.2f})")
+    else:
+        print("No confident match")
+    print(f"({elapsed:.2f} ms)")
+
+if __name__ == "__main__":
+    main()
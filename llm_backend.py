@@ -0,0 +1,61 @@
+import os
+import threading
+from typing import Optional
+import openai
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Model used by every chat completion unless a caller overrides it
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o")
+
+_mock_server = None
+_mock_lock = threading.Lock()
+
+def get_backend() -> str:
+    """Selected backend: "openai", "compatible" (any OpenAI-compatible base URL) or "mock" """
+    return os.getenv("LLM_BACKEND", "openai").lower()
+
+def get_mock_server():
+    """Start the in-process mock server on first use and return it"""
+    global _mock_server
+    with _mock_lock:
+        if _mock_server is None:
+            from mock_llm_server import MockLLMServer
+            _mock_server = MockLLMServer.from_env().start()
+        return _mock_server
+
+def client_kwargs(backend: Optional[str] = None) -> dict:
+    """Keyword arguments for the OpenAI client of a backend"""
+    backend = backend or get_backend()
+    if backend == "openai":
+        return {"api_key": os.getenv("OPENAI_API_KEY")}
+    if backend == "compatible":
+        return {
+            "base_url": os.environ["LLM_BASE_URL"],
+            "api_key": os.getenv("LLM_API_KEY") or os.getenv("OPENAI_API_KEY") or "unused",
+        }
+    if backend == "mock":
+        return {"base_url": get_mock_server().base_url, "api_key": "mock"}
+    raise ValueError(f"Unknown LLM_BACKEND: {backend}")
+
+def create_client(backend: Optional[str] = None, **options) -> openai.OpenAI:
+    """Blocking client for the configured backend; ``options`` go to the client (e.g. max_retries)"""
+    from rate_limit import get_scheduler
+    scheduler = get_scheduler()
+    if scheduler is not None and "http_client" not in options:
+        # Every response's rate-limit headers update the shared scheduler
+        options["http_client"] = openai.DefaultHttpxClient(event_hooks={"response": [scheduler.observe_response]})
+    return openai.OpenAI(**client_kwargs(backend), **options)
+
+def create_async_client(backend: Optional[str] = None, **options) -> openai.AsyncOpenAI:
+    """Async client for the configured backend; ``options`` go to the client (e.g. max_retries)"""
+    from rate_limit import get_scheduler
+    scheduler = get_scheduler()
+    if scheduler is not None and "http_client" not in options:
+        options["http_client"] = openai.DefaultAsyncHttpxClient(event_hooks={"response": [scheduler.aobserve_response]})
+    return openai.AsyncOpenAI(**client_kwargs(backend), **options)
+
+def requires_api_key() -> bool:
+    """Whether the configured backend needs OPENAI_API_KEY"""
+    return get_backend() == "openai"
@@ -1,24 +1,43 @@
 import openai
-import json
 import os
-from typing import Dict, Any
+import textwrap
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional, Union
 from dotenv import load_dotenv
+from openai.types import CompletionUsage
+from openai.types.completion_usage import PromptTokensDetails
 from models import (
-    QueryAnalysis, QueryType, UserIntentCategory, 
-    SearchResponse, BookRecommendation, ContentCard, PlaceholderFeature
+    QueryAnalysis, QueryType, UserIntentCategory,
+    SearchResponse, CombinedSearchResponse, BookRecommendation, ContentCard, PlaceholderFeature
+)
+from cache import ResponseCache, SemanticCache
+from llm_backend import LLM_MODEL, create_client
+from tracing import Span, Tracer, cached_tokens_of, percentile, span, submit_in_context
+from routing import ModelRouter
+from resilience import UpstreamGuard, UpstreamUnavailable
+from response_parser import (
+    JsonArrayStreamParser, parse_query_analysis, parse_recommendation, parse_cards, parse_batch_analysis
+)
+from batching import MicroBatcher
+from rate_limit import estimate_tokens
+from lexical_index import LexicalIndex, recommendation_from_match
+from passage_index import PassageIndex, PASSAGE_INTENTS, cards_from_passages, with_passages
+from intent_classifier import LocalIntentClassifier, classify_by_rules, log_classification
+from vector_index import VectorIndex
+from retrieval import (
+    GROUNDED_RECOMMENDATION_SYSTEM_PROMPT, GROUNDED_CARDS_SYSTEM_PROMPT, retrieve_candidates,
+    format_candidates, card_from_candidate, cards_from_candidates, recommendation_from_candidate
 )
 
 load_dotenv()
 
-class LLMService:
-    def __init__(self):
-        openai.api_key = os.getenv("OPENAI_API_KEY")
-        self.client = openai.OpenAI()
-    
-    def analyze_query(self, user_query: str) -> QueryAnalysis:
-        """Analyze user query to determine type and intent category"""
-        
-        system_prompt = """
+# Prompts are dedented so indentation does not cost tokens. Everything that varies per
+# request goes in the user message after the fixed system prompt, so repeated requests
+# share an identical prefix for provider-side prompt caching.
+ANALYSIS_SYSTEM_PROMPT = textwrap.dedent("""
         You are an expert at analyzing search queries for content (books, podcasts, hosts, articles). Your task is to:
         1. Determine if the query is about a SPECIFIC item or GENERAL
         2. If GENERAL, categorize the user intent into one of these categories:
@@ -29,121 +48,53 @@ class LLMService:
            - character_scene_description: User has strong resonance with characters/worlds
            - emotional_theme: User seeks specific emotional experiences related to current life situation
            - comparative_search: User likes specific aspects of a work and wants similar variants
-        
+
         You MUST respond with valid JSON only. No other text.
         Return a JSON object with:
         - query_type: "specific_book" or "general"
         - user_intent_category: (only if general) one of the categories above
         - confidence_score: float between 0-1
         - reasoning: explanation of your analysis
-        """
-        
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Analyze this query: '{user_query}'"}
-                ],
-                temperature=0.3
-            )
-            
-            response_text = response.choices[0].message.content.strip()
-            
-            # Clean the response to ensure it's valid JSON
-            if response_text.startswith('```json'):
-                response_text = response_text.replace('```json', '').replace('```', '').strip()
-            
-            if not response_text:
-                raise ValueError("Empty response from OpenAI")
-            
-            result = json.loads(response_text)
-            
-            return QueryAnalysis(
-                query_type=QueryType(result["query_type"]),
-                user_intent_category=UserIntentCategory(result["user_intent_category"]) if result.get("user_intent_category") else None,
-                confidence_score=result["confidence_score"],
-                reasoning=result["reasoning"]
-            )
-        except Exception as e:
-            print(f"Error in query analysis: {str(e)}")
-            # Fallback analysis
-            return QueryAnalysis(
-                query_type=QueryType.GENERAL,
-                user_intent_category=UserIntentCategory.EXPLORATION_DISCOVERY,
-                confidence_score=0.5,
-                reasoning=f"Error in analysis: {str(e)}"
-            )
-    
-    def generate_book_recommendation(self, query: str) -> BookRecommendation:
-        """Generate recommendation for specific content queries"""
-        
-        system_prompt = """
+        """).strip()
+
+# Appended to the analysis prompt so batched and single classification share a prefix
+BATCH_ANALYSIS_SYSTEM_PROMPT = ANALYSIS_SYSTEM_PROMPT + "\n\n" + textwrap.dedent("""
+        The user message is a numbered list of search queries, one per line, each starting with its [index].
+        Analyze every query independently. Instead of a single object, return a JSON array with one
+        object per query: the fields above plus "index", the number of the query it answers.
+        """).strip()
+
+RECOMMENDATION_SYSTEM_PROMPT = textwrap.dedent("""
         You are a knowledgeable content curator. The user is asking about specific content (books, podcasts, etc.).
         Provide a recommendation with title, creator, and detailed reasoning.
-        
+
         You MUST respond with valid JSON only. No other text.
         Return JSON with: title, author, reason, relevance_score (0-1)
-        """
-        
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": query}
-                ],
-                temperature=0.4
-            )
-            
-            response_text = response.choices[0].message.content.strip()
-            
-            # Clean the response
-            if response_text.startswith('```json'):
-                response_text = response_text.replace('```json', '').replace('```', '').strip()
-            
-            if not response_text:
-                raise ValueError("Empty response from OpenAI")
-            
-            result = json.loads(response_text)
-            return BookRecommendation(**result)
-        except Exception as e:
-            print(f"Error in recommendation generation: {str(e)}")
-            return BookRecommendation(
-                title="Content Analysis Error",
-                author="System",
-                reason=f"Unable to analyze: {str(e)}",
-                relevance_score=0.0
-            )
-    
-    def generate_content_cards(self, query: str, intent_category: UserIntentCategory) -> list[ContentCard]:
-        """Generate relevant content cards based on query and intent"""
-        
-        category_prompts = {
-            UserIntentCategory.PROBLEM_SOLVING: "Generate practical content recommendations (books, podcasts, articles) that solve real problems",
-            UserIntentCategory.EXPLORATION_DISCOVERY: "Generate content that offers new perspectives and discoveries",
-            UserIntentCategory.QUOTE_CONCEPT_MEMORY: "Generate content cards with memorable quotes and concepts",
-            UserIntentCategory.PLOT_FRAGMENT_MEMORY: "Generate cards focusing on specific story elements and plot points",
-            UserIntentCategory.CHARACTER_SCENE_DESCRIPTION: "Generate cards highlighting character development and vivid scenes",
-            UserIntentCategory.EMOTIONAL_THEME: "Generate emotionally resonant content that matches the user's current state",
-            UserIntentCategory.COMPARATIVE_SEARCH: "Generate recommendations similar to what the user already likes"
-        }
-        
-        system_prompt = f"""
-        You are creating content cards for a search system. 
-        Focus on: {category_prompts.get(intent_category, "general recommendations")}
-        
+        """).strip()
+
+CATEGORY_PROMPTS = {
+    UserIntentCategory.PROBLEM_SOLVING: "Generate practical content recommendations (books, podcasts, articles) that solve real problems",
+    UserIntentCategory.EXPLORATION_DISCOVERY: "Generate content that offers new perspectives and discoveries",
+    UserIntentCategory.QUOTE_CONCEPT_MEMORY: "Generate content cards with memorable quotes and concepts",
+    UserIntentCategory.PLOT_FRAGMENT_MEMORY: "Generate cards focusing on specific story elements and plot points",
+    UserIntentCategory.CHARACTER_SCENE_DESCRIPTION: "Generate cards highlighting character development and vivid scenes",
+    UserIntentCategory.EMOTIONAL_THEME: "Generate emotionally resonant content that matches the user's current state",
+    UserIntentCategory.COMPARATIVE_SEARCH: "Generate recommendations similar to what the user already likes"
+}
+
+CARDS_SYSTEM_PROMPT = textwrap.dedent("""
+        You are creating content cards for a search system.
+        The user message gives the query, its intent category and what to focus on for that category.
+
         CRITICAL: You must decide how many cards (1-5) to generate based on query complexity:
-        
+
         - 1 card: Simple, direct queries with one clear answer (e.g., "What is atomic habits about?")
         - 2 cards: Queries needing two complementary perspectives (e.g., "books on confidence")
         - 3 cards: Standard queries with moderate complexity (e.g., "dealing with difficult colleagues")
         - 4-5 cards: Only for complex, multi-faceted topics requiring diverse angles
-        
+
         Each card MUST logically build upon or relate to the previous ones to form a cohesive learning journey.
-        
-        For each card:
-        
+
         You MUST respond with valid JSON only. No other text.
         Return an array of objects with:
         - type: EXACTLY one of: "quote", "summary", "recommendation", "theme"
@@ -154,84 +105,786 @@ class LLMService:
         - quote: (only if type is "quote") the actual quote text
         - source_page: (optional) string like "Page 143" or "23:45" for timestamps
         - clickable_link: always use "#"
-        
-        Important: 
+
+        Important:
         - START with the most fundamental/foundational content, then progress to more specific/advanced
         - Each card should logically flow from the previous one
         - For podcasts, include words like "Podcast", "Episode", "Interview", "Talk" in the book_title
         - source_page should be a string, not a number
         - Quality over quantity - fewer, better-connected cards are preferred
-        """
-        
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Query: '{query}' | Category: {intent_category.value}"}
-                ],
-                temperature=0.6
-            )
-            
-            response_text = response.choices[0].message.content.strip()
-            
-            # Clean the response
-            if response_text.startswith('```json'):
-                response_text = response_text.replace('```json', '').replace('```', '').strip()
-            
-            if not response_text:
-                raise ValueError("Empty response from OpenAI")
-            
-            print(f"Raw response: {response_text}")  # Debug print
-            
-            cards_data = json.loads(response_text)
-            return [ContentCard(**card) for card in cards_data]
-        except Exception as e:
-            print(f"Error in content generation: {str(e)}")
-            print(f"Raw response was: {response_text if 'response_text' in locals() else 'No response'}")
-            # Fallback cards
-            return [
-                ContentCard(
-                    type="recommendation",
-                    title="Content Discovery",
-                    description="We're finding the best content for your query. Please try again or refine your search.",
-                    clickable_link="#"
+        """).strip()
+
+_CATEGORY_FOCUS_LINES = "\n".join(
+    f"           - {category.value}: {focus}" for category, focus in CATEGORY_PROMPTS.items()
+)
+
+# Single-call prompt that classifies a query and generates its results
+COMBINED_SYSTEM_PROMPT = textwrap.dedent(f"""
+        You are the search engine for a content discovery system (books, podcasts, hosts, articles).
+        For each query, first analyze it, then produce the matching results in the same response.
+
+        Analysis:
+        - query_type: "specific_book" if the query is about one SPECIFIC item, otherwise "general"
+        - user_intent_category: null for specific_book, otherwise one of:
+{_CATEGORY_FOCUS_LINES}
+        - confidence_score: float between 0-1
+        - reasoning: explanation of your analysis
+
+        If query_type is "specific_book":
+        - book_recommendation: title, author (creator), detailed reason and relevance_score (0-1)
+        - content_cards: empty array
+
+        If query_type is "general":
+        - book_recommendation: null
+        - content_cards: 1-5 cards following the focus of the chosen category. Use 1 card for simple,
+          direct queries, 2-3 for moderate ones and 4-5 only for complex multi-faceted topics. Cards form a
+          cohesive journey from foundational to advanced content, each building on the previous one.
+          Each card has:
+          - type: EXACTLY one of: "quote", "summary", "recommendation", "theme"
+          - title: engaging title that relates to the overall theme
+          - description: compelling description (max 100 words) showing how this fits the progression
+          - book_title / book_author: content title and creator (for podcasts use the show or episode and host names,
+            and include words like "Podcast", "Episode", "Interview", "Talk" in book_title), or null
+          - quote: the actual quote text if type is "quote", otherwise null
+          - source_page: string like "Page 143" or "23:45" for timestamps, or null
+          - clickable_link: always "#"
+        """).strip()
+
+def recommendation_messages(query: str, candidates: list[dict]) -> list[dict]:
+    """Recommendation prompt, grounded in catalog candidates when there are any"""
+    if candidates:
+        return [
+            {"role": "system", "content": GROUNDED_RECOMMENDATION_SYSTEM_PROMPT},
+            {"role": "user", "content": f"{query}\n\nCandidates:\n{format_candidates(candidates)}"}
+        ]
+    return [
+        {"role": "system", "content": RECOMMENDATION_SYSTEM_PROMPT},
+        {"role": "user", "content": query}
+    ]
+
+def card_messages(query: str, intent_category: UserIntentCategory, candidates: list[dict],
+                  matches: Optional[list[tuple[dict, float]]] = None) -> list[dict]:
+    """Card prompt, grounded in catalog candidates when there are any and pointing at indexed passage matches"""
+    focus = CATEGORY_PROMPTS.get(intent_category, "general recommendations")
+    request = f"Query: '{query}' | Category: {intent_category.value}\nFocus on: {focus}"
+    if matches:
+        ids = ", ".join(f"[{passage['catalog_id']}]" for passage, _ in matches)
+        request += f"\nIndexed passages matching the query were found in {ids}; build the first cards on them."
+    if candidates:
+        return [
+            {"role": "system", "content": GROUNDED_CARDS_SYSTEM_PROMPT},
+            {"role": "user", "content": f"{request}\n\nCandidates:\n{format_candidates(candidates)}"}
+        ]
+    return [
+        {"role": "system", "content": CARDS_SYSTEM_PROMPT},
+        {"role": "user", "content": request}
+    ]
+
+def analysis_messages(query: str) -> list[dict]:
+    """Classification prompt"""
+    return [
+        {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Analyze this query: '{query}'"}
+    ]
+
+def batch_analysis_messages(queries: list[str]) -> list[dict]:
+    """Classification prompt for several queries at once"""
+    lines = [f"[{i}] {' '.join(query.split())}" for i, query in enumerate(queries)]
+    return [
+        {"role": "system", "content": BATCH_ANALYSIS_SYSTEM_PROMPT},
+        {"role": "user", "content": "\n".join(lines)}
+    ]
+
+def split_usage(usage, count: int) -> list[Optional[CompletionUsage]]:
+    """An API usage object divided as evenly as possible into ``count`` shares"""
+    if usage is None:
+        return [None] * count
+    def share(total: int, index: int) -> int:
+        return total // count + (index < total % count)
+    return [
+        CompletionUsage(
+            prompt_tokens=share(usage.prompt_tokens, index),
+            completion_tokens=share(usage.completion_tokens, index),
+            total_tokens=share(usage.prompt_tokens, index) + share(usage.completion_tokens, index),
+            prompt_tokens_details=PromptTokensDetails(cached_tokens=share(cached_tokens_of(usage), index))
+        )
+        for index in range(count)
+    ]
+
+def classify_batch(client, guard: UpstreamGuard, router: ModelRouter,
+                   queries: list[str]) -> list[tuple[Optional[QueryAnalysis], Optional[CompletionUsage]]]:
+    """Classify several queries in one request.
+
+    Each query gets its analysis (None where the model left it out or got it
+    wrong) and its share of the request's token usage.
+    """
+    model = router.model_for("analyze", queries[0])
+    messages = batch_analysis_messages(queries)
+    start = time.perf_counter()
+    response = guard.call("analyze_batch", lambda timeout: client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=0.3,
+        timeout=timeout
+    ), model=model, tokens=estimate_tokens(messages, "analyze_batch", model))
+    elapsed = time.perf_counter() - start
+    try:
+        results = parse_batch_analysis(response.choices[0].message.content, len(queries))
+    except ValueError as e:
+        print(f"Invalid batch analysis response: {str(e)}")
+        results = [None] * len(queries)
+    router.record("analyze_batch", model, elapsed, response.usage, ok=None not in results)
+    return list(zip(results, split_usage(response.usage, len(queries))))
+
+def combined_messages(query: str) -> list[dict]:
+    """Single-call classify-and-generate prompt"""
+    return [
+        {"role": "system", "content": COMBINED_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Query: '{query}'"}
+    ]
+
+def fallback_analysis(error: Exception) -> QueryAnalysis:
+    """Analysis used when the classification call fails"""
+    return QueryAnalysis(
+        query_type=QueryType.GENERAL,
+        user_intent_category=UserIntentCategory.EXPLORATION_DISCOVERY,
+        confidence_score=0.5,
+        reasoning=f"Error in analysis: {str(error)}"
+    )
+
+def fallback_recommendation(error: Exception) -> BookRecommendation:
+    """Recommendation used when the recommendation call fails"""
+    return BookRecommendation(
+        title="Content Analysis Error",
+        author="System",
+        reason=f"Unable to analyze: {str(error)}",
+        relevance_score=0.0
+    )
+
+def fallback_cards() -> list[ContentCard]:
+    """Cards used when the card generation call fails"""
+    return [
+        ContentCard(
+            type="recommendation",
+            title="Content Discovery",
+            description="We're finding the best content for your query. Please try again or refine your search.",
+            clickable_link="#"
+        )
+    ]
+
+# Reasoning prefix of analyses produced while the circuit breaker is open
+DEGRADED_REASONING = "Served locally while the LLM is unavailable"
+
+def degraded_response(user_query: str, local_classifier: Optional[LocalIntentClassifier], vector_index,
+                      lexical_index: Optional[LexicalIndex] = None,
+                      passage_index: Optional[PassageIndex] = None) -> SearchResponse:
+    """Best answer without the LLM: the local classification plus the closest catalog items"""
+    analysis = local_classifier.predict(user_query) if local_classifier else classify_by_rules(user_query)
+    analysis = analysis.model_copy(update={"reasoning": f"{DEGRADED_REASONING} ({analysis.reasoning})"})
+    if analysis.query_type == QueryType.SPECIFIC_BOOK and lexical_index:
+        match = lexical_index.match(user_query)
+        if match is not None:
+            return SearchResponse(analysis=analysis, book_recommendation=recommendation_from_match(*match), content_cards=[])
+    if analysis.user_intent_category in PASSAGE_INTENTS and passage_index:
+        matches = passage_index.match(user_query)
+        if matches:
+            return SearchResponse(analysis=analysis, book_recommendation=None, content_cards=cards_from_passages(matches))
+    try:
+        candidates = retrieve_candidates(vector_index, user_query)
+    except Exception as e:
+        # The degraded path must answer even when the index is unusable
+        print(f"Error retrieving degraded candidates: {str(e)}")
+        candidates = []
+    if analysis.query_type == QueryType.SPECIFIC_BOOK:
+        if not candidates:
+            return SearchResponse(analysis=analysis, book_recommendation=fallback_recommendation(
+                UpstreamUnavailable("the LLM is temporarily unavailable")), content_cards=[])
+        book_rec = recommendation_from_candidate(
+            {"catalog_id": candidates[0]["id"], "reason": "Closest catalog match to your query.", "relevance_score": 0.5},
+            candidates
+        )
+        return SearchResponse(analysis=analysis, book_recommendation=book_rec, content_cards=[])
+    by_id = {str(item["id"]): item for item in candidates}
+    cards = [
+        card_from_candidate({
+            "catalog_id": item["id"],
+            "type": "summary",
+            "title": item.get("title", ""),
+            "description": item.get("summary", "")[:300] or "Closest catalog match to your query."
+        }, by_id)
+        for item in candidates[:3]
+    ]
+    return SearchResponse(analysis=analysis, book_recommendation=None, content_cards=cards or fallback_cards())
+
+def normalize_combined_response(response: SearchResponse) -> SearchResponse:
+    """Keep only the result matching the analysed query type, rejecting incomplete responses"""
+    if response.analysis.query_type == QueryType.SPECIFIC_BOOK:
+        if response.book_recommendation is None:
+            raise ValueError("Combined response is missing the book recommendation")
+        return response.model_copy(update={"content_cards": []})
+    if not response.content_cards or response.analysis.user_intent_category is None:
+        raise ValueError("Combined response is missing the intent category or content cards")
+    return response.model_copy(update={"book_recommendation": None})
+
+def is_fallback_response(response: SearchResponse) -> bool:
+    """Check whether any stage of a response came from an error fallback"""
+    if response.analysis.reasoning.startswith(("Error in analysis", DEGRADED_REASONING)):
+        return True
+    if response.book_recommendation and response.book_recommendation.author == "System":
+        return True
+    return any(card.title == "Content Discovery" for card in response.content_cards)
+
+def same_branch(analysis: QueryAnalysis, predicted: QueryAnalysis) -> bool:
+    """Check whether two analyses lead to the same generation call"""
+    if analysis.query_type != predicted.query_type:
+        return False
+    return analysis.query_type == QueryType.SPECIFIC_BOOK or analysis.user_intent_category == predicted.user_intent_category
+
+def span_usage(stage: Span):
+    """Token usage recorded on a span, in the shape of an API usage object"""
+    if stage.prompt_tokens is None:
+        return None
+    return CompletionUsage(
+        prompt_tokens=stage.prompt_tokens,
+        completion_tokens=stage.completion_tokens or 0,
+        total_tokens=stage.prompt_tokens + (stage.completion_tokens or 0),
+        prompt_tokens_details=PromptTokensDetails(cached_tokens=stage.cached_tokens or 0)
+    )
+
+class SpeculationStats:
+    """Thread-safe counters of speculative generation hits and misses.
+
+    ``wasted`` counts misses whose speculative generation had already started,
+    so its API calls were spent on a result that was thrown away.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.wasted = 0
+        self._lock = threading.Lock()
+
+    def record(self, hit: bool, wasted: bool = False) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+                self.wasted += wasted
+
+    def as_dict(self) -> dict:
+        attempts = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "wasted": self.wasted,
+            "hit_rate": self.hits / attempts if attempts else 0.0,
+        }
+
+def response_items(response: SearchResponse) -> Iterator[Union[QueryAnalysis, BookRecommendation, ContentCard]]:
+    """A finished response in streaming order: the analysis, then the recommendation or each card"""
+    yield response.analysis
+    if response.book_recommendation:
+        yield response.book_recommendation
+    yield from response.content_cards
+
+def streamed_cards(parser: JsonArrayStreamParser, chunk, stage: Span, by_id: dict[str, dict]) -> list[ContentCard]:
+    """Cards completed by one streamed chunk, grounded in ``by_id`` when there are candidates"""
+    stage.record_usage(chunk.usage)
+    if not chunk.choices or not chunk.choices[0].delta.content:
+        return []
+    stage.first_token()
+    cards = (card_from_candidate(data, by_id) if by_id else ContentCard(**data)
+             for data in parser.feed(chunk.choices[0].delta.content))
+    return [card for card in cards if card is not None]
+
+class SearchServiceBase:
+    """Configuration and the decisions shared by LLMService and AsyncLLMService.
+
+    Nothing here waits on the API: cache lookups, local classification, index
+    matches, escalation and fallback bookkeeping are the same in both services,
+    which differ only in how they send requests. The cache, index and log steps
+    block, so the async service runs them in a thread.
+    """
+
+    def _configure(self, cache: Optional[ResponseCache], speculative: Optional[bool],
+                   local_classifier: Optional[LocalIntentClassifier], combined: Optional[bool],
+                   vector_index: Optional[VectorIndex], semantic_cache: Optional[SemanticCache],
+                   model: Optional[str], tracer: Optional[Tracer], router: Optional[ModelRouter],
+                   guard: Optional[UpstreamGuard], lexical_index: Optional[LexicalIndex],
+                   passage_index: Optional[PassageIndex], use_cache: bool) -> None:
+        # Retries are handled by the guard, which also applies timeouts, hedging and the circuit breaker
+        self.guard = guard if guard is not None else UpstreamGuard.from_env()
+        self.model = model or LLM_MODEL
+        # Picks the model per stage (LLM_ROUTING) and accounts cost and latency per route
+        self.router = router if router is not None else ModelRouter.from_env(self.model)
+        # Exact-match response cache; use_cache=False runs without one whatever SEARCH_CACHE_ENABLED says
+        self.cache = (cache if cache is not None else ResponseCache.from_env()) if use_cache else None
+        # Paraphrase-tolerant cache consulted after an exact-match miss
+        self.semantic_cache = semantic_cache if semantic_cache is not None else SemanticCache.from_env()
+        # Local fast path that answers confident classifications without the LLM
+        self.local_classifier = local_classifier if local_classifier is not None else LocalIntentClassifier.from_env()
+        self.classification_log_path = os.getenv("CLASSIFICATION_LOG_PATH")
+        # Local semantic index over the catalog, if one has been ingested
+        self.vector_index = vector_index if vector_index is not None else VectorIndex.from_env()
+        # Title/author index that answers confidently named books without the LLM;
+        # with LEXICAL_PERSONALIZE the match is still sent to the LLM, alone, to personalize the reason
+        self.lexical_index = lexical_index if lexical_index is not None else LexicalIndex.from_env(self.vector_index)
+        self.lexical_personalize = os.getenv("LEXICAL_PERSONALIZE", "0").lower() in ("1", "true", "yes")
+        # Quote/passage index that answers quote and plot recall queries with real passages and pages
+        self.passage_index = passage_index if passage_index is not None else PassageIndex.from_env()
+        # Speculative mode runs analysis and the most likely generation concurrently
+        if speculative is None:
+            speculative = os.getenv("SEARCH_SPECULATIVE", "0").lower() in ("1", "true", "yes")
+        self.speculative = speculative
+        # Combined mode classifies and generates in one structured-output request
+        if combined is None:
+            combined = os.getenv("SEARCH_COMBINED", "0").lower() in ("1", "true", "yes")
+        self.combined = combined
+        self.speculation = SpeculationStats()
+        # Per-request stage spans, handed to the configured sinks (TRACE_SINKS)
+        self.tracer = tracer if tracer is not None else Tracer.from_env()
+        # Seconds from query start to the first streamed card, most recent last
+        self.first_card_latencies: deque[float] = deque(maxlen=1000)
+
+    def _create_batcher(self, batch_window_ms: Optional[float]) -> Optional[MicroBatcher]:
+        """Micro-batcher sending concurrent analyses as one request (ANALYZE_BATCH_WINDOW_MS, ANALYZE_BATCH_MAX_SIZE)"""
+        if batch_window_ms is None:
+            return MicroBatcher.from_env(self._classify_batch)
+        return MicroBatcher(self._classify_batch, window_ms=batch_window_ms) if batch_window_ms > 0 else None
+
+    def _classify_batch(self, queries: list[str]) -> list[tuple[Optional[QueryAnalysis], Optional[CompletionUsage]]]:
+        raise NotImplementedError
+
+    def _classify_locally(self, user_query: str) -> Optional[QueryAnalysis]:
+        """Confident local classification, or None when the LLM is needed"""
+        if not self.local_classifier:
+            return None
+        with span("classify_local") as stage:
+            analysis = self.local_classifier.classify(user_query)
+            stage.set("absorbed", analysis is not None)
+        return analysis
+
+    def _log_classification(self, user_query: str, analysis: QueryAnalysis) -> None:
+        """Append an LLM classification to the training log, if one is configured (blocking)"""
+        if self.classification_log_path:
+            log_classification(self.classification_log_path, user_query, analysis)
+
+    def _lexical_match(self, query: str) -> Optional[tuple[dict, float]]:
+        """Confident title/author match for a named book, or None (sub-millisecond, so never offloaded)"""
+        if not self.lexical_index:
+            return None
+        with span("lexical") as stage:
+            match = self.lexical_index.match(query)
+            stage.set("matched", match is not None)
+        return match
+
+    def _passage_match(self, query: str, intent_category: UserIntentCategory) -> list[tuple[dict, float]]:
+        """Indexed passages matching a quote or plot recall query; empty for other intents (never offloaded)"""
+        if not self.passage_index or intent_category not in PASSAGE_INTENTS:
+            return []
+        with span("passages") as stage:
+            matches = self.passage_index.match(query)
+            stage.set("matched", len(matches))
+        return matches
+
+    def _cached_response(self, user_query: str) -> Optional[SearchResponse]:
+        """Look the query up in the exact cache, then the semantic cache (blocking)"""
+        if not self.cache and not self.semantic_cache:
+            return None
+        with span("cache", cache="miss") as stage:
+            if self.cache:
+                cached = self.cache.get(user_query)
+                if cached is not None:
+                    stage.cache = "hit"
+                    return cached
+            if self.semantic_cache:
+                cached = self.semantic_cache.get(user_query)
+                if cached is not None:
+                    stage.cache = "semantic_hit"
+                    return cached
+        return None
+
+    def _degraded_response(self, user_query: str) -> SearchResponse:
+        """Local answer while the circuit breaker is open (blocking)"""
+        with span("degraded") as stage:
+            stage.fail(UpstreamUnavailable("Circuit breaker open"))
+            return degraded_response(user_query, self.local_classifier, self.vector_index,
+                                     self.lexical_index, self.passage_index)
+
+    def _store_response(self, user_query: str, response: SearchResponse) -> None:
+        """Cache a response; error fallbacks are never cached so the next attempt retries upstream (blocking)"""
+        if is_fallback_response(response):
+            return
+        if self.cache:
+            self.cache.set(user_query, response)
+        if self.semantic_cache:
+            self.semantic_cache.set(user_query, response)
+
+    def _escalation(self, stage: Span, model: str, seconds: float, usage, escalated: bool,
+                    error: Exception) -> Optional[str]:
+        """Record an unparseable answer and return the model to retry with, or None if it was the largest"""
+        self.router.record(stage.name, model, seconds, usage, ok=False, escalated=escalated)
+        larger = self.router.escalate(model)
+        if larger is not None:
+            print(f"Invalid {stage.name} response from {model}, escalating to {larger}: {str(error)}")
+            stage.set("escalated_from", model)
+        return larger
+
+    def _combined_response(self, stage: Span, completion, model: str, seconds: float) -> SearchResponse:
+        """Validate a combined-mode completion and account for it on its route"""
+        stage.record_usage(completion.usage)
+        parsed = completion.choices[0].message.parsed
+        if parsed is None:
+            raise ValueError(completion.choices[0].message.refusal or "Empty response from OpenAI")
+        response = normalize_combined_response(parsed.to_search_response())
+        self.router.record("combined", model, seconds, completion.usage)
+        return response
+
+    def _combined_failed(self, stage: Span, error: Exception, model: str, seconds: float) -> None:
+        """Close the span of a combined request that the two-stage pipeline will redo"""
+        if isinstance(error, (openai.APIError, UpstreamUnavailable)):
+            print(f"Error in combined search, using two-stage pipeline: {str(error)}")
+        else:
+            print(f"Invalid combined response, using two-stage pipeline: {str(error)}")
+            self.router.record("combined", model, seconds, span_usage(stage), ok=False)
+        stage.fail(error)
+        stage.finish()
+
+    def _stream_finished(self, stage: Span, model: str, seconds: float, error: Optional[Exception] = None) -> None:
+        """Account for a streamed card generation on its route"""
+        if error is None:
+            self.router.record("cards", model, seconds, span_usage(stage))
+            return
+        print(f"Error in streamed content generation: {str(error)}")
+        self.router.record("cards", model, seconds, span_usage(stage), ok=False)
+        stage.fail(error)
+
+    def first_card_stats(self) -> dict:
+        """Time-to-first-card percentiles over recent streamed searches"""
+        samples = list(self.first_card_latencies)
+        return {
+            "count": len(samples),
+            "p50": percentile(samples, 0.5),
+            "p95": percentile(samples, 0.95),
+        }
+
+class LLMService(SearchServiceBase):
+    def __init__(self, cache: Optional[ResponseCache] = None, speculative: Optional[bool] = None,
+                 local_classifier: Optional[LocalIntentClassifier] = None, combined: Optional[bool] = None,
+                 vector_index: Optional[VectorIndex] = None, semantic_cache: Optional[SemanticCache] = None,
+                 model: Optional[str] = None, tracer: Optional[Tracer] = None, router: Optional[ModelRouter] = None,
+                 guard: Optional[UpstreamGuard] = None, batch_window_ms: Optional[float] = None,
+                 lexical_index: Optional[LexicalIndex] = None, passage_index: Optional[PassageIndex] = None,
+                 use_cache: bool = True):
+        start = time.perf_counter()
+        self._configure(cache, speculative, local_classifier, combined, vector_index, semantic_cache, model,
+                        tracer, router, guard, lexical_index, passage_index, use_cache)
+        # Backend (OpenAI, any compatible endpoint or the local mock) comes from LLM_BACKEND
+        self.client = create_client(max_retries=0)
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="speculative") if self.speculative else None
+        self.batcher = self._create_batcher(batch_window_ms)
+        # Seconds spent building the service, including loading the index and classifier
+        self.startup_seconds = time.perf_counter() - start
+
+    def _routed_completion(self, stage: Span, messages: list[dict], temperature: float, parse,
+                           query: str, analysis: Optional[QueryAnalysis] = None):
+        """Run a completion on the routed model and parse it, escalating once to the large model if parsing fails"""
+        model = self.router.model_for(stage.name, query, analysis)
+        escalated = False
+        while True:
+            stage.model = model
+            start = time.perf_counter()
+            response = self.guard.call(stage.name, lambda timeout: self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                timeout=timeout
+            ), stage, model=model, tokens=estimate_tokens(messages, stage.name, model))
+            elapsed = time.perf_counter() - start
+            stage.record_usage(response.usage)
+            try:
+                result = parse(response.choices[0].message.content)
+            except (ValueError, KeyError, TypeError) as e:
+                larger = self._escalation(stage, model, elapsed, response.usage, escalated, e)
+                if larger is None:
+                    raise
+                model, escalated = larger, True
+                continue
+            self.router.record(stage.name, model, elapsed, response.usage, escalated=escalated)
+            return result
+
+    def analyze_query(self, user_query: str) -> QueryAnalysis:
+        """Analyze user query to determine type and intent category"""
+        local_analysis = self._classify_locally(user_query)
+        if local_analysis is not None:
+            return local_analysis
+        return self._analyze_with_llm(user_query)
+
+    def _analyze_with_llm(self, user_query: str) -> QueryAnalysis:
+        """Classify a query with the LLM, logging the result for classifier training"""
+
+        with span("analyze") as stage:
+            try:
+                analysis = self._batched_analysis(user_query, stage) if self.batcher else None
+                if analysis is None:
+                    analysis = self._routed_completion(stage, analysis_messages(user_query), 0.3, parse_query_analysis, user_query)
+            except Exception as e:
+                print(f"Error in query analysis: {str(e)}")
+                stage.fail(e)
+                return fallback_analysis(e)
+
+        self._log_classification(user_query, analysis)
+        return analysis
+
+    def close(self) -> None:
+        """Stop the batcher and speculation threads; searches already waiting on them still finish"""
+        if self.batcher:
+            self.batcher.close()
+        if self._executor:
+            self._executor.shutdown(wait=True)
+        self.client.close()
+
+    def _classify_batch(self, queries: list[str]) -> list[tuple[Optional[QueryAnalysis], Optional[CompletionUsage]]]:
+        return classify_batch(self.client, self.guard, self.router, queries)
+
+    def _batched_analysis(self, user_query: str, stage: Span) -> Optional[QueryAnalysis]:
+        """Classify through the micro-batcher; None when the batch response left this query out"""
+        stage.model = self.router.model_for("analyze", user_query)
+        analysis, usage = self.batcher.submit(user_query).result()
+        stage.record_usage(usage)
+        stage.set("batched", True)
+        return analysis
+
+    def generate_book_recommendation(self, query: str, analysis: Optional[QueryAnalysis] = None) -> BookRecommendation:
+        """Generate recommendation for specific content queries"""
+
+        match = self._lexical_match(query)
+        if match is not None and not self.lexical_personalize:
+            return recommendation_from_match(*match)
+
+        with span("recommend") as stage:
+            try:
+                candidates = [match[0]] if match is not None else retrieve_candidates(self.vector_index, query)
+                stage.set("candidates", len(candidates))
+                return self._routed_completion(
+                    stage, recommendation_messages(query, candidates), 0.4,
+                    lambda text: parse_recommendation(text, candidates), query, analysis
+                )
+            except Exception as e:
+                print(f"Error in recommendation generation: {str(e)}")
+                stage.fail(e)
+                return fallback_recommendation(e)
+
+    def generate_content_cards(self, query: str, intent_category: UserIntentCategory,
+                               analysis: Optional[QueryAnalysis] = None) -> list[ContentCard]:
+        """Generate relevant content cards based on query and intent"""
+
+        matches = self._passage_match(query, intent_category)
+
+        with span("cards") as stage:
+            try:
+                candidates = with_passages(matches, retrieve_candidates(self.vector_index, query))
+                stage.set("candidates", len(candidates))
+                return self._routed_completion(
+                    stage, card_messages(query, intent_category, candidates, matches), 0.6,
+                    lambda text: parse_cards(text, candidates), query, analysis
                 )
-            ]
-    
+            except Exception as e:
+                print(f"Error in content generation: {str(e)}")
+                stage.fail(e)
+                return cards_from_passages(matches) or fallback_cards()
+
+    def stream_content_cards(self, query: str, intent_category: UserIntentCategory,
+                             analysis: Optional[QueryAnalysis] = None) -> Iterator[ContentCard]:
+        """Stream card generation and yield each card as soon as it is complete"""
+        matches = self._passage_match(query, intent_category)
+
+        yielded = False
+        # Cards are shown as they arrive, so a streamed response is never escalated
+        model = self.router.model_for("cards", query, analysis)
+        with span("cards_stream", model=model) as stage:
+            start = time.perf_counter()
+            try:
+                candidates = with_passages(matches, retrieve_candidates(self.vector_index, query))
+                stage.set("candidates", len(candidates))
+                by_id = {str(item["id"]): item for item in candidates}
+                messages = card_messages(query, intent_category, candidates, matches)
+                # Only opening the stream is retried; a duplicate stream cannot be merged, so no hedging
+                stream = self.guard.call("cards_stream", lambda timeout: self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=0.6,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    timeout=timeout
+                ), stage, hedge=False, model=model, tokens=estimate_tokens(messages, "cards", model))
+
+                parser = JsonArrayStreamParser()
+                for chunk in stream:
+                    for card in streamed_cards(parser, chunk, stage, by_id):
+                        yielded = True
+                        yield card
+                if not yielded:
+                    raise ValueError("No content cards in streamed response")
+                self._stream_finished(stage, model, time.perf_counter() - start)
+            except Exception as e:
+                self._stream_finished(stage, model, time.perf_counter() - start, e)
+                # Keep any cards already shown; only fall back when nothing arrived
+                if not yielded:
+                    yield from cards_from_passages(matches) or fallback_cards()
+
+    def stream_search_query(self, user_query: str) -> Iterator[Union[QueryAnalysis, BookRecommendation, ContentCard]]:
+        """Yield the analysis, then the recommendation or each content card as it becomes ready"""
+        with self.tracer.trace(user_query):
+            start = time.perf_counter()
+
+            cached = self._cached_response(user_query)
+            if cached is None and not self.guard.available():
+                cached = self._degraded_response(user_query)
+            if cached is not None:
+                yield from response_items(cached)
+                return
+
+            analysis = self.analyze_query(user_query)
+            yield analysis
+
+            if analysis.query_type == QueryType.SPECIFIC_BOOK:
+                book_rec = self.generate_book_recommendation(user_query, analysis)
+                yield book_rec
+                response = SearchResponse(analysis=analysis, book_recommendation=book_rec, content_cards=[])
+            else:
+                content_cards = []
+                for card in self.stream_content_cards(user_query, analysis.user_intent_category, analysis):
+                    if not content_cards:
+                        self.first_card_latencies.append(time.perf_counter() - start)
+                    content_cards.append(card)
+                    yield card
+                response = SearchResponse(analysis=analysis, book_recommendation=None, content_cards=content_cards)
+
+            self._store_response(user_query, response)
+
     def process_search_query(self, user_query: str) -> SearchResponse:
         """Main method to process a search query end-to-end"""
-        
-        # Step 1: Analyze the query
-        analysis = self.analyze_query(user_query)
-        
-        # Step 2: Generate appropriate response
+
+        with self.tracer.trace(user_query):
+            # Serve repeated and paraphrased queries straight from the caches
+            cached = self._cached_response(user_query)
+            if cached is not None:
+                return cached
+
+            # While the upstream is unhealthy, answer locally instead of queueing behind failures
+            if not self.guard.available():
+                return self._degraded_response(user_query)
+
+            if self.combined:
+                response = self._process_combined(user_query)
+            elif self.speculative:
+                response = self._process_speculatively(user_query)
+            else:
+                # Step 1: Analyze the query
+                analysis = self.analyze_query(user_query)
+                # Step 2: Generate appropriate response
+                response = self._generate_response(user_query, analysis)
+
+            self._store_response(user_query, response)
+            return response
+
+    def _generate_response(self, user_query: str, analysis: QueryAnalysis) -> SearchResponse:
+        """Run the generation stage selected by the analysis"""
         if analysis.query_type == QueryType.SPECIFIC_BOOK:
-            book_rec = self.generate_book_recommendation(user_query)
+            book_rec = self.generate_book_recommendation(user_query, analysis)
             return SearchResponse(
                 analysis=analysis,
                 book_recommendation=book_rec,
                 content_cards=[]
             )
-        else:
-            content_cards = self.generate_content_cards(user_query, analysis.user_intent_category)
-            return SearchResponse(
-                analysis=analysis,
-                book_recommendation=None,
-                content_cards=content_cards
-            )
-    
+        content_cards = self.generate_content_cards(user_query, analysis.user_intent_category, analysis)
+        return SearchResponse(
+            analysis=analysis,
+            book_recommendation=None,
+            content_cards=content_cards
+        )
+
+    def _process_combined(self, user_query: str) -> SearchResponse:
+        """Classify and generate in one structured-output round trip.
+
+        Confident local classifications skip straight to the single generation call.
+        API errors and responses that fail validation or disagree with their own
+        query_type fall back to the two-stage pipeline.
+        """
+        local_analysis = self._classify_locally(user_query)
+        if local_analysis is not None:
+            return self._generate_response(user_query, local_analysis)
+
+        # Nothing is classified yet, so the route follows the local rules' guess
+        model = self.router.model_for("combined", user_query, classify_by_rules(user_query))
+        with span("combined", model=model) as stage:
+            start = time.perf_counter()
+            messages = combined_messages(user_query)
+            try:
+                completion = self.guard.call("combined", lambda timeout: self.client.chat.completions.parse(
+                    model=model,
+                    messages=messages,
+                    response_format=CombinedSearchResponse,
+                    temperature=0.4,
+                    timeout=timeout
+                ), stage, model=model, tokens=estimate_tokens(messages, "combined", model))
+                response = self._combined_response(stage, completion, model, time.perf_counter() - start)
+            except Exception as e:
+                self._combined_failed(stage, e, model, time.perf_counter() - start)
+                return self._generate_response(user_query, self._analyze_with_llm(user_query))
+
+        self._log_classification(user_query, response.analysis)
+        return response
+
+    def _process_speculatively(self, user_query: str) -> SearchResponse:
+        """Run analysis alongside the generation predicted by the local rules.
+
+        If the analysis agrees with the prediction the speculative result is used;
+        otherwise the correct generation runs after the analysis. A speculative
+        generation that has not started yet is cancelled; one that has cannot be
+        stopped, so it finishes in its thread, its result is dropped and the miss
+        is counted as wasted.
+        """
+        local_analysis = self._classify_locally(user_query)
+        if local_analysis is not None:
+            return self._generate_response(user_query, local_analysis)
+
+        predicted = classify_by_rules(user_query)
+        analysis_future = submit_in_context(self._executor, self._analyze_with_llm, user_query)
+        speculative_future = submit_in_context(self._executor, self._generate_response, user_query, predicted)
+
+        analysis = analysis_future.result()
+        if same_branch(analysis, predicted):
+            self.speculation.record(True)
+            return speculative_future.result().model_copy(update={"analysis": analysis})
+
+        self.speculation.record(False, wasted=not speculative_future.cancel())
+        return self._generate_response(user_query, analysis)
+
     def get_placeholder_feature(self) -> PlaceholderFeature:
-        """Generate a work-in-progress placeholder feature"""
+        """Describe the semantic vector search feature and its index status"""
+        if self.vector_index is not None:
+            return PlaceholderFeature(
+                name="Semantic Vector Search",
+                description="Semantic matching over the local catalog using embeddings to find books with similar themes, writing styles, and emotional resonance.",
+                status="Available",
+                estimated_completion="Shipped",
+                preview_data={
+                    **self.vector_index.stats(),
+                    "search_modes": ["exact", "ivf"] if self.vector_index.centroids is not None else ["exact"]
+                }
+            )
         return PlaceholderFeature(
             name="Semantic Vector Search",
             description="Advanced semantic matching using embeddings to find books with similar themes, writing styles, and emotional resonance.",
             status="In Development",
-            estimated_completion="Next Sprint",
+            estimated_completion="Run `python vector_index.py ingest catalog.jsonl` to build the index",
             preview_data={
                 "similarity_threshold": 0.85,
                 "embedding_dimensions": 1536,
-                "indexed_books": 15000,
-                "search_modes": ["semantic", "hybrid", "contextual"]
+                "indexed_books": 0,
+                "search_modes": ["exact", "ivf"]
             }
-        ) 
\ No newline at end of file
+        )
@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+"""
+Deterministic OpenAI-compatible mock server for offline load testing.
+
+Serves /v1/chat/completions (plain and streamed) and /v1/embeddings. Responses
+are replayed from a recordings file when the request matches one, otherwise a
+plausible response is synthesized from the prompt. Latency follows a seeded
+log-normal distribution and a configurable share of requests fail with 429 or
+500, so throughput and tail latency of the whole pipeline can be measured
+without spending money or hitting real rate limits. --rpm and --tpm emulate a
+per-minute quota instead: completions carry OpenAI's x-ratelimit-* headers and
+are refused with 429 and Retry-After once the quota is spent. Strict
+structured-output schemas are checked the way OpenAI checks them, and invalid
+ones get a 400.
+
+Synthesized analyses start from the keyword rules in intent_classifier.py, which
+are also what speculation guesses with, so --label-noise (default 0.2) relabels
+a seeded share of queries. Otherwise every speculative guess would be right by
+construction.
+
+  python mock_llm_server.py --port 8765 --latency-ms 400 --error-rate 0.02
+  LLM_BACKEND=compatible LLM_BASE_URL=http://127.0.0.1:8765/v1 streamlit run app.py
+
+With --record-upstream the server instead proxies to a real endpoint and appends
+every completion to the recordings file for later replay.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from intent_classifier import classify_by_rules
+from models import QueryAnalysis, QueryType, UserIntentCategory
+from rate_limit import TokenBucket
+from vector_index import HashingEmbedder
+
+def request_key(messages: list[dict]) -> str:
+    """Stable key of a chat request used to match recordings"""
+    return hashlib.sha256(json.dumps(messages, sort_keys=True).encode()).hexdigest()
+
+_QUOTED_QUERY = re.compile(r"^(?:Query|Analyze this query): '(.*?)'(?: \||$)", re.S)
+
+def _quoted_query(text: str) -> str:
+    match = _QUOTED_QUERY.match(text)
+    return match.group(1) if match else text
+
+def strict_schema_error(response_format: Optional[dict]) -> Optional[str]:
+    """Why OpenAI would reject a strict json_schema response format with a 400, or None if it is valid.
+
+    Strict mode needs every object to list all its properties as required and
+    forbid additional ones, and allows no "default" anywhere in the schema.
+    """
+    if not response_format or response_format.get("type") != "json_schema":
+        return None
+    spec = response_format.get("json_schema", {})
+    if not spec.get("strict"):
+        return None
+    pending = [("#", spec.get("schema", {}))]
+    while pending:
+        path, node = pending.pop()
+        if isinstance(node, list):
+            pending.extend((f"{path}/{index}", child) for index, child in enumerate(node))
+            continue
+        if not isinstance(node, dict):
+            continue
+        if "default" in node:
+            return f"Invalid schema for response_format '{spec.get('name')}': In context=({path}), 'default' is not permitted."
+        if "properties" in node:
+            missing = sorted(set(node["properties"]) - set(node.get("required", [])))
+            if missing:
+                return f"Invalid schema for response_format '{spec.get('name')}': In context=({path}), 'required' is missing {missing}."
+            if node.get("additionalProperties") is not False:
+                return f"Invalid schema for response_format '{spec.get('name')}': In context=({path}), 'additionalProperties' must be false."
+        pending.extend((f"{path}/{key}", child) for key, child in node.items())
+    return None
+
+def _candidate_ids(text: str) -> list[str]:
+    return re.findall(r"^\[([^\]]+)\]", text, re.M)
+
+def _synthetic_cards(query: str, count: int) -> list[dict]:
+    card_types = ["summary", "recommendation", "quote", "theme"]
+    return [
+        {
+            "type": card_types[i % len(card_types)],
+            "title": f"Perspective {i + 1} on {query[:40]}",
+            "description": f"A mock card exploring '{query}' from angle {i + 1}.",
+            "book_title": f"Mock Title {i + 1}",
+            "book_author": "Mock Author",
+            "quote": "A mock quote." if card_types[i % len(card_types)] == "quote" else None,
+            "source_page": f"Page {10 * (i + 1)}",
+            "clickable_link": "#",
+        }
+        for i in range(count)
+    ]
+
+def mock_analysis(query: str, label_noise: float = 0.0, seed: int = 0) -> QueryAnalysis:
+    """The keyword-rule analysis of a query, or for a seeded ``label_noise`` share of queries a different intent.
+
+    The choice depends only on the seed and the query, so a query is labelled the same way on every request.
+    """
+    analysis = classify_by_rules(query)
+    rng = random.Random(f"{seed}:{query}")
+    if rng.random() >= label_noise:
+        return analysis
+    others = [category for category in UserIntentCategory if category != analysis.user_intent_category]
+    return QueryAnalysis(
+        query_type=QueryType.GENERAL,
+        user_intent_category=rng.choice(others),
+        confidence_score=0.7,
+        reasoning="Mock label differing from the keyword rules"
+    )
+
+def synthesize_content(messages: list[dict], label_noise: float = 0.0, seed: int = 0) -> str:
+    """Build a plausible response for the repo's prompts from the request alone"""
+    system = messages[0]["content"] if messages else ""
+    user = messages[-1]["content"] if messages else ""
+    query = _quoted_query(user.split("\n\n")[0])
+    count = 1 + int(hashlib.md5(query.encode()).hexdigest(), 16) % 3
+
+    if "search engine for a content discovery system" in system:
+        analysis = mock_analysis(query, label_noise, seed)
+        if analysis.query_type.value == "specific_book":
+            result = {"book_recommendation": {"title": "Mock Book", "author": "Mock Author",
+                                              "reason": f"Mock answer for '{query}'.", "relevance_score": 0.9},
+                      "content_cards": []}
+        else:
+            result = {"book_recommendation": None, "content_cards": _synthetic_cards(query, count)}
+        return json.dumps({"analysis": json.loads(analysis.model_dump_json()), **result})
+
+    if "numbered list of search queries" in system:
+        return json.dumps([
+            {"index": int(index), **json.loads(mock_analysis(text, label_noise, seed).model_dump_json())}
+            for index, text in re.findall(r"^\[(\d+)\] (.*)$", user, re.M)
+        ])
+
+    if "analyzing search queries" in system:
+        return mock_analysis(query, label_noise, seed).model_dump_json()
+
+    if "content curator" in system:
+        ids = _candidate_ids(user)
+        if ids:
+            return json.dumps({"catalog_id": ids[0], "reason": f"Best catalog match for '{query}'.", "relevance_score": 0.9})
+        return json.dumps({"title": "Mock Book", "author": "Mock Author",
+                           "reason": f"Mock recommendation for '{query}'.", "relevance_score": 0.9})
+
+    if "content cards" in system:
+        ids = _candidate_ids(user)
+        if ids:
+            return json.dumps([
+                {"catalog_id": cid, "type": "recommendation", "title": f"Pick {i + 1}",
+                 "description": f"Why this catalog item fits '{query}'."}
+                for i, cid in enumerate(ids[:count])
+            ])
+        return json.dumps(_synthetic_cards(query, count))
+
+    return "{}"
+
+class MockLLMServer:
+    """Threaded OpenAI-compatible HTTP server with replay, latency and error injection"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, recordings_path: Optional[str] = None,
+                 latency_ms: float = 400.0, latency_sigma: float = 0.5, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, seed: int = 0, record_upstream: Optional[str] = None,
+                 requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None,
+                 label_noise: float = 0.2):
+        self.recordings_path = recordings_path
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.record_upstream = record_upstream
+        self.seed = seed
+        # Share of synthesized analyses that disagree with the keyword rules
+        self.label_noise = label_noise
+        self.recordings: dict[str, str] = {}
+        self.requests = 0
+        self.throttled = 0
+        # Emulated per-minute quota, reported in x-ratelimit-* headers
+        self.quota = {kind: TokenBucket(limit) for kind, limit in
+                      (("requests", requests_per_minute), ("tokens", tokens_per_minute)) if limit}
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        # Prompt prefixes seen so far, for simulating provider-side prompt caching
+        self._seen_prefixes: set[str] = set()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._embedder = HashingEmbedder(256)
+        if recordings_path and os.path.exists(recordings_path):
+            with open(recordings_path) as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.recordings[record["key"]] = record["content"]
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def independent_labels(self) -> bool:
+        """Whether analyses can differ from the keyword rules, so a speculation hit rate means something"""
+        return self.label_noise > 0 or bool(self.record_upstream)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockLLMServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="mock-llm", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def sample(self) -> tuple[float, Optional[int]]:
+        """Draw (latency seconds, error status or None) for one request"""
+        with self._lock:
+            self.requests += 1
+            latency = self.latency_ms / 1000 * self._rng.lognormvariate(0, self.latency_sigma) if self.latency_ms else 0.0
+            roll = self._rng.random()
+        if roll < self.rate_limit_rate:
+            return latency * 0.1, 429
+        if roll < self.rate_limit_rate + self.error_rate:
+            return latency, 500
+        return latency, None
+
+    def charge(self, tokens: int) -> tuple[dict, bool]:
+        """Take one request and ``tokens`` from the quota; returns the rate-limit headers and whether it was allowed"""
+        headers = {}
+        with self._lock:
+            now = time.monotonic()
+            amounts = {"requests": 1, "tokens": tokens}
+            waits = []
+            for kind, bucket in self.quota.items():
+                bucket.refill(now)
+                waits.append(bucket.wait_for(amounts[kind]))
+            allowed = not any(waits)
+            for kind, bucket in self.quota.items():
+                if allowed:
+                    bucket.take(amounts[kind])
+                headers[f"x-ratelimit-limit-{kind}"] = str(int(bucket.capacity))
+                headers[f"x-ratelimit-remaining-{kind}"] = str(max(0, int(bucket.level)))
+                headers[f"x-ratelimit-reset-{kind}"] = f"{(bucket.capacity - bucket.level) / bucket.rate:.3f}s"
+            if not allowed:
+                self.throttled += 1
+                headers["retry-after-ms"] = str(int(max(waits) * 1000) + 1)
+        return headers, allowed
+
+    def cached_prefix_tokens(self, messages: list[dict], prompt_tokens: int) -> int:
+        """Cached prompt tokens the way OpenAI reports them: only for prompts of 1024+ tokens,
+        in 128-token steps, covering the system prompt when it was seen before"""
+        if not messages or prompt_tokens < 1024:
+            return 0
+        prefix = str(messages[0].get("content", ""))
+        key = hashlib.sha256(prefix.encode()).hexdigest()
+        with self._lock:
+            seen = key in self._seen_prefixes
+            self._seen_prefixes.add(key)
+        prefix_tokens = len(prefix) // 4
+        if not seen or prefix_tokens < 1024:
+            return 0
+        return 1024 + (min(prefix_tokens, prompt_tokens) - 1024) // 128 * 128
+
+    def record_usage(self, usage: dict) -> None:
+        with self._lock:
+            self.prompt_tokens += usage["prompt_tokens"]
+            self.completion_tokens += usage["completion_tokens"]
+            self.cached_tokens += usage["prompt_tokens_details"]["cached_tokens"]
+
+    def content_for(self, body: dict) -> str:
+        key = request_key(body.get("messages", []))
+        if key in self.recordings:
+            return self.recordings[key]
+        if self.record_upstream:
+            content = self._fetch_upstream(body)
+            with self._lock:
+                self.recordings[key] = content
+                with open(self.recordings_path, "a") as f:
+                    f.write(json.dumps({"key": key, "messages": body.get("messages", []), "content": content}) + "\n")
+            return content
+        return synthesize_content(body.get("messages", []), self.label_noise, self.seed)
+
+    def _fetch_upstream(self, body: dict) -> str:
+        request = urllib.request.Request(
+            self.record_upstream.rstrip("/") + "/chat/completions",
+            data=json.dumps({**body, "stream": False}).encode(),
+            headers={"Content-Type": "application/json", "Authorization": f"Bearer {os.getenv('OPENAI_API_KEY', '')}"},
+        )
+        with urllib.request.urlopen(request) as response:
+            return json.load(response)["choices"][0]["message"]["content"]
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        return self._embedder(texts).tolist()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def handle(self):
+                # Cancelled or hedged clients hang up mid-response
+                try:
+                    super().handle()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def _send_json(self, status: int, payload: dict, headers: Optional[dict] = None):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/health"):
+                    self._send_json(200, {"status": "ok", "requests": server.requests, "throttled": server.throttled})
+                else:
+                    self._send_json(404, {"error": {"message": "not found"}})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                latency, error = server.sample()
+
+                if error:
+                    time.sleep(latency)
+                    headers = {"Retry-After": "1"} if error == 429 else None
+                    self._send_json(error, {"error": {"message": f"Mock error {error}", "type": "mock_error"}}, headers)
+                    return
+
+                if self.path.endswith("/embeddings"):
+                    texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+                    time.sleep(latency * 0.2)
+                    self._send_json(200, {
+                        "object": "list",
+                        "data": [{"object": "embedding", "index": i, "embedding": v} for i, v in enumerate(server.embed(texts))],
+                        "model": body.get("model", "mock"),
+                        "usage": {"prompt_tokens": sum(len(t) // 4 for t in texts), "total_tokens": sum(len(t) // 4 for t in texts)},
+                    })
+                    return
+
+                if not self.path.endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+
+                schema_error = strict_schema_error(body.get("response_format"))
+                if schema_error:
+                    self._send_json(400, {"error": {"message": schema_error, "type": "invalid_request_error"}})
+                    return
+
+                content = server.content_for(body)
+                prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 4
+                cached = server.cached_prefix_tokens(body.get("messages", []), prompt_tokens)
+                usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4,
+                         "total_tokens": prompt_tokens + len(content) // 4,
+                         "prompt_tokens_details": {"cached_tokens": cached}}
+                quota_headers, allowed = server.charge(usage["total_tokens"])
+                if not allowed:
+                    self._send_json(429, {"error": {"message": "Rate limit reached", "type": "requests"}}, quota_headers)
+                    return
+                server.record_usage(usage)
+                base = {"id": f"mock-{server.requests}", "created": int(time.time()), "model": body.get("model", "mock")}
+
+                if body.get("stream"):
+                    self._stream(base, content, latency, usage if body.get("stream_options", {}).get("include_usage") else None,
+                                 quota_headers)
+                    return
+
+                time.sleep(latency)
+                self._send_json(200, {
+                    **base,
+                    "object": "chat.completion",
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": content, "refusal": None}}],
+                    "usage": usage,
+                }, quota_headers)
+
+            def _stream(self, base: dict, content: str, latency: float, usage: Optional[dict], headers: dict):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                pieces = [content[i:i + 24] for i in range(0, len(content), 24)] or [""]
+                # A third of the latency goes to the first token, the rest is spread over the stream
+                time.sleep(latency * 0.3)
+                for i, piece in enumerate(pieces):
+                    delta = {"role": "assistant", "content": piece} if i == 0 else {"content": piece}
+                    chunk = {**base, "object": "chat.completion.chunk",
+                             "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+                    time.sleep(latency * 0.7 / len(pieces))
+                final = {**base, "object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+                self.wfile.write(f"data: {json.dumps(final)}\n\n".encode())
+                if usage:
+                    self.wfile.write(f"data: {json.dumps({**base, 'object': 'chat.completion.chunk', 'choices': [], 'usage': usage})}\n\n".encode())
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+        return Handler
+
+    @classmethod
+    def from_env(cls) -> "MockLLMServer":
+        """Build a server from MOCK_LLM_* environment variables"""
+        return cls(
+            recordings_path=os.getenv("MOCK_LLM_RECORDINGS"),
+            latency_ms=float(os.getenv("MOCK_LLM_LATENCY_MS", 400)),
+            latency_sigma=float(os.getenv("MOCK_LLM_LATENCY_SIGMA", 0.5)),
+            error_rate=float(os.getenv("MOCK_LLM_ERROR_RATE", 0.0)),
+            rate_limit_rate=float(os.getenv("MOCK_LLM_RATE_LIMIT_RATE", 0.0)),
+            seed=int(os.getenv("MOCK_LLM_SEED", 0)),
+            requests_per_minute=float(os.getenv("MOCK_LLM_RPM", 0)) or None,
+            tokens_per_minute=float(os.getenv("MOCK_LLM_TPM", 0)) or None,
+            label_noise=float(os.getenv("MOCK_LLM_LABEL_NOISE", 0.2)),
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--recordings", default=os.getenv("MOCK_LLM_RECORDINGS"))
+    parser.add_argument("--latency-ms", type=float, default=400.0, help="Median latency")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Log-normal spread of latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failing with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of requests failing with 429")
+    parser.add_argument("--rpm", type=float, default=None, help="Emulated requests-per-minute quota")
+    parser.add_argument("--tpm", type=float, default=None, help="Emulated tokens-per-minute quota")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label-noise", type=float, default=0.2, help="Share of analyses relabelled away from the keyword rules")
+    parser.add_argument("--record-upstream", help="Proxy to this base URL and record responses")
+    args = parser.parse_args()
+
+    if args.record_upstream and not args.recordings:
+        parser.error("--record-upstream needs --recordings")
+
+    server = MockLLMServer(args.host, args.port, args.recordings, args.latency_ms, args.latency_sigma,
+                           args.error_rate, args.rate_limit_rate, args.seed, args.record_upstream, args.rpm, args.tpm,
+                           args.label_noise)
+    print(f"Mock LLM server on {server.base_url} ({len(server.recordings)} recordings)")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
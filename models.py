@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 from typing import List, Optional, Literal
 from enum import Enum
 
@@ -20,6 +20,7 @@ class BookRecommendation(BaseModel):
     author: str
     reason: str
     relevance_score: float
+    catalog_id: Optional[str] = None
 
 class ContentCard(BaseModel):
     type: str
@@ -30,6 +31,7 @@ class ContentCard(BaseModel):
     quote: Optional[str] = None
     source_page: Optional[str] = None
     clickable_link: Optional[str] = None
+    catalog_id: Optional[str] = None
 
 class QueryAnalysis(BaseModel):
     query_type: QueryType
@@ -37,10 +39,35 @@ class QueryAnalysis(BaseModel):
     confidence_score: float
     reasoning: str
 
+    @field_validator("user_intent_category", mode="before")
+    @classmethod
+    def empty_category_is_none(cls, value):
+        """Specific-book analyses often come back with an empty category instead of null"""
+        return None if value == "" else value
+
+class SearchRequest(BaseModel):
+    model_config = ConfigDict(str_strip_whitespace=True)
+
+    query: str = Field(min_length=1, max_length=500)
+
 class SearchResponse(BaseModel):
     analysis: QueryAnalysis
     book_recommendation: Optional[BookRecommendation] = None
     content_cards: List[ContentCard] = []
+
+class CombinedSearchResponse(BaseModel):
+    """Combined-mode structured-output schema.
+
+    OpenAI strict structured outputs reject schema defaults, so unlike
+    SearchResponse every field is required and none has a default.
+    """
+    analysis: QueryAnalysis
+    book_recommendation: Optional[BookRecommendation]
+    content_cards: List[ContentCard]
+
+    def to_search_response(self) -> SearchResponse:
+        return SearchResponse(analysis=self.analysis, book_recommendation=self.book_recommendation,
+                              content_cards=self.content_cards)
     
 class PlaceholderFeature(BaseModel):
     name: str
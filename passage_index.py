@@ -0,0 +1,285 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+from typing import Optional
+import numpy as np
+from models import ContentCard, UserIntentCategory
+from vector_index import read_catalog
+
+# Intents whose cards are answered from indexed passages when one matches
+PASSAGE_INTENTS = frozenset({UserIntentCategory.QUOTE_CONCEPT_MEMORY, UserIntentCategory.PLOT_FRAGMENT_MEMORY})
+
+# Catalog fields holding quote-like passages, as strings or {"text", "page"} dicts
+PASSAGE_FIELDS = ("quotes", "excerpts")
+
+_WORD = re.compile(r"[a-z0-9']+")
+_QUOTED = re.compile(r"(?:^|\s)[\"'‘“]([^\"'’”]{3,})[\"'’”](?:\s|$|[?.!,])")
+
+STOPWORDS = frozenset("""
+    a an the of and or to in on for by at as is are was were be been it its this that these those
+    with from into than then so but not no he she they his her their we our you your i me my
+""".split())
+
+# Words describing the search rather than the passage; dropped from queries only
+QUERY_STOPWORDS = STOPWORDS | frozenset("""
+    content about book books novel story quote quotes passage line where which what who there
+    remember something someone said says saying idea concept called
+""".split())
+
+# Share of the ranking score given to adjacent word pairs, so passages with the query's phrasing rank first
+PHRASE_BONUS = 0.5
+
+def _stem(word: str) -> str:
+    """Crude suffix stripping so "counting primes" finds "counts prime" """
+    for suffix in ("ing", "ed", "s"):
+        if len(word) > len(suffix) + 2 and word.endswith(suffix):
+            return word[:-len(suffix)]
+    return word
+
+def _terms(text: str, stopwords: frozenset[str] = STOPWORDS) -> list[str]:
+    words = (word.replace("'", "") for word in _WORD.findall(text.casefold()))
+    return [_stem(word) for word in words if word and word not in stopwords]
+
+def _key(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+
+def _shingles(terms: list[str]) -> tuple[set[int], set[int]]:
+    """Hashed words and hashed adjacent word pairs"""
+    return {_key(term) for term in terms}, {_key(f"{a} {b}") for a, b in zip(terms, terms[1:])}
+
+def passages_of(item: dict) -> list[dict]:
+    """The item's quotes and excerpts, plus its summary for plot and scene recall"""
+    passages = []
+    for field in PASSAGE_FIELDS:
+        for passage in item.get(field, []):
+            passage = passage if isinstance(passage, dict) else {"text": passage}
+            if passage.get("text"):
+                page = passage.get("page", passage.get("timestamp"))
+                passages.append({"kind": "quote", "text": passage["text"], "page": str(page) if page is not None else None})
+    if item.get("summary"):
+        passages.append({"kind": "summary", "text": item["summary"], "page": None})
+    return passages
+
+class PassageIndex:
+    """Memory-mapped shingle index over catalog quotes, excerpts and summaries.
+
+    An index directory holds ``keys.npy`` (sorted 64-bit hashes of word and
+    word-pair shingles), ``offsets.npy`` and ``postings.npy`` (the passages of
+    each key, CSR style), ``passages.jsonl`` and ``meta.json``. A lookup is one
+    binary search per query shingle on the memory map, so the index is not read
+    into memory. A passage's score is the idf-weighted share of the query's
+    words it contains, which tolerates missing, extra and reordered words;
+    among equal scores, passages sharing more of the query's word pairs rank first.
+    """
+
+    def __init__(self, path: str, threshold: float = 0.5):
+        start = time.perf_counter()
+        self.path = path
+        self.threshold = threshold
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.keys = np.load(os.path.join(path, "keys.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self.postings = np.load(os.path.join(path, "postings.npy"), mmap_mode="r")
+        with open(os.path.join(path, "passages.jsonl")) as f:
+            self.passages = [json.loads(line) for line in f if line.strip()]
+        self.load_seconds = time.perf_counter() - start
+        self.lookups = 0
+        self.matches = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> Optional["PassageIndex"]:
+        """Load the index at PASSAGE_INDEX_PATH if it has been built and is not disabled"""
+        if os.getenv("PASSAGE_INDEX_ENABLED", "1").lower() in ("0", "false", "no"):
+            return None
+        path = os.getenv("PASSAGE_INDEX_PATH", "passage_index")
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            return None
+        return cls(path, threshold=float(os.getenv("PASSAGE_MATCH_THRESHOLD", 0.5)))
+
+    @classmethod
+    def build(cls, path: str, items: list[dict]) -> "PassageIndex":
+        """Write the passages of a catalog and their shingle postings to ``path``"""
+        os.makedirs(path, exist_ok=True)
+        passages, keys, rows = [], [], []
+        for item in items:
+            for passage in passages_of(item):
+                row = len(passages)
+                passages.append({
+                    **passage,
+                    "catalog_id": str(item["id"]),
+                    "title": item.get("title", ""),
+                    "author": item.get("author", ""),
+                    "url": item.get("url", "#"),
+                })
+                words, pairs = _shingles(_terms(passage["text"]))
+                keys.extend(words | pairs)
+                rows.extend([row] * len(words | pairs))
+
+        keys = np.asarray(keys, dtype=np.uint64)
+        rows = np.asarray(rows, dtype=np.int32)
+        order = np.lexsort((rows, keys))
+        unique_keys, starts = np.unique(keys[order], return_index=True)
+        np.save(os.path.join(path, "keys.npy"), unique_keys)
+        np.save(os.path.join(path, "offsets.npy"), np.append(starts, len(keys)).astype(np.int64))
+        np.save(os.path.join(path, "postings.npy"), rows[order])
+        with open(os.path.join(path, "passages.jsonl"), "w") as f:
+            for passage in passages:
+                f.write(json.dumps(passage) + "\n")
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"items": len(items), "passages": len(passages), "shingles": len(unique_keys)}, f, indent=2)
+        return cls(path)
+
+    def __len__(self) -> int:
+        return len(self.passages)
+
+    def _postings(self, key: int) -> np.ndarray:
+        position = int(np.searchsorted(self.keys, np.uint64(key)))
+        if position < len(self.keys) and int(self.keys[position]) == key:
+            return np.asarray(self.postings[self.offsets[position]:self.offsets[position + 1]])
+        return self.postings[:0]
+
+    def search(self, query: str, k: int = 5) -> list[tuple[dict, float]]:
+        """Best passage per catalog item for the top-k items, with the share of the query it contains.
+
+        A quoted phrase in the query ("content about 'flow state'") is searched
+        on its own, without the words around it.
+        """
+        quoted = _QUOTED.search(query)
+        words, pairs = _shingles(_terms(quoted.group(1) if quoted else query, QUERY_STOPWORDS))
+        if not words or not len(self.passages):
+            return []
+        rows, weights, phrase = [], [], []
+        totals = [0.0, 0.0]
+        for is_pair, keys in enumerate((words, pairs)):
+            for key in keys:
+                postings = self._postings(key)
+                # Shingles absent from the index keep full weight, so unmatched words lower every score
+                weight = math.log(1 + len(self.passages) / (len(postings) or 1))
+                totals[is_pair] += weight
+                rows.append(postings)
+                weights.append(np.full(len(postings), weight))
+                phrase.append(np.full(len(postings), is_pair, dtype=bool))
+        candidates, inverse = np.unique(np.concatenate(rows), return_inverse=True)
+        if not len(candidates):
+            return []
+        weights, phrase = np.concatenate(weights), np.concatenate(phrase)
+        scores = np.bincount(inverse[~phrase], weights=weights[~phrase], minlength=len(candidates)) / totals[0]
+        ranking = scores
+        if totals[1]:
+            ranking = scores + PHRASE_BONUS * np.bincount(inverse[phrase], weights=weights[phrase], minlength=len(candidates)) / totals[1]
+        results, seen = [], set()
+        for position in np.argsort(-ranking, kind="stable"):
+            passage = self.passages[candidates[position]]
+            if passage["catalog_id"] in seen:
+                continue
+            seen.add(passage["catalog_id"])
+            results.append((passage, float(scores[position])))
+            if len(results) == k:
+                break
+        return results
+
+    def match(self, query: str, k: int = 3) -> list[tuple[dict, float]]:
+        """Passages containing at least ``threshold`` of the query, best first"""
+        results = [(passage, score) for passage, score in self.search(query, k) if score >= self.threshold]
+        with self._lock:
+            self.lookups += 1
+            self.matches += bool(results)
+        return results
+
+    def stats(self) -> dict:
+        return {
+            "indexed_passages": len(self.passages),
+            "shingles": self.meta["shingles"],
+            "load_ms": self.load_seconds * 1000,
+            "lookups": self.lookups,
+            "matches": self.matches,
+            "match_rate": self.matches / self.lookups if self.lookups else 0.0,
+        }
+
+def _words(text: str, limit: int) -> str:
+    words = text.split()
+    return text if len(words) <= limit else " ".join(words[:limit]) + "…"
+
+def candidates_from_passages(matches: list[tuple[dict, float]]) -> list[dict]:
+    """Catalog-style candidates holding just the matched passage, as quote 0 or as the summary"""
+    candidates = []
+    for passage, _ in matches:
+        item = {"id": passage["catalog_id"], "title": passage["title"], "author": passage["author"], "url": passage["url"]}
+        if passage["kind"] == "quote":
+            item["quotes"] = [{"text": passage["text"], "page": passage["page"]}]
+        else:
+            item["summary"] = passage["text"]
+        candidates.append(item)
+    return candidates
+
+def with_passages(matches: list[tuple[dict, float]], candidates: list[dict]) -> list[dict]:
+    """Passage candidates first, then the retrieved candidates for other items"""
+    grounded = candidates_from_passages(matches)
+    ids = {item["id"] for item in grounded}
+    return grounded + [item for item in candidates if str(item["id"]) not in ids]
+
+def _describe(passage: dict, score: float) -> str:
+    if passage["kind"] == "summary":
+        return _words(passage["text"], 60)
+    source = " by ".join(part for part in (passage["title"], passage["author"]) if part) or "the catalog"
+    location = f", page {passage['page']}" if passage["page"] else ""
+    return f"Passage from {source}{location} containing {score:.0%} of the words you searched for."
+
+def cards_from_passages(matches: list[tuple[dict, float]]) -> list[ContentCard]:
+    """Quote cards with their page or timestamp, or summary cards, straight from the matched passages"""
+    return [
+        ContentCard(
+            type=passage["kind"],
+            title=passage["title"] or "Matching passage",
+            description=_describe(passage, score),
+            book_title=passage["title"] or None,
+            book_author=passage["author"] or None,
+            quote=passage["text"] if passage["kind"] == "quote" else None,
+            source_page=passage["page"],
+            clickable_link=passage["url"],
+            catalog_id=passage["catalog_id"]
+        )
+        for passage, score in matches
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query the quote and passage index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest = subparsers.add_parser("ingest", help="Index the quotes, excerpts and summaries of a JSONL catalog")
+    ingest.add_argument("catalog")
+    ingest.add_argument("--index", default=os.getenv("PASSAGE_INDEX_PATH", "passage_index"))
+
+    search = subparsers.add_parser("search", help="Query an index")
+    search.add_argument("query")
+    search.add_argument("--index", default=os.getenv("PASSAGE_INDEX_PATH", "passage_index"))
+    search.add_argument("-k", type=int, default=5)
+
+    args = parser.parse_args()
+
+    if args.command == "ingest":
+        items = read_catalog(args.catalog)
+        start = time.perf_counter()
+        index = PassageIndex.build(args.index, items)
+        print(f"Indexed {len(index)} passages in {time.perf_counter() - start:.1f}s -> {args.index}")
+        print(json.dumps(index.stats(), indent=2))
+        return
+
+    index = PassageIndex(args.index)
+    start = time.perf_counter()
+    results = index.search(args.query, args.k)
+    elapsed = (time.perf_counter() - start) * 1000
+    for passage, score in results:
+        location = f" ({passage['page']})" if passage["page"] else ""
+        print(f"{score:.2f}  {passage['title']}{location}: {_words(passage['text'], 20)}")
+    print(f"({elapsed:.2f} ms)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Token report for every prompt the search pipeline sends.
+
+For each prompt it prints the fixed prefix (system prompt, plus the JSON schema
+for structured output) and an example variable suffix (the user message).
+OpenAI caches prompt prefixes of at least 1024 tokens; the report marks which
+prompts qualify and checks that every category shares one prefix.
+
+  python prompt_tokens.py
+  python prompt_tokens.py --json
+"""
+
+import argparse
+import json
+from models import SearchResponse, UserIntentCategory
+from llm_backend import LLM_MODEL
+
+# Shortest prompt prefix OpenAI caches
+MIN_CACHEABLE_TOKENS = 1024
+
+EXAMPLE_QUERY = "How to deal with difficult colleagues"
+
+EXAMPLE_CANDIDATES = [
+    {
+        "id": f"book-{i}",
+        "title": f"Example Title {i}",
+        "author": "Example Author",
+        "summary": "A practical guide to understanding people at work, handling conflict and building trust. " * 2,
+        "quotes": ["The quality of your relationships determines the quality of your work."],
+    }
+    for i in range(8)
+]
+
+def count_tokens(text: str, model: str = LLM_MODEL) -> int:
+    """Exact count with tiktoken when installed, otherwise the ~4 characters per token estimate"""
+    try:
+        import tiktoken
+    except ImportError:
+        return max(1, len(text) // 4)
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        encoding = tiktoken.get_encoding("o200k_base")
+    return len(encoding.encode(text))
+
+def prompt_layouts() -> dict[str, tuple[list[dict], str]]:
+    """Example messages per prompt, plus any structured-output schema sent with them"""
+    from openai.lib._parsing import type_to_response_format_param
+    from llm_service import (
+        analysis_messages, batch_analysis_messages, recommendation_messages, card_messages, combined_messages
+    )
+
+    category = UserIntentCategory.PROBLEM_SOLVING
+    schema = json.dumps(type_to_response_format_param(SearchResponse))
+    return {
+        "analysis": (analysis_messages(EXAMPLE_QUERY), ""),
+        "analysis_batch": (batch_analysis_messages([EXAMPLE_QUERY] * 16), ""),
+        "recommendation": (recommendation_messages("What is the book Atomic Habits about?", []), ""),
+        "recommendation_grounded": (recommendation_messages("What is the book Atomic Habits about?", EXAMPLE_CANDIDATES), ""),
+        "cards": (card_messages(EXAMPLE_QUERY, category, []), ""),
+        "cards_grounded": (card_messages(EXAMPLE_QUERY, category, EXAMPLE_CANDIDATES), ""),
+        "combined": (combined_messages(EXAMPLE_QUERY), schema),
+    }
+
+def shared_card_prefix() -> bool:
+    """Whether every intent category sends the same card system prompt"""
+    from llm_service import card_messages
+    prefixes = {card_messages(EXAMPLE_QUERY, category, [])[0]["content"] for category in UserIntentCategory}
+    grounded = {
+        card_messages(EXAMPLE_QUERY, category, EXAMPLE_CANDIDATES)[0]["content"]
+        for category in UserIntentCategory
+    }
+    return len(prefixes) == 1 and len(grounded) == 1
+
+def report(model: str = LLM_MODEL) -> dict:
+    rows = {}
+    for name, (messages, schema) in prompt_layouts().items():
+        prefix = count_tokens(messages[0]["content"], model) + (count_tokens(schema, model) if schema else 0)
+        suffix = sum(count_tokens(message["content"], model) for message in messages[1:])
+        rows[name] = {
+            "prefix_tokens": prefix,
+            "suffix_tokens": suffix,
+            "total_tokens": prefix + suffix,
+            "cacheable": prefix >= MIN_CACHEABLE_TOKENS,
+        }
+    return {"model": model, "shared_card_prefix": shared_card_prefix(), "prompts": rows}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=LLM_MODEL, help="Model whose tokenizer to use (needs tiktoken)")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    result = report(args.model)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print(f"{'prompt':<25} {'prefix':>7} {'suffix':>7} {'total':>7}  cacheable")
+    for name, row in result["prompts"].items():
+        cacheable = "yes" if row["cacheable"] else f"no (<{MIN_CACHEABLE_TOKENS})"
+        print(f"{name:<25} {row['prefix_tokens']:>7} {row['suffix_tokens']:>7} {row['total_tokens']:>7}  {cacheable}")
+    print(f"All categories share one card prefix: {'yes' if result['shared_card_prefix'] else 'no'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+from prompt_tokens import count_tokens
+from resilience import UpstreamUnavailable
+from tracing import percentile
+
+# Priority classes; lower values are served first
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+# Completion tokens expected per stage, counted against the token budget before the call is sent
+EXPECTED_COMPLETION_TOKENS = {
+    "analyze": 100,
+    "analyze_batch": 1200,
+    "recommend": 200,
+    "cards": 700,
+    "combined": 800,
+}
+
+_priority: ContextVar[int] = ContextVar("llm_priority", default=INTERACTIVE)
+_DURATION = re.compile(r"([\d.]+)(ms|h|m|s)")
+_scheduler = None
+_scheduler_loaded = False
+_scheduler_lock = threading.Lock()
+
+class RateLimitShed(UpstreamUnavailable):
+    """Raised instead of queueing background work that would wait too long for quota"""
+
+@contextmanager
+def priority(level: int) -> Iterator[None]:
+    """Send the LLM calls made inside the block (and in tasks it starts) at ``level``"""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+def current_priority() -> int:
+    return _priority.get()
+
+def estimate_tokens(messages: list[dict], stage: str, model: str) -> int:
+    """Prompt tokens plus the completion tokens the stage usually produces"""
+    prompt = sum(count_tokens(str(message.get("content", "")), model) + 4 for message in messages)
+    return prompt + EXPECTED_COMPLETION_TOKENS.get(stage.removesuffix("_stream"), 500)
+
+def parse_duration(value: str) -> Optional[float]:
+    """Seconds in a rate-limit reset header such as "1s", "6m0s" or "250ms" """
+    parts = _DURATION.findall(value or "")
+    if not parts:
+        return None
+    scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(number) * scale[unit] for number, unit in parts)
+
+class TokenBucket:
+    """Budget of ``capacity`` units, refilled continuously over ``period`` seconds"""
+
+    def __init__(self, capacity: float, period: float = 60.0):
+        self.capacity = float(capacity)
+        self.period = period
+        self.level = float(capacity)
+        self.updated = time.monotonic()
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / self.period
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, amount: float, reserve: float = 0.0) -> float:
+        """Seconds until ``amount`` can be taken while leaving ``reserve`` of the capacity"""
+        needed = min(amount, self.capacity) + reserve * self.capacity - self.level
+        return max(0.0, needed / self.rate)
+
+    def take(self, amount: float) -> None:
+        self.level -= min(amount, self.capacity)
+
+    def observe(self, limit: Optional[float], remaining: Optional[float], now: float) -> None:
+        """Adopt the limit the server reported, and its remaining budget when that is lower.
+
+        The server's count misses calls already granted here but not yet received,
+        so it may lower the level (usage by other processes) but never raise it.
+        """
+        self.refill(now)
+        if limit:
+            self.capacity = limit
+        if remaining is not None:
+            self.level = min(self.level, self.capacity, remaining)
+
+class _Lane:
+    """Request and token buckets of one model, and the calls waiting for them"""
+
+    def __init__(self, requests_per_minute: Optional[float], tokens_per_minute: Optional[float]):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.blocked_until = 0.0
+        # Heap of (priority, sequence, tokens); the head is the next call to send
+        self.waiting: list[tuple[int, int, int]] = []
+
+    def delay(self, level: int, tokens: int, reserve: float, now: float) -> float:
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        reserve = reserve if level != INTERACTIVE else 0.0
+        delay = 0.0
+        for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+            if bucket is not None:
+                bucket.refill(now)
+                delay = max(delay, bucket.wait_for(amount, reserve))
+        return delay
+
+    def take(self, tokens: int) -> None:
+        for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+            if bucket is not None:
+                bucket.take(amount)
+
+class RateLimitScheduler:
+    """Token-bucket admission of LLM calls per model, by priority class.
+
+    Each call reserves one request and its estimated tokens before it is sent.
+    Waiting calls are served interactive first, then in arrival order. Background
+    calls may not use the last ``interactive_reserve`` of either budget, and are
+    shed with ``RateLimitShed`` when more than ``background_max_queue`` are waiting
+    or one has waited ``background_max_wait`` seconds. Limits start from the
+    configured values, are replaced by the ``x-ratelimit-*`` headers of every
+    response, and a 429 pauses the model's lane for its Retry-After.
+    """
+
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None,
+                 interactive_reserve: float = 0.2, background_max_wait: float = 30.0, background_max_queue: int = 64):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.interactive_reserve = interactive_reserve
+        self.background_max_wait = background_max_wait
+        self.background_max_queue = background_max_queue
+        self._lanes: dict[str, _Lane] = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self.granted = {level: 0 for level in PRIORITY_NAMES}
+        self.shed = 0
+        self.throttled = 0
+        self.header_updates = 0
+        # Seconds each granted call waited for quota, per priority
+        self.waits = {level: deque(maxlen=1000) for level in PRIORITY_NAMES}
+
+    @classmethod
+    def from_env(cls) -> Optional["RateLimitScheduler"]:
+        """Build a scheduler from RATE_LIMIT_* variables; None when RATE_LIMIT_ENABLED=0"""
+        if os.getenv("RATE_LIMIT_ENABLED", "1").lower() in ("0", "false", "no"):
+            return None
+        requests_per_minute = os.getenv("RATE_LIMIT_RPM")
+        tokens_per_minute = os.getenv("RATE_LIMIT_TPM")
+        return cls(
+            requests_per_minute=float(requests_per_minute) if requests_per_minute else None,
+            tokens_per_minute=float(tokens_per_minute) if tokens_per_minute else None,
+            interactive_reserve=float(os.getenv("RATE_LIMIT_INTERACTIVE_RESERVE", 0.2)),
+            background_max_wait=float(os.getenv("RATE_LIMIT_BACKGROUND_MAX_WAIT", 30.0)),
+            background_max_queue=int(os.getenv("RATE_LIMIT_BACKGROUND_MAX_QUEUE", 64)),
+        )
+
+    def _lane(self, model: str) -> _Lane:
+        lane = self._lanes.get(model)
+        if lane is None:
+            lane = self._lanes[model] = _Lane(self.requests_per_minute, self.tokens_per_minute)
+        return lane
+
+    def _enqueue(self, model: str, tokens: int, level: int) -> tuple[int, int, int]:
+        with self._condition:
+            lane = self._lane(model)
+            if level != INTERACTIVE and sum(1 for waiting in lane.waiting if waiting[0] != INTERACTIVE) >= self.background_max_queue:
+                self.shed += 1
+                raise RateLimitShed(f"Rate limit queue for {model} is full; background call shed")
+            ticket = (level, next(self._sequence), tokens)
+            heapq.heappush(lane.waiting, ticket)
+            return ticket
+
+    def _try(self, model: str, ticket: tuple[int, int, int], waited: float) -> float:
+        """Grant the ticket if it is first in line and quota allows; otherwise seconds to wait (holds the lock)"""
+        lane = self._lanes[model]
+        level, _, tokens = ticket
+        now = time.monotonic()
+        head = lane.waiting[0]
+        delay = lane.delay(head[0], head[2], self.interactive_reserve, now)
+        if head == ticket and delay <= 0:
+            heapq.heappop(lane.waiting)
+            lane.take(tokens)
+            self.granted[level] += 1
+            self.waits[level].append(waited)
+            self._condition.notify_all()
+            return 0.0
+        if level != INTERACTIVE and waited + delay > self.background_max_wait:
+            self._withdraw(lane, ticket)
+            self.shed += 1
+            raise RateLimitShed(f"Background call would wait over {self.background_max_wait:.0f}s for {model} quota")
+        # Calls behind the head are woken when it is granted; the timeout only guards against missed updates
+        return max(delay, 0.005) if head == ticket else max(delay, 0.05)
+
+    def _withdraw(self, lane: _Lane, ticket: tuple[int, int, int]) -> None:
+        if ticket in lane.waiting:
+            lane.waiting.remove(ticket)
+            heapq.heapify(lane.waiting)
+            self._condition.notify_all()
+
+    def acquire(self, model: str, tokens: int, level: Optional[int] = None) -> float:
+        """Block until a call may be sent; returns the seconds it waited"""
+        level = current_priority() if level is None else level
+        ticket = self._enqueue(model, tokens, level)
+        start = time.monotonic()
+        with self._condition:
+            try:
+                while True:
+                    waited = time.monotonic() - start
+                    delay = self._try(model, ticket, waited)
+                    if not delay:
+                        return waited
+                    self._condition.wait(delay)
+            except BaseException:
+                self._withdraw(self._lanes[model], ticket)
+                raise
+
+    async def aacquire(self, model: str, tokens: int, level: Optional[int] = None) -> float:
+        """Async counterpart of ``acquire``; waiting sleeps instead of blocking the event loop"""
+        level = current_priority() if level is None else level
+        ticket = self._enqueue(model, tokens, level)
+        start = time.monotonic()
+        try:
+            while True:
+                waited = time.monotonic() - start
+                with self._condition:
+                    delay = self._try(model, ticket, waited)
+                if not delay:
+                    return waited
+                # Polled, since a grant elsewhere cannot wake a coroutine through the condition
+                await asyncio.sleep(min(delay, 0.05))
+        except BaseException:
+            with self._condition:
+                self._withdraw(self._lanes[model], ticket)
+            raise
+
+    def observe(self, model: str, status: int, headers) -> None:
+        """Update a model's budgets from the rate-limit headers of a response"""
+        def number(name: str) -> Optional[float]:
+            try:
+                return float(headers[name]) if headers.get(name) else None
+            except ValueError:
+                return None
+
+        limits = {kind: (number(f"x-ratelimit-limit-{kind}"), number(f"x-ratelimit-remaining-{kind}"))
+                  for kind in ("requests", "tokens")}
+        with self._condition:
+            lane = self._lane(model)
+            now = time.monotonic()
+            for kind, (limit, remaining) in limits.items():
+                if limit is None and remaining is None:
+                    continue
+                if getattr(lane, kind) is None and limit:
+                    setattr(lane, kind, TokenBucket(limit))
+                if getattr(lane, kind) is not None:
+                    getattr(lane, kind).observe(limit, remaining, now)
+                    self.header_updates += 1
+            if status == 429:
+                self.throttled += 1
+                delay = number("retry-after-ms")
+                delay = delay / 1000 if delay is not None else number("retry-after")
+                if delay is None:
+                    delay = parse_duration(headers.get("x-ratelimit-reset-requests", "")) or 1.0
+                lane.blocked_until = max(lane.blocked_until, now + delay)
+            self._condition.notify_all()
+
+    def observe_response(self, response) -> None:
+        """HTTP client response hook; the model is read from the request body"""
+        try:
+            model = json.loads(response.request.content).get("model")
+        except (ValueError, AttributeError):
+            return
+        if model:
+            self.observe(model, response.status_code, response.headers)
+
+    async def aobserve_response(self, response) -> None:
+        self.observe_response(response)
+
+    def stats(self) -> dict:
+        with self._condition:
+            lanes = {
+                model: {
+                    "requests_available": round(lane.requests.level, 1) if lane.requests else None,
+                    "requests_per_minute": lane.requests.capacity if lane.requests else None,
+                    "tokens_available": round(lane.tokens.level) if lane.tokens else None,
+                    "tokens_per_minute": lane.tokens.capacity if lane.tokens else None,
+                    "waiting": len(lane.waiting),
+                }
+                for model, lane in self._lanes.items()
+            }
+            waits = {level: list(samples) for level, samples in self.waits.items()}
+            stats = {"shed": self.shed, "throttled": self.throttled, "header_updates": self.header_updates}
+        for level, name in PRIORITY_NAMES.items():
+            stats[f"{name}_granted"] = self.granted[level]
+            stats[f"{name}_wait_p50_ms"] = percentile(waits[level], 0.5) * 1000
+            stats[f"{name}_wait_p95_ms"] = percentile(waits[level], 0.95) * 1000
+        stats["models"] = lanes
+        return stats
+
+def get_scheduler() -> Optional[RateLimitScheduler]:
+    """The process-wide scheduler shared by every client and guard, built on first use"""
+    global _scheduler, _scheduler_loaded
+    with _scheduler_lock:
+        if not _scheduler_loaded:
+            _scheduler = RateLimitScheduler.from_env()
+            _scheduler_loaded = True
+        return _scheduler
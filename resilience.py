@@ -0,0 +1,408 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Awaitable, Callable, Optional, TypeVar
+import openai
+from tracing import percentile
+
+T = TypeVar("T")
+
+# Seconds each stage may take per attempt; streamed cards share the cards budget
+DEFAULT_STAGE_TIMEOUTS = {
+    "analyze": 10.0,
+    "analyze_batch": 15.0,
+    "recommend": 20.0,
+    "cards": 30.0,
+    "combined": 30.0,
+}
+
+class UpstreamUnavailable(Exception):
+    """Raised without calling the API while the circuit breaker is open"""
+
+def is_retryable(error: Exception) -> bool:
+    """Rate limits, server errors, timeouts and dropped connections are worth retrying"""
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Delay the server asked for in Retry-After headers, in seconds"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+def is_auth_error(error: Exception) -> bool:
+    """A rejected or unauthorized key fails every request until the configuration is fixed"""
+    return isinstance(error, (openai.AuthenticationError, openai.PermissionDeniedError))
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, honouring Retry-After.
+
+    Backoff is capped at ``max_delay``; a server's Retry-After is waited out in
+    full up to ``max_retry_after``, and a longer one ends the retries instead of
+    retrying before the server is ready.
+    """
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.25, max_delay: float = 4.0,
+                 max_retry_after: float = 30.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+
+    def delay(self, attempt: int, error: Exception) -> Optional[float]:
+        """Seconds before the next attempt, or None when the server asked for more than ``max_retry_after``"""
+        requested = retry_after(error)
+        if requested is not None and requested > self.max_retry_after:
+            return None
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(backoff, requested or 0.0)
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive upstream failures.
+
+    While open every call is refused. After ``reset_seconds`` a single probe is let
+    through; its success closes the breaker and its failure opens it again. A
+    probe that ends without an outcome (cancelled) is released for the next call.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.times_opened = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def available(self) -> bool:
+        """Whether a call would currently be let through, without claiming the probe"""
+        state = self.state
+        return state == "closed" or (state == "half_open" and not self._probing)
+
+    def allow(self) -> Optional[str]:
+        """Claim permission for one call: "closed", "probe" when it is the half-open probe, or None if refused"""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return "closed"
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return "probe"
+            return None
+
+    def release_probe(self) -> None:
+        """Give up a claimed probe without recording an outcome, so another call can probe"""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._probing or (self.opened_at is None and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                self.times_opened += 1
+            self._probing = False
+
+class UpstreamGuard:
+    """Per-stage timeouts, jittered retries, optional hedging and a circuit breaker around API calls.
+
+    ``request`` callables receive the timeout in seconds for one attempt. Hedging
+    sends a duplicate request when the first has not answered after the stage's
+    observed p95 latency (or ``hedge_after`` seconds) and keeps the faster one.
+    With a rate-limit scheduler, calls that name their ``model`` and estimated
+    ``tokens`` wait for quota in their priority class before every request they
+    send, retries and hedged duplicates included; background calls are never hedged.
+    """
+
+    def __init__(self, retry: Optional[RetryPolicy] = None, breaker: Optional[CircuitBreaker] = None,
+                 timeouts: Optional[dict[str, float]] = None, default_timeout: float = 30.0,
+                 hedging: bool = False, hedge_after: Optional[float] = None, hedge_min_samples: int = 20,
+                 scheduler=None):
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        # RateLimitScheduler shared with the clients' response hooks, or None to send calls unscheduled
+        self.scheduler = scheduler
+        self.timeouts = {**DEFAULT_STAGE_TIMEOUTS, **(timeouts or {})}
+        self.default_timeout = default_timeout
+        self.hedging = hedging
+        self.hedge_after = hedge_after
+        self.hedge_min_samples = hedge_min_samples
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.rejected = 0
+        self._latencies: dict[str, deque[float]] = {}
+        self._lock = threading.Lock()
+        self._hedge_pool: Optional[ThreadPoolExecutor] = None
+
+    @classmethod
+    def from_env(cls) -> "UpstreamGuard":
+        """Build a guard from LLM_RETRY_*, LLM_TIMEOUT_*, LLM_HEDGE* and LLM_BREAKER_* variables, with the shared scheduler"""
+        from rate_limit import get_scheduler
+        timeouts = {
+            stage: float(os.environ[f"LLM_TIMEOUT_{stage.upper()}"])
+            for stage in DEFAULT_STAGE_TIMEOUTS if os.getenv(f"LLM_TIMEOUT_{stage.upper()}")
+        }
+        hedge_after_ms = os.getenv("LLM_HEDGE_AFTER_MS")
+        return cls(
+            retry=RetryPolicy(
+                max_attempts=int(os.getenv("LLM_RETRY_ATTEMPTS", 3)),
+                base_delay=float(os.getenv("LLM_RETRY_BASE_DELAY", 0.25)),
+                max_delay=float(os.getenv("LLM_RETRY_MAX_DELAY", 4.0)),
+                max_retry_after=float(os.getenv("LLM_RETRY_MAX_RETRY_AFTER", 30.0)),
+            ),
+            breaker=CircuitBreaker(
+                failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", 5)),
+                reset_seconds=float(os.getenv("LLM_BREAKER_RESET_SECONDS", 30.0)),
+            ),
+            timeouts=timeouts,
+            default_timeout=float(os.getenv("LLM_TIMEOUT_SECONDS", 30.0)),
+            hedging=os.getenv("LLM_HEDGE", "0").lower() in ("1", "true", "yes"),
+            hedge_after=float(hedge_after_ms) / 1000 if hedge_after_ms else None,
+            hedge_min_samples=int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 20)),
+            scheduler=get_scheduler(),
+        )
+
+    def available(self) -> bool:
+        """False while the breaker is open; callers should serve local results instead"""
+        return self.breaker.available()
+
+    def timeout_for(self, stage: str) -> float:
+        return self.timeouts.get(stage.removesuffix("_stream"), self.default_timeout)
+
+    def hedge_delay(self, stage: str) -> Optional[float]:
+        """Seconds to wait before hedging, or None when hedging is off or there is too little data"""
+        if not self.hedging:
+            return None
+        if self.hedge_after is not None:
+            return self.hedge_after
+        with self._lock:
+            samples = list(self._latencies.get(stage, ()))
+        if len(samples) < self.hedge_min_samples:
+            return None
+        return percentile(samples, 0.95)
+
+    def _observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._latencies.setdefault(stage, deque(maxlen=500)).append(seconds)
+
+    def _waited(self, waited: float, span) -> None:
+        if span is not None and waited > 0.001:
+            span.set("rate_limit_wait_ms", round(span.attributes.get("rate_limit_wait_ms", 0) + waited * 1000, 1))
+
+    def _quota(self, model: Optional[str], tokens: int) -> Optional[tuple[str, int, int]]:
+        """(model, tokens, priority) each request of this call acquires, or None when unscheduled"""
+        from rate_limit import current_priority
+        if self.scheduler is None or model is None:
+            return None
+        return model, tokens, current_priority()
+
+    def _acquire(self, quota: Optional[tuple[str, int, int]], span) -> None:
+        if quota is not None:
+            self._waited(self.scheduler.acquire(*quota), span)
+
+    async def _aacquire(self, quota: Optional[tuple[str, int, int]], span) -> None:
+        if quota is not None:
+            self._waited(await self.scheduler.aacquire(*quota), span)
+
+    def _admit(self) -> bool:
+        """Claim permission from the breaker; True when this call is the half-open probe"""
+        permission = self.breaker.allow()
+        if permission is None:
+            with self._lock:
+                self.rejected += 1
+            raise UpstreamUnavailable("Circuit breaker open: upstream LLM is unhealthy")
+        return permission == "probe"
+
+    def _failed(self, stage: str, attempt: int, error: Exception, span) -> Optional[float]:
+        """Record a failed attempt and return the delay before retrying, or None to give up"""
+        if not is_retryable(error):
+            if is_auth_error(error):
+                self.breaker.record_failure()
+            # Other bad requests and local errors say nothing about upstream health, so the breaker is left alone
+            return None
+        delay = self.retry.delay(attempt, error) if attempt + 1 < self.retry.max_attempts else None
+        if delay is None:
+            self.breaker.record_failure()
+            return None
+        with self._lock:
+            self.retries += 1
+        if span is not None:
+            span.set("retries", attempt + 1)
+        print(f"Retrying {stage} after {type(error).__name__}: {str(error)}")
+        return delay
+
+    def _succeeded(self, stage: str, seconds: float, hedge_won: bool, span) -> None:
+        self.breaker.record_success()
+        self._observe(stage, seconds)
+        if hedge_won:
+            with self._lock:
+                self.hedge_wins += 1
+            if span is not None:
+                span.set("hedge_won", True)
+
+    def call(self, stage: str, request: Callable[[float], T], span=None, hedge: bool = True,
+             model: Optional[str] = None, tokens: int = 0) -> T:
+        """Run a blocking request with rate limiting, retries, hedging and the breaker"""
+        from rate_limit import INTERACTIVE
+        quota = self._quota(model, tokens)
+        hedge = hedge and (quota is None or quota[2] == INTERACTIVE)
+        probe = self._admit()
+        try:
+            return self._attempts(stage, request, span, hedge, quota)
+        except BaseException:
+            # Cancelled or interrupted before an outcome was recorded; never keep the probe claimed
+            if probe:
+                self.breaker.release_probe()
+            raise
+
+    def _attempts(self, stage: str, request: Callable[[float], T], span, hedge: bool, quota) -> T:
+        timeout = self.timeout_for(stage)
+        attempt = 0
+        while True:
+            self._acquire(quota, span)
+            start = time.perf_counter()
+            try:
+                result, hedge_won = self._hedged(stage, request, timeout, span, quota) if hedge else (request(timeout), False)
+            except Exception as e:
+                delay = self._failed(stage, attempt, e, span)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self._succeeded(stage, time.perf_counter() - start, hedge_won, span)
+            return result
+
+    def _hedged(self, stage: str, request: Callable[[float], T], timeout: float, span, quota) -> tuple[T, bool]:
+        delay = self.hedge_delay(stage)
+        if delay is None:
+            return request(timeout), False
+        with self._lock:
+            if self._hedge_pool is None:
+                self._hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="hedge")
+        primary = self._hedge_pool.submit(request, timeout)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result(), False
+        with self._lock:
+            self.hedges += 1
+        if span is not None:
+            span.set("hedged", True)
+
+        def backup_request(timeout: float) -> T:
+            # The duplicate is a request of its own and needs its own quota
+            self._acquire(quota, span)
+            return request(timeout)
+
+        backup = self._hedge_pool.submit(backup_request, timeout)
+        pending = {primary, backup}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # The slower request keeps running in its thread; its result is dropped
+                    return future.result(), future is backup
+        return primary.result(), False
+
+    async def acall(self, stage: str, request: Callable[[float], Awaitable[T]], span=None, hedge: bool = True,
+                    model: Optional[str] = None, tokens: int = 0) -> T:
+        """Async counterpart of ``call``; the losing hedge is cancelled"""
+        from rate_limit import INTERACTIVE
+        quota = self._quota(model, tokens)
+        hedge = hedge and (quota is None or quota[2] == INTERACTIVE)
+        probe = self._admit()
+        try:
+            return await self._aattempts(stage, request, span, hedge, quota)
+        except BaseException:
+            if probe:
+                self.breaker.release_probe()
+            raise
+
+    async def _aattempts(self, stage: str, request: Callable[[float], Awaitable[T]], span, hedge: bool, quota) -> T:
+        timeout = self.timeout_for(stage)
+        attempt = 0
+        while True:
+            await self._aacquire(quota, span)
+            start = time.perf_counter()
+            try:
+                result, hedge_won = await self._ahedged(stage, request, timeout, span, quota) if hedge else (await request(timeout), False)
+            except Exception as e:
+                delay = self._failed(stage, attempt, e, span)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self._succeeded(stage, time.perf_counter() - start, hedge_won, span)
+            return result
+
+    async def _ahedged(self, stage: str, request: Callable[[float], Awaitable[T]], timeout: float, span, quota) -> tuple[T, bool]:
+        delay = self.hedge_delay(stage)
+        if delay is None:
+            return await request(timeout), False
+        primary = asyncio.ensure_future(request(timeout))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result(), False
+        with self._lock:
+            self.hedges += 1
+        if span is not None:
+            span.set("hedged", True)
+
+        async def backup_request(timeout: float) -> T:
+            await self._aacquire(quota, span)
+            return await request(timeout)
+
+        backup = asyncio.ensure_future(backup_request(timeout))
+        pending = {primary, backup}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result(), task is backup
+            return primary.result(), False
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "breaker": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "times_opened": self.breaker.times_opened,
+            "rejected": self.rejected,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            **({"rate_limit": self.scheduler.stats()} if self.scheduler is not None else {}),
+        }
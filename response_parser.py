@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Parsing and validation of model responses.
+
+The first JSON value is located with two string scans and decoded by C code
+(pydantic-core, orjson when installed, or the standard library), so code fences
+and stray prose around the JSON no longer cause a fallback. Typed responses are
+validated straight from the JSON text by pre-built pydantic TypeAdapters.
+
+Run it to compare with the previous strip/replace/json.loads/model path:
+
+  python response_parser.py --iterations 20000
+"""
+
+import argparse
+import json
+import time
+from typing import Any, Optional
+from pydantic import TypeAdapter, ValidationError
+from models import QueryAnalysis, BookRecommendation, ContentCard, SearchResponse
+from retrieval import cards_from_candidates, recommendation_from_candidate
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson is several times faster than the standard library for the small objects
+# decoded here; both raise ValueError subclasses on invalid input
+loads = orjson.loads if orjson is not None else json.loads
+
+ANALYSIS_ADAPTER = TypeAdapter(QueryAnalysis)
+RECOMMENDATION_ADAPTER = TypeAdapter(BookRecommendation)
+CARDS_ADAPTER = TypeAdapter(list[ContentCard])
+SEARCH_RESPONSE_ADAPTER = TypeAdapter(SearchResponse)
+
+_decoder = json.JSONDecoder()
+
+def _first_open(text: str, position: int, opener: Optional[str] = None) -> int:
+    """Index of the first ``opener`` (default '{' or '[') at or after ``position``, or -1"""
+    if opener is not None:
+        return text.find(opener, position)
+    brace = text.find("{", position)
+    bracket = text.find("[", position)
+    if brace < 0 or bracket < 0:
+        return max(brace, bracket)
+    return min(brace, bracket)
+
+def extract_json(text: Optional[str], opener: Optional[str] = None) -> str:
+    """The response from its first opening bracket to its last closing one"""
+    start = _first_open(text or "", 0, opener)
+    if start < 0:
+        raise ValueError("No JSON in response" if text and text.strip() else "Empty response from OpenAI")
+    end = max(text.rfind("}"), text.rfind("]")) + 1
+    # A truncated value has no closing bracket; keep all of it so decoding reports why
+    return text[start:end] if end > start else text[start:]
+
+def loads_first(text: Optional[str], opener: Optional[str] = None) -> Any:
+    """Decode the first JSON value in a response, ignoring fences and prose around it.
+
+    ``opener`` restricts the search to objects ('{') or arrays ('[') when the
+    expected shape is known, so brackets in leading prose are skipped.
+    """
+    candidate = extract_json(text, opener)
+    try:
+        return loads(candidate)
+    except ValueError:
+        pass
+    # Prose after the value, or a bracket in prose before it: decode from each opening bracket in turn
+    position = 0
+    while position >= 0:
+        try:
+            return _decoder.raw_decode(candidate, position)[0]
+        except json.JSONDecodeError:
+            position = _first_open(candidate, position + 1, opener)
+    raise ValueError("No valid JSON value in response")
+
+def _validate(adapter: TypeAdapter, text: Optional[str], opener: str):
+    candidate = extract_json(text, opener)
+    try:
+        return adapter.validate_json(candidate)
+    except ValidationError as e:
+        # Schema errors are real; only a JSON syntax error means the value needs to be located first
+        if not any(error["type"] == "json_invalid" for error in e.errors()):
+            raise
+    return adapter.validate_python(loads_first(candidate, opener))
+
+def parse_query_analysis(text: Optional[str]) -> QueryAnalysis:
+    """Validate an analysis response"""
+    return _validate(ANALYSIS_ADAPTER, text, "{")
+
+def parse_recommendation(text: Optional[str], candidates: list[dict]) -> BookRecommendation:
+    """Validate a recommendation response, filled from the catalog when grounded"""
+    if candidates:
+        return recommendation_from_candidate(loads_first(text, "{"), candidates)
+    return _validate(RECOMMENDATION_ADAPTER, text, "{")
+
+def parse_cards(text: Optional[str], candidates: list[dict]) -> list[ContentCard]:
+    """Validate a card list response, filled from the catalog when grounded"""
+    if candidates:
+        return cards_from_candidates(loads_first(text, "["), candidates)
+    return _validate(CARDS_ADAPTER, text, "[")
+
+def parse_search_response(text: Optional[str]) -> SearchResponse:
+    """Validate a combined-mode response"""
+    return _validate(SEARCH_RESPONSE_ADAPTER, text, "{")
+
+def parse_batch_analysis(text: Optional[str], count: int) -> list[Optional[QueryAnalysis]]:
+    """Analyses of a batched classification in query order; None where an entry is missing or invalid"""
+    results: list[Optional[QueryAnalysis]] = [None] * count
+    entries = loads_first(text, "[")
+    if not isinstance(entries, list):
+        raise ValueError("Batch analysis response is not a JSON array")
+    for entry in entries:
+        try:
+            index = int(entry["index"])
+            analysis = ANALYSIS_ADAPTER.validate_python(entry)
+        except (ValueError, KeyError, TypeError):
+            continue
+        if 0 <= index < count:
+            results[index] = analysis
+    return results
+
+class JsonArrayStreamParser:
+    """Incrementally extract the objects of a streamed top-level JSON array.
+
+    Text outside of objects (the enclosing brackets, commas, code fences) is
+    skipped, so each object is decoded as soon as its closing brace arrives.
+    """
+
+    def __init__(self):
+        self._buffer: list[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, text: str) -> list[dict]:
+        """Consume a chunk of text and return the objects it completed"""
+        objects = []
+        for char in text:
+            if self._depth == 0:
+                if char == "{":
+                    self._buffer = [char]
+                    self._depth = 1
+                continue
+            self._buffer.append(char)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    objects.append(loads("".join(self._buffer)))
+        return objects
+
+def _legacy_parse(kind: str, text: str):
+    """The parsing path this module replaced, kept for the benchmark"""
+    text = text.strip()
+    if text.startswith('```json'):
+        text = text.replace('```json', '').replace('```', '').strip()
+    if kind == "combined":
+        return SearchResponse.model_validate_json(text)
+    result = json.loads(text)
+    if kind == "analysis":
+        return QueryAnalysis(
+            query_type=result["query_type"],
+            user_intent_category=result.get("user_intent_category") or None,
+            confidence_score=result["confidence_score"],
+            reasoning=result["reasoning"]
+        )
+    return [ContentCard(**card) for card in result]
+
+PARSERS = {
+    "analysis": parse_query_analysis,
+    "cards": lambda text: parse_cards(text, []),
+    "combined": parse_search_response,
+}
+
+def benchmark(payloads: list[tuple[str, str]], iterations: int) -> dict:
+    """Microseconds per parse and failures for the legacy and current paths"""
+    results = {}
+    for name, parse in (("legacy", _legacy_parse), ("current", lambda kind, text: PARSERS[kind](text))):
+        failures = 0
+        start = time.perf_counter()
+        for i in range(iterations):
+            kind, text = payloads[i % len(payloads)]
+            try:
+                parse(kind, text)
+            except ValueError:
+                failures += 1
+        elapsed = time.perf_counter() - start
+        results[name] = {"us_per_parse": elapsed / iterations * 1e6, "failures": failures}
+    return results
+
+def main():
+    from benchmark import DEFAULT_QUERIES, parse_payloads
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    clean = parse_payloads(DEFAULT_QUERIES)
+    # The same payloads as a chatty model might return them
+    chatty = [(kind, f"Here is the JSON you asked for:\n```json\n{text.removeprefix('```json').removesuffix('```').strip()}\n```\nLet me know if you need more.")
+              for kind, text in clean]
+    print(f"JSON decoder: {'orjson' if orjson is not None else 'json'}")
+    print(f"{'payloads':<8} {'path':<8} {'us/parse':>9} {'failures':>9}")
+    for label, payloads in (("clean", clean), ("chatty", chatty)):
+        for name, row in benchmark(payloads, args.iterations).items():
+            print(f"{label:<8} {name:<8} {row['us_per_parse']:>9.2f} {row['failures']:>9}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import os
+import textwrap
+from typing import Optional
+from models import BookRecommendation, ContentCard
+
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", 8))
+
+GROUNDED_RECOMMENDATION_SYSTEM_PROMPT = textwrap.dedent("""
+        You are a knowledgeable content curator. The user is asking about specific content (books, podcasts, etc.).
+        You are given candidate catalog entries, each starting with its [id].
+        Pick the candidate the user is asking about and explain why it matches.
+
+        You MUST respond with valid JSON only. No other text.
+        Return JSON with: catalog_id, reason, relevance_score (0-1)
+        If no candidate is the requested item, set catalog_id to null and also return title and author.
+        """).strip()
+
+# Card prompt that ranks and explains retrieved candidates instead of inventing content.
+# The category focus arrives in the user message so this prefix is shared by every request.
+GROUNDED_CARDS_SYSTEM_PROMPT = textwrap.dedent("""
+        You are creating content cards for a search system from candidate catalog entries.
+        The user message gives the query, its intent category and what to focus on for that category.
+
+        Each candidate starts with its [id] and may list numbered quotes.
+        Choose 1-5 candidates that best answer the query: 1 for simple direct queries, 2-3 for moderate ones,
+        4-5 only for complex multi-faceted topics. Order them from foundational to advanced so each card
+        builds on the previous one. Only use the candidates given.
+
+        You MUST respond with valid JSON only. No other text.
+        Return an array of objects with:
+        - catalog_id: the candidate id
+        - type: EXACTLY one of: "quote", "summary", "recommendation", "theme"
+        - title: engaging title that relates to the overall theme
+        - description: why this fits the query and the progression (max 60 words)
+        - quote_index: (only if type is "quote") number of the candidate quote to show
+        """).strip()
+
+def retrieve_candidates(index, query: str, k: int = RETRIEVAL_TOP_K) -> list[dict]:
+    """Top-k catalog items for a query, or an empty list without an index; IVF indexes scan their ``n_probe`` lists"""
+    if index is None or not len(index):
+        return []
+    return [item for item, _ in index.search(query, k, index.n_probe)]
+
+def _truncate(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit].rsplit(" ", 1)[0] + "…"
+
+def _quotes(item: dict) -> list[dict]:
+    """Catalog quotes as {"text", "page"} dicts; plain strings are accepted too"""
+    return [quote if isinstance(quote, dict) else {"text": quote} for quote in item.get("quotes", [])]
+
+def format_candidates(candidates: list[dict]) -> str:
+    """Compact candidate listing for the prompt"""
+    lines = []
+    for item in candidates:
+        line = f"[{item['id']}] {item.get('title', '')} — {item.get('author', '')}"
+        if item.get("summary"):
+            line += f": {_truncate(item['summary'], 200)}"
+        for number, quote in enumerate(_quotes(item)[:3]):
+            line += f"\n    quote {number}: \"{_truncate(quote['text'], 160)}\""
+        lines.append(line)
+    return "\n".join(lines)
+
+def card_from_candidate(data: dict, candidates: dict[str, dict]) -> Optional[ContentCard]:
+    """Fill a ranked card from its catalog entry; None if it references an unknown id"""
+    item = candidates.get(str(data.get("catalog_id")))
+    if item is None:
+        return None
+    quote_text, source_page = None, None
+    if data.get("type") == "quote" and data.get("quote_index") is not None:
+        quotes = _quotes(item)
+        index = int(data["quote_index"])
+        if 0 <= index < len(quotes):
+            quote_text = quotes[index]["text"]
+            source_page = quotes[index].get("page")
+    return ContentCard(
+        type=data["type"] if quote_text or data.get("type") != "quote" else "summary",
+        title=data["title"],
+        description=data["description"],
+        book_title=item.get("title"),
+        book_author=item.get("author"),
+        quote=quote_text,
+        source_page=source_page,
+        clickable_link=item.get("url", "#"),
+        catalog_id=str(item["id"])
+    )
+
+def cards_from_candidates(cards_data: list[dict], candidates: list[dict]) -> list[ContentCard]:
+    """Turn the ranked card list into ContentCards, dropping references to unknown ids"""
+    by_id = {str(item["id"]): item for item in candidates}
+    cards = [card_from_candidate(data, by_id) for data in cards_data]
+    cards = [card for card in cards if card is not None]
+    if not cards:
+        raise ValueError("No valid catalog ids in grounded response")
+    return cards
+
+def recommendation_from_candidate(data: dict, candidates: list[dict]) -> BookRecommendation:
+    """Fill a recommendation from its catalog entry, or from the model when nothing matched"""
+    item = next((c for c in candidates if str(c["id"]) == str(data.get("catalog_id"))), None)
+    return BookRecommendation(
+        title=item.get("title", "") if item else data["title"],
+        author=item.get("author", "") if item else data["author"],
+        reason=data["reason"],
+        relevance_score=data["relevance_score"],
+        catalog_id=str(item["id"]) if item else None
+    )
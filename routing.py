@@ -0,0 +1,147 @@
+import os
+import threading
+from collections import deque
+from typing import Optional
+from models import QueryAnalysis, QueryType, UserIntentCategory
+from llm_backend import LLM_MODEL
+from tracing import cached_tokens_of, percentile
+
+# USD per million (prompt, cached prompt, completion) tokens, used for cost accounting only
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+}
+
+def _env_flag(name: str, default: str = "0") -> bool:
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
+class RoutingPolicy:
+    """Which model serves each stage.
+
+    Classification always goes to the small model. Generation goes to the small
+    model unless the analysis is low-confidence, the intent category is marked as
+    complex, or the query is long enough to suggest a multi-card journey.
+    Combined requests are routed on the local rule prediction.
+    """
+
+    def __init__(self, small_model: str = "gpt-4o-mini", large_model: str = LLM_MODEL,
+                 confidence_threshold: float = 0.75, long_query_words: int = 12,
+                 large_categories: Optional[set[UserIntentCategory]] = None):
+        self.small_model = small_model
+        self.large_model = large_model
+        self.confidence_threshold = confidence_threshold
+        self.long_query_words = long_query_words
+        self.large_categories = large_categories if large_categories is not None else {UserIntentCategory.COMPARATIVE_SEARCH}
+
+    def model_for(self, stage: str, query: str, analysis: Optional[QueryAnalysis] = None) -> str:
+        if stage == "analyze":
+            return self.small_model
+        if analysis is None or analysis.confidence_score < self.confidence_threshold:
+            return self.large_model
+        if analysis.query_type == QueryType.GENERAL and analysis.user_intent_category in self.large_categories:
+            return self.large_model
+        if len(query.split()) >= self.long_query_words:
+            return self.large_model
+        return self.small_model
+
+class StaticPolicy:
+    """Every stage uses the same model"""
+
+    def __init__(self, model: str = LLM_MODEL):
+        self.small_model = model
+        self.large_model = model
+
+    def model_for(self, stage: str, query: str, analysis: Optional[QueryAnalysis] = None) -> str:
+        return self.large_model
+
+class RouteStats:
+    """Calls, failures, latency and spend of one (stage, model) route"""
+
+    def __init__(self, model: str):
+        self.model = model
+        self.calls = 0
+        self.failures = 0
+        self.escalations = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.latencies: deque[float] = deque(maxlen=1000)
+
+    @property
+    def cost(self) -> float:
+        prompt_price, cached_price, completion_price = MODEL_PRICES.get(self.model, (0.0, 0.0, 0.0))
+        uncached = self.prompt_tokens - self.cached_tokens
+        return (uncached * prompt_price + self.cached_tokens * cached_price
+                + self.completion_tokens * completion_price) / 1_000_000
+
+    def as_dict(self) -> dict:
+        samples = list(self.latencies)
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "escalations": self.escalations,
+            "p50_ms": percentile(samples, 0.5) * 1000,
+            "p95_ms": percentile(samples, 0.95) * 1000,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cached_fraction": self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+            "cost_usd": self.cost,
+            "cost_per_call_usd": self.cost / self.calls if self.calls else 0.0,
+        }
+
+class ModelRouter:
+    """Picks the model per stage, escalates failed validations and keeps per-route accounting"""
+
+    def __init__(self, policy=None):
+        self.policy = policy if policy is not None else StaticPolicy()
+        self._routes: dict[tuple[str, str], RouteStats] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, model: Optional[str] = None) -> "ModelRouter":
+        """Adaptive routing when LLM_ROUTING is set, otherwise every stage uses ``model``"""
+        large_model = os.getenv("LLM_LARGE_MODEL", model or LLM_MODEL)
+        if not _env_flag("LLM_ROUTING"):
+            return cls(StaticPolicy(model or LLM_MODEL))
+        categories = os.getenv("LLM_ROUTING_LARGE_CATEGORIES", UserIntentCategory.COMPARATIVE_SEARCH.value)
+        return cls(RoutingPolicy(
+            small_model=os.getenv("LLM_SMALL_MODEL", "gpt-4o-mini"),
+            large_model=large_model,
+            confidence_threshold=float(os.getenv("LLM_ROUTING_CONFIDENCE", 0.75)),
+            long_query_words=int(os.getenv("LLM_ROUTING_LONG_QUERY_WORDS", 12)),
+            large_categories={UserIntentCategory(name.strip()) for name in categories.split(",") if name.strip()},
+        ))
+
+    def model_for(self, stage: str, query: str, analysis: Optional[QueryAnalysis] = None) -> str:
+        return self.policy.model_for(stage, query, analysis)
+
+    def escalate(self, model: str) -> Optional[str]:
+        """Model to retry with after a validation failure, or None if already on the largest"""
+        return self.policy.large_model if model != self.policy.large_model else None
+
+    def record(self, stage: str, model: str, seconds: float, usage=None, ok: bool = True, escalated: bool = False) -> None:
+        with self._lock:
+            route = self._routes.get((stage, model))
+            if route is None:
+                route = self._routes[(stage, model)] = RouteStats(model)
+            route.calls += 1
+            route.failures += not ok
+            route.escalations += escalated
+            route.latencies.append(seconds)
+            if usage is not None:
+                route.prompt_tokens += usage.prompt_tokens
+                route.completion_tokens += usage.completion_tokens
+                route.cached_tokens += cached_tokens_of(usage)
+
+    def stats(self) -> dict:
+        """Per-route accounting keyed by "stage/model", plus the total spend"""
+        with self._lock:
+            routes = {f"{stage}/{model}": route.as_dict() for (stage, model), route in sorted(self._routes.items())}
+        return {
+            "routes": routes,
+            "total_cost_usd": sum(route["cost_usd"] for route in routes.values()),
+        }
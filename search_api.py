@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Headless HTTP API for the search pipeline.
+
+Serves AsyncLLMService as JSON so the Streamlit app is just one client among
+others. Each worker process runs its own service; the SQLite response cache is
+shared between them through the file system.
+
+  python search_api.py --port 8000 --workers 4
+  curl -X POST localhost:8000/search -d '{"query": "books on confidence"}'
+  curl -N 'localhost:8000/search/stream?q=books+on+confidence'
+
+Endpoints:
+  POST/GET /search         SearchResponse as JSON
+  POST/GET /search/stream  server-sent events: analysis, recommendation, card..., done
+  GET      /health         upstream and circuit breaker state
+  GET      /metrics        Prometheus text metrics of this worker
+"""
+
+import argparse
+import json
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+from dotenv import load_dotenv
+from pydantic import ValidationError
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+from models import SearchRequest, QueryAnalysis, BookRecommendation
+from llm_backend import get_backend
+from tracing import PrometheusSink, Tracer, last_trace
+from async_llm_service import AsyncLLMService
+
+load_dotenv()
+
+SSE_EVENTS = {QueryAnalysis: "analysis", BookRecommendation: "recommendation"}
+
+def create_service() -> AsyncLLMService:
+    """Service for one worker; /metrics always needs a Prometheus sink"""
+    tracer = Tracer.from_env()
+    if tracer.sink(PrometheusSink) is None:
+        tracer.sinks.append(PrometheusSink())
+    return AsyncLLMService(tracer=tracer)
+
+async def read_search_request(request: Request) -> SearchRequest:
+    """The query from a JSON body, or from ?q= on GET"""
+    if request.method == "GET":
+        return SearchRequest.model_validate({"query": request.query_params.get("q", "")})
+    try:
+        data = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise HTTPException(400, "Request body must be JSON")
+    return SearchRequest.model_validate(data)
+
+def sse_event(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
+
+async def search(request: Request) -> JSONResponse:
+    search_request = await read_search_request(request)
+    response = await request.app.state.service.process_search_query(search_request.query)
+    trace = last_trace()
+    headers = {"X-Trace-Id": trace.trace_id} if trace else None
+    return JSONResponse(response.model_dump(mode="json"), headers=headers)
+
+async def search_stream(request: Request) -> StreamingResponse:
+    search_request = await read_search_request(request)
+    service = request.app.state.service
+
+    async def events() -> AsyncIterator[str]:
+        try:
+            async for item in service.stream_search_query(search_request.query):
+                yield sse_event(SSE_EVENTS.get(type(item), "card"), item.model_dump_json())
+        except Exception as e:
+            print(f"Error in streamed search: {str(e)}")
+            yield sse_event("error", json.dumps({"detail": str(e)}))
+            return
+        trace = last_trace()
+        yield sse_event("done", json.dumps({
+            "trace_id": trace.trace_id if trace else None,
+            "total_ms": trace.total_ms if trace else None,
+            "fallback": trace.fallback if trace else False,
+        }))
+
+    # Proxies must pass events through as they are produced
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def health(request: Request) -> JSONResponse:
+    service = request.app.state.service
+    return JSONResponse({
+        # Degraded workers still answer, from the caches and the local index
+        "status": "ok" if service.guard.available() else "degraded",
+        "backend": get_backend(),
+        "model": service.model,
+        "pid": os.getpid(),
+        "upstream": service.guard.stats(),
+    })
+
+def upstream_metrics(service: AsyncLLMService, prefix: str = "ai_search") -> str:
+    """Breaker, retry and hedging gauges in the Prometheus text format"""
+    stats = service.guard.stats()
+    lines = [
+        f"# TYPE {prefix}_upstream_available gauge",
+        f"{prefix}_upstream_available {int(service.guard.available())}",
+    ]
+    for name in ("times_opened", "rejected", "retries", "hedges", "hedge_wins"):
+        lines.append(f"# TYPE {prefix}_upstream_{name}_total counter")
+        lines.append(f"{prefix}_upstream_{name}_total {stats[name]}")
+    return "\n".join(lines) + "\n"
+
+async def metrics(request: Request) -> PlainTextResponse:
+    service = request.app.state.service
+    text = service.tracer.sink(PrometheusSink).render() + upstream_metrics(service)
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+async def validation_error(request: Request, error: ValidationError) -> JSONResponse:
+    return JSONResponse({"detail": json.loads(error.json(include_url=False))}, status_code=422)
+
+async def http_error(request: Request, error: HTTPException) -> JSONResponse:
+    """JSON instead of Starlette's plain-text body, so clients parse every error the same way"""
+    return JSONResponse({"detail": error.detail}, status_code=error.status_code, headers=error.headers)
+
+@asynccontextmanager
+async def lifespan(app: Starlette):
+    app.state.service = create_service()
+    try:
+        yield
+    finally:
+        await app.state.service.close()
+
+app = Starlette(
+    routes=[
+        Route("/search", search, methods=["GET", "POST"]),
+        Route("/search/stream", search_stream, methods=["GET", "POST"]),
+        Route("/health", health),
+        Route("/metrics", metrics),
+    ],
+    exception_handlers={HTTPException: http_error, ValidationError: validation_error},
+    lifespan=lifespan,
+)
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("SEARCH_API_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SEARCH_API_PORT", 8000)))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("SEARCH_API_WORKERS", 1)),
+                        help="Worker processes, each with its own event loop and service")
+    args = parser.parse_args()
+    uvicorn.run("search_api:app", host=args.host, port=args.port, workers=args.workers)
+
+if __name__ == "__main__":
+    main()
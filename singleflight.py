@@ -0,0 +1,99 @@
+import threading
+from typing import Callable, Iterator, Optional
+from cache import normalize_query
+from tracing import Trace, last_trace
+
+class Flight:
+    """One upstream search whose streamed items are replayed to every subscriber.
+
+    The producer runs in its own thread and always runs to completion, so a
+    subscriber that goes away (a Streamlit rerun, a closed tab) does not cut the
+    stream short for the others, and the finished response still reaches the cache.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.items: list = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        # Trace of the upstream request, set when the producer finishes
+        self.trace: Optional[Trace] = None
+        self.subscribers = 0
+        self._condition = threading.Condition()
+
+    def run(self, produce: Callable[[], Iterator]) -> None:
+        try:
+            for item in produce():
+                with self._condition:
+                    self.items.append(item)
+                    self._condition.notify_all()
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.trace = last_trace()
+            with self._condition:
+                self.done = True
+                self._condition.notify_all()
+
+    def subscribe(self) -> Iterator:
+        """Every item produced so far, then each new one as it arrives"""
+        position = 0
+        while True:
+            with self._condition:
+                while position >= len(self.items) and not self.done:
+                    self._condition.wait()
+                if position >= len(self.items):
+                    break
+                item = self.items[position]
+            position += 1
+            yield item
+        if self.error is not None:
+            raise self.error
+
+class SingleFlight:
+    """Coalesces identical in-flight searches onto one upstream request.
+
+    Queries are keyed by their normalized text, like the response cache. A search
+    that arrives while the same query is streaming joins it instead of calling
+    the API again; once the flight finishes the next search starts a new one
+    (and is normally answered by the cache).
+    """
+
+    def __init__(self):
+        self._flights: dict[str, Flight] = {}
+        self._lock = threading.Lock()
+        self.started = 0
+        self.coalesced = 0
+
+    def join(self, query: str, produce: Callable[[], Iterator]) -> Flight:
+        """The flight for ``query``, starting ``produce`` in a new thread if none is running"""
+        key = normalize_query(query)
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                flight.subscribers += 1
+                return flight
+            flight = self._flights[key] = Flight(key)
+            flight.subscribers = 1
+            self.started += 1
+        threading.Thread(target=self._run, args=(flight, produce), name="search-flight", daemon=True).start()
+        return flight
+
+    def _run(self, flight: Flight, produce: Callable[[], Iterator]) -> None:
+        try:
+            flight.run(produce)
+        finally:
+            with self._lock:
+                self._flights.pop(flight.key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_flight = len(self._flights)
+        searches = self.started + self.coalesced
+        return {
+            "in_flight": in_flight,
+            "started": self.started,
+            "coalesced": self.coalesced,
+            "coalesced_rate": self.coalesced / searches if searches else 0.0,
+        }
@@ -0,0 +1,12 @@
+import json
+from batch_search import prepare_batch
+from mock_llm_server import strict_schema_error
+
+def test_prepared_requests_use_strict_schema(tmp_path):
+    queries = tmp_path / "queries.jsonl"
+    queries.write_text(json.dumps({"id": "q1", "query": "books on confidence"}) + "\n")
+    requests = tmp_path / "requests.jsonl"
+    prepare_batch(str(queries), str(requests), "query", "id", "gpt-4o-mini")
+    [request] = [json.loads(line) for line in requests.read_text().splitlines()]
+    assert request["custom_id"] == "q1"
+    assert strict_schema_error(request["body"]["response_format"]) is None
@@ -0,0 +1,33 @@
+import time
+import pytest
+from batching import MicroBatcher
+from llm_service import LLMService
+
+def test_base_exception_in_process_resolves_every_future():
+    def exits(items):
+        raise SystemExit("worker stopped")
+
+    batcher = MicroBatcher(exits, window_ms=10)
+    futures = [batcher.submit(item) for item in "ab"]
+    for future in futures:
+        with pytest.raises(SystemExit):
+            future.result(timeout=2)
+    assert batcher.stats()["failures"] == 1
+    assert batcher.submit("c").exception(timeout=2) is not None
+    batcher.close()
+
+def test_close_flushes_waiting_items_and_stops_threads():
+    batcher = MicroBatcher(lambda items: [item.upper() for item in items], window_ms=10_000)
+    future = batcher.submit("a")
+    start = time.perf_counter()
+    batcher.close()
+    assert future.result(timeout=0) == "A" and time.perf_counter() - start < 5
+    assert not batcher._collector.is_alive()
+    with pytest.raises(RuntimeError):
+        batcher.submit("b")
+
+def test_service_close_stops_its_batcher():
+    service = LLMService(use_cache=False, local_classifier=False, batch_window_ms=5)
+    assert not service.analyze_query("books on confidence").reasoning.startswith("Error in analysis")
+    service.close()
+    assert not service.batcher._collector.is_alive()
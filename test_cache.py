@@ -0,0 +1,88 @@
+import math
+import time
+import numpy as np
+from cache import ResponseCache, SemanticCache, normalize_query
+from llm_service import fallback_cards
+from models import QueryAnalysis, QueryType, SearchResponse, UserIntentCategory
+
+def sample_response(category: UserIntentCategory = UserIntentCategory.EXPLORATION_DISCOVERY) -> SearchResponse:
+    analysis = QueryAnalysis(query_type=QueryType.GENERAL, user_intent_category=category,
+                             confidence_score=0.8, reasoning="Broad topic")
+    return SearchResponse(analysis=analysis, content_cards=fallback_cards())
+
+def test_normalize_query():
+    assert normalize_query("  Books about  Flow-State!? ") == "books about flow state"
+
+def test_cache_keys_on_normalized_query():
+    """Case, punctuation and whitespace variants share an entry; other wording does not"""
+    cache = ResponseCache(":memory:")
+    cache.set("Books about Flow State!", sample_response())
+    assert cache.get("  books about flow state ") == sample_response()
+    assert cache.get("books about flow") is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5, "entries": 1}
+
+def test_cache_entries_expire():
+    cache = ResponseCache(":memory:", ttl_seconds=0.05)
+    cache.set("books on confidence", sample_response())
+    assert cache.get("books on confidence") is not None
+    time.sleep(0.1)
+    assert cache.get("books on confidence") is None
+    assert cache.stats()["entries"] == 0
+
+def test_cache_evicts_least_recently_used():
+    cache = ResponseCache(":memory:", max_entries=2)
+    cache.set("first", sample_response())
+    time.sleep(0.01)
+    cache.set("second", sample_response())
+    time.sleep(0.01)
+    cache.get("first")
+    time.sleep(0.01)
+    cache.set("third", sample_response())
+    assert cache.get("second") is None
+    assert cache.get("first") is not None and cache.get("third") is not None
+
+def angle_embedder(queries: list[str]) -> np.ndarray:
+    """Embeds "<degrees> ..." as a unit vector at that angle, so cosine similarity is easy to set"""
+    angles = [math.radians(float(query.split()[0])) for query in queries]
+    return np.array([[math.cos(a), math.sin(a)] for a in angles], dtype=np.float32)
+
+def similarity_at(degrees: float) -> float:
+    return math.cos(math.radians(degrees))
+
+def test_semantic_cache_uses_category_thresholds():
+    """cos(20°) ≈ 0.94 passes the 0.88 emotional threshold but not the 0.95 quote threshold"""
+    cache = SemanticCache(angle_embedder)
+    cache.set("0 books that make me cry", sample_response(UserIntentCategory.EMOTIONAL_THEME))
+    cache.set("90 where is this quote from", sample_response(UserIntentCategory.QUOTE_CONCEPT_MEMORY))
+    assert similarity_at(20) < cache.category_thresholds["quote_concept_memory"]
+    assert cache.get("20 sad books").analysis.user_intent_category == UserIntentCategory.EMOTIONAL_THEME
+    assert cache.get("110 who said this quote") is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5, "entries": 2}
+
+def test_semantic_cache_replaces_repeated_query():
+    cache = SemanticCache(angle_embedder, max_entries=3)
+    cache.set("0 Books that make me cry", sample_response(UserIntentCategory.EXPLORATION_DISCOVERY))
+    cache.set("0 books that make me cry!", sample_response(UserIntentCategory.EMOTIONAL_THEME))
+    assert cache.stats()["entries"] == 1
+    assert cache.get("0 books that make me cry").analysis.user_intent_category == UserIntentCategory.EMOTIONAL_THEME
+
+def test_semantic_cache_evicts_least_recently_used():
+    cache = SemanticCache(angle_embedder, max_entries=2)
+    cache.set("0 first", sample_response())
+    time.sleep(0.01)
+    cache.set("90 second", sample_response())
+    time.sleep(0.01)
+    assert cache.get("0 first") is not None
+    time.sleep(0.01)
+    cache.set("180 third", sample_response())
+    assert cache.get("90 second") is None
+    assert cache.get("0 first") is not None and cache.get("180 third") is not None
+    assert cache.stats()["entries"] == 2
+
+def test_semantic_cache_entries_expire():
+    cache = SemanticCache(angle_embedder, ttl_seconds=0.05)
+    cache.set("0 books on confidence", sample_response())
+    assert cache.get("0 books on confidence") is not None
+    time.sleep(0.1)
+    assert cache.stats()["entries"] == 0
+    assert cache.get("0 books on confidence") is None
@@ -0,0 +1,44 @@
+from intent_classifier import LocalIntentClassifier, TfidfLinearModel, evaluate, label_of, split_holdout
+
+EXAMPLES = [
+    ("books that make me cry", "emotional_theme"),
+    ("cathartic novels after a breakup", "emotional_theme"),
+    ("comfort reads for grief", "emotional_theme"),
+    ("how to overcome procrastination", "problem_solving"),
+    ("how do i stop overthinking", "problem_solving"),
+    ("dealing with burnout at work", "problem_solving"),
+]
+
+def train(examples=EXAMPLES) -> TfidfLinearModel:
+    texts, labels = zip(*examples)
+    return TfidfLinearModel.train(list(texts) * 5, list(labels) * 5)
+
+def test_confident_known_queries_are_answered_locally():
+    classifier = LocalIntentClassifier(train(), threshold=0.6)
+    analysis = classifier.classify("books that make me cry")
+    assert analysis is not None and label_of(analysis) == "emotional_theme"
+
+def test_queries_without_known_terms_defer_to_llm():
+    classifier = LocalIntentClassifier(train(), threshold=0.0)
+    assert classifier.classify("zxqv plorbs") is None
+    assert classifier.predict("zxqv plorbs").reasoning == "No rule matched"
+    assert classifier.stats()["deferred"] == 1
+
+def test_single_label_model_always_defers():
+    classifier = LocalIntentClassifier(train(EXAMPLES[:3]), threshold=0.0)
+    assert classifier.model.labels == ["emotional_theme"]
+    assert classifier.classify("books that make me cry") is None
+
+def test_holdout_split_keeps_queries_on_one_side():
+    texts = [text for text, _ in EXAMPLES] * 3
+    labels = [label for _, label in EXAMPLES] * 3
+    (train_texts, train_labels), (test_texts, test_labels) = split_holdout(texts, labels, 0.34)
+    assert len(set(test_texts)) == 2 and not set(train_texts) & set(test_texts)
+    assert sorted(train_texts + test_texts) == sorted(texts)
+    assert dict(zip(test_texts, test_labels)) == {text: dict(EXAMPLES)[text] for text in test_texts}
+
+def test_evaluate_counts_agreement_and_absorption():
+    classifier = LocalIntentClassifier(train(), threshold=0.0)
+    result = evaluate(classifier, ["books that make me cry", "zxqv"], ["emotional_theme", "problem_solving"])
+    assert result["absorbed"] == 1 and result["absorbed_agreement"] == 1.0
+    assert result["agreement"] == 0.5
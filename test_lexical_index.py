@@ -0,0 +1,43 @@
+import math
+import pytest
+from lexical_index import FUZZY_WEIGHT, LexicalIndex
+
+CATALOG = [
+    {"id": "1", "title": "The Power of Habit", "author": "Charles Duhigg"},
+    {"id": "2", "title": "Atomic Habits", "author": "James Clear"},
+    {"id": "3", "title": "Thinking, Fast and Slow", "author": "Daniel Kahneman"},
+    {"id": "4", "title": "The Name of the Wind", "author": "Patrick Rothfuss"},
+]
+
+def test_bm25_scores_follow_the_formula():
+    index = LexicalIndex(CATALOG)
+    [(item, score)] = index.search("kahneman")
+    assert item["id"] == "3"
+    idf = math.log(1 + (4 - 1 + 0.5) / (1 + 0.5))
+    frequency = 2.0
+    norm = index.k1 * (1 - index.b + index.b * index.lengths[2] / index.average_length)
+    assert score == pytest.approx(idf * frequency * (index.k1 + 1) / (frequency + norm))
+
+def test_title_terms_outweigh_author_terms():
+    index = LexicalIndex(CATALOG + [{"id": "5", "title": "Letters", "author": "Clear"}])
+    assert [item["id"] for item, _ in index.search("clear")] == ["5", "2"]
+
+def test_exact_title_is_a_confident_match():
+    item, confidence = LexicalIndex(CATALOG).match("what is the power of habit about")
+    assert item["id"] == "1" and confidence == pytest.approx(1.0)
+    assert LexicalIndex(CATALOG).match("habit") is None
+
+def test_fuzzy_title_match_at_the_threshold():
+    """A typo is matched at FUZZY_WEIGHT, so it passes a threshold equal to its confidence and no higher"""
+    item, confidence = LexicalIndex(CATALOG, threshold=0.0).match("power of habbit")
+    assert item["id"] == "1" and FUZZY_WEIGHT < confidence < 1.0
+    assert LexicalIndex(CATALOG, threshold=confidence).match("power of habbit")[0]["id"] == "1"
+    assert LexicalIndex(CATALOG, threshold=confidence + 0.01).match("power of habbit") is None
+
+def test_last_term_is_matched_as_a_prefix():
+    item, _ = LexicalIndex(CATALOG).match("atomic hab")
+    assert item["id"] == "2"
+
+def test_same_title_by_different_authors_is_ambiguous():
+    index = LexicalIndex(CATALOG + [{"id": "6", "title": "Atomic Habits", "author": "Someone Else"}])
+    assert index.match("atomic habits") is None
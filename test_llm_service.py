@@ -0,0 +1,37 @@
+import json
+from openai.lib._parsing import type_to_response_format_param
+import llm_service
+from llm_service import LLMService, is_fallback_response
+from mock_llm_server import strict_schema_error
+from models import CombinedSearchResponse, SearchResponse
+from tracing import last_trace
+
+def schema_keys(node) -> set[str]:
+    if isinstance(node, dict):
+        return set(node) | {key for child in node.values() for key in schema_keys(child)}
+    if isinstance(node, list):
+        return {key for child in node for key in schema_keys(child)}
+    return set()
+
+def test_combined_schema_is_strict():
+    """OpenAI strict structured outputs reject "default" anywhere in the schema"""
+    response_format = type_to_response_format_param(CombinedSearchResponse)
+    assert "default" not in schema_keys(response_format)
+    assert strict_schema_error(response_format) is None
+    assert strict_schema_error(type_to_response_format_param(SearchResponse)) is not None
+
+def test_combined_mode_answers_in_one_call():
+    service = LLMService(use_cache=False, local_classifier=False, combined=True)
+    response = service.process_search_query("books on confidence")
+    assert not is_fallback_response(response) and response.content_cards
+    assert [span.name for span in last_trace().spans] == ["combined"]
+
+def test_rejected_combined_request_uses_two_stage_pipeline(monkeypatch):
+    """A 400 for the combined request falls back to analyze -> cards instead of error cards"""
+    monkeypatch.setattr(llm_service, "CombinedSearchResponse", SearchResponse)
+    service = LLMService(use_cache=False, local_classifier=False, combined=True)
+    response = service.process_search_query("books on confidence")
+    assert not is_fallback_response(response) and response.content_cards
+    spans = {span.name: span for span in last_trace().spans}
+    assert set(spans) == {"combined", "analyze", "cards"}
+    assert "default" in spans["combined"].error
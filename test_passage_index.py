@@ -0,0 +1,74 @@
+from llm_service import LLMService
+from models import UserIntentCategory
+from passage_index import PassageIndex, cards_from_passages, with_passages
+from vector_index import HashingEmbedder, VectorIndex
+
+CATALOG = [
+    {"id": "1", "title": "The Curious Incident of the Dog in the Night-Time", "author": "Mark Haddon",
+     "summary": "A boy investigates the death of a neighbour's dog.",
+     "quotes": [{"text": "I said that I counted prime numbers to stay calm when the noise got too loud.", "page": 44}]},
+    {"id": "2", "title": "Flow", "author": "Mihaly Csikszentmihalyi",
+     "summary": "The psychology of optimal experience and deep focus.",
+     "excerpts": ["Happiness is not something that happens; it is prepared for and cultivated."]},
+    {"id": "3", "title": "The Martian", "author": "Andy Weir",
+     "summary": "An astronaut stranded on Mars grows potatoes to survive."},
+]
+
+def build(tmp_path) -> PassageIndex:
+    return PassageIndex.build(str(tmp_path / "passages"), CATALOG)
+
+def test_reworded_quote_matches_its_passage(tmp_path):
+    """Stemming and word shingles tolerate reordered, inflected and missing words"""
+    [(passage, score)] = build(tmp_path).match("boy counting primes to calm down")
+    assert passage["catalog_id"] == "1" and passage["kind"] == "quote" and passage["page"] == "44"
+    assert 0.5 <= score < 1.0
+
+def test_quoted_phrase_is_searched_alone(tmp_path):
+    [(passage, score)] = build(tmp_path).match("where does 'prepared for and cultivated' come from")
+    assert passage["catalog_id"] == "2" and score == 1.0
+
+def test_word_pairs_break_ties(tmp_path):
+    index = PassageIndex.build(str(tmp_path / "pairs"), [
+        {"id": "a", "title": "A", "summary": "stay calm counting"},
+        {"id": "b", "title": "B", "summary": "counting calm stay"},
+    ])
+    results = index.search("stay calm")
+    assert [passage["catalog_id"] for passage, _ in results] == ["a", "b"]
+    assert results[0][1] == results[1][1] == 1.0
+
+def test_summaries_match_plot_recall_and_weak_matches_are_dropped(tmp_path):
+    index = build(tmp_path)
+    assert index.match("astronaut grows potatoes on mars")[0][0]["kind"] == "summary"
+    assert index.match("dragons and wizards at sea") == []
+    assert index.stats()["match_rate"] == 0.5
+
+def test_matched_passages_become_cards(tmp_path):
+    [card] = cards_from_passages(build(tmp_path).match("counted prime numbers to stay calm"))
+    assert card.type == "quote" and card.source_page == "44" and card.catalog_id == "1"
+    assert card.quote.startswith("I said that I counted")
+
+def test_grounded_prompt_lists_passages_first(tmp_path, monkeypatch):
+    passages = build(tmp_path)
+    vectors = VectorIndex.build(str(tmp_path / "vectors"), CATALOG, HashingEmbedder(64))
+    query = "the book where a boy counted prime numbers to stay calm"
+    matches = passages.match(query)
+    retrieved = [item for item, _ in vectors.search(query, 3)]
+    assert [item["id"] for item in with_passages(matches, retrieved)][0] == "1"
+    assert len(with_passages(matches, retrieved)) == 3
+
+    service = LLMService(use_cache=False, local_classifier=False, vector_index=vectors, passage_index=passages)
+    sent = []
+    create = service.client.chat.completions.create
+
+    def recording_create(**kwargs):
+        sent.append(kwargs["messages"])
+        return create(**kwargs)
+
+    monkeypatch.setattr(service.client.chat.completions, "create", recording_create)
+    cards = service.generate_content_cards(query, UserIntentCategory.PLOT_FRAGMENT_MEMORY)
+    assert cards
+    prompt = sent[-1][1]["content"]
+    assert "Indexed passages matching the query were found in [1]" in prompt
+    candidates = prompt.split("Candidates:\n", 1)[1]
+    assert candidates.startswith("[1] The Curious Incident")
+    assert "counted prime numbers" in candidates.split("\n[", 1)[0]
@@ -0,0 +1,97 @@
+import asyncio
+import threading
+import time
+import openai
+import pytest
+from rate_limit import BACKGROUND, INTERACTIVE, RateLimitScheduler, RateLimitShed, priority
+from resilience import RetryPolicy, UpstreamGuard
+from test_resilience import api_error
+
+def drained(requests_per_minute: float, **kwargs) -> RateLimitScheduler:
+    """Scheduler whose request budget for model "m" is empty"""
+    scheduler = RateLimitScheduler(requests_per_minute=requests_per_minute, **kwargs)
+    scheduler._lane("m").requests.level = 0
+    return scheduler
+
+def test_interactive_calls_are_served_before_waiting_background_calls():
+    scheduler = drained(600, interactive_reserve=0.0)
+    order = []
+
+    def call(level):
+        scheduler.acquire("m", 0, level)
+        order.append(level)
+
+    background = threading.Thread(target=call, args=(BACKGROUND,))
+    background.start()
+    time.sleep(0.02)
+    interactive = threading.Thread(target=call, args=(INTERACTIVE,))
+    interactive.start()
+    background.join(2)
+    interactive.join(2)
+    assert order == [INTERACTIVE, BACKGROUND]
+    assert scheduler.granted == {INTERACTIVE: 1, BACKGROUND: 1}
+
+def test_background_calls_leave_the_interactive_reserve():
+    scheduler = drained(100, interactive_reserve=0.2, background_max_wait=0.01)
+    scheduler._lane("m").requests.level = 10
+    assert scheduler.acquire("m", 0, INTERACTIVE) < 0.01
+    with pytest.raises(RateLimitShed):
+        scheduler.acquire("m", 0, BACKGROUND)
+    assert scheduler.shed == 1 and not scheduler._lane("m").waiting
+
+def test_background_calls_are_shed_when_the_queue_is_full():
+    scheduler = drained(600, background_max_queue=0)
+    with pytest.raises(RateLimitShed):
+        scheduler.acquire("m", 0, BACKGROUND)
+    assert scheduler.stats()["shed"] == 1
+
+def test_headers_update_budgets_and_429_pauses_the_lane():
+    scheduler = RateLimitScheduler()
+    scheduler.observe("m", 200, {"x-ratelimit-limit-requests": "500", "x-ratelimit-remaining-requests": "3",
+                                 "x-ratelimit-limit-tokens": "90000", "x-ratelimit-remaining-tokens": "1000"})
+    lane = scheduler._lane("m")
+    assert (lane.requests.capacity, lane.requests.level) == (500, 3)
+    assert (lane.tokens.capacity, lane.tokens.level) == (90000, 1000)
+    assert scheduler.header_updates == 2
+
+    scheduler.observe("m", 429, {"retry-after-ms": "50"})
+    assert scheduler.throttled == 1
+    assert scheduler.acquire("m", 10, INTERACTIVE) >= 0.04
+
+def test_every_retry_acquires_quota():
+    scheduler = RateLimitScheduler(requests_per_minute=600)
+    guard = UpstreamGuard(retry=RetryPolicy(max_attempts=3, base_delay=0.0), scheduler=scheduler)
+    attempts = []
+
+    def flaky(timeout):
+        attempts.append(timeout)
+        if len(attempts) < 3:
+            raise api_error(openai.InternalServerError, 500)
+        return "ok"
+
+    assert guard.call("analyze", flaky, hedge=False, model="m", tokens=10) == "ok"
+    assert scheduler.granted[INTERACTIVE] == 3 == len(attempts)
+
+def test_hedged_duplicate_acquires_quota():
+    scheduler = RateLimitScheduler(requests_per_minute=600)
+    guard = UpstreamGuard(hedging=True, hedge_after=0.01, scheduler=scheduler)
+
+    async def slow_then_fast():
+        calls = []
+
+        async def request(timeout):
+            calls.append(timeout)
+            await asyncio.sleep(0.2 if len(calls) == 1 else 0.0)
+            return len(calls)
+
+        return await guard.acall("analyze", request, model="m", tokens=10)
+
+    assert asyncio.run(slow_then_fast()) == 2
+    assert guard.hedges == 1 and scheduler.granted[INTERACTIVE] == 2
+
+def test_background_calls_are_never_hedged():
+    scheduler = RateLimitScheduler(requests_per_minute=600)
+    guard = UpstreamGuard(hedging=True, hedge_after=0.01, scheduler=scheduler)
+    with priority(BACKGROUND):
+        assert guard.call("analyze", lambda timeout: time.sleep(0.05) or "ok", model="m", tokens=10) == "ok"
+    assert guard.hedges == 0 and scheduler.granted[BACKGROUND] == 1
@@ -0,0 +1,129 @@
+import asyncio
+from types import SimpleNamespace
+import openai
+import pytest
+from llm_service import DEGRADED_REASONING, LLMService
+from resilience import CircuitBreaker, RetryPolicy, UpstreamGuard
+
+def api_error(cls, status: int, headers: dict = None):
+    """An OpenAI status error without building an HTTP response"""
+    error = cls.__new__(cls)
+    Exception.__init__(error, f"HTTP {status}")
+    error.status_code = status
+    error.response = SimpleNamespace(headers=headers or {})
+    return error
+
+def failing(error):
+    def request(timeout):
+        raise error
+    return request
+
+def test_breaker_transitions():
+    """closed -> open after the threshold, half-open after the reset period, then closed or open by the probe"""
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=30.0)
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow() == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open" and breaker.allow() is None and not breaker.available()
+
+    breaker.opened_at -= 30.0
+    assert breaker.state == "half_open"
+    assert breaker.allow() == "probe" and breaker.allow() is None
+    breaker.record_failure()
+    assert breaker.state == "open" and breaker.times_opened == 2
+
+    breaker.opened_at -= 30.0
+    assert breaker.allow() == "probe"
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.failures == 0
+
+def half_open_guard() -> UpstreamGuard:
+    """Guard whose breaker has just become half-open, so the next call is the probe"""
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0.0)
+    breaker.record_failure()
+    assert breaker.state == "half_open" and breaker.available()
+    return UpstreamGuard(retry=RetryPolicy(max_attempts=1), breaker=breaker)
+
+def test_cancelled_probe_releases_breaker():
+    """A probe cancelled mid-request must not leave the breaker refusing every call"""
+    guard = half_open_guard()
+
+    async def cancelled_probe():
+        async def slow(timeout):
+            await asyncio.sleep(10)
+        task = asyncio.ensure_future(guard.acall("analyze", slow, hedge=False))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(cancelled_probe())
+    assert guard.breaker.available()
+    assert guard.call("analyze", lambda timeout: "ok", hedge=False) == "ok"
+    assert guard.breaker.state == "closed"
+
+    class Interrupted(BaseException):
+        pass
+
+    guard = half_open_guard()
+    with pytest.raises(Interrupted):
+        guard.call("analyze", failing(Interrupted()), hedge=False)
+    assert guard.breaker.available()
+
+def test_bad_requests_leave_breaker_unchanged():
+    """A 400 or a local bug is neither a failure nor proof of health"""
+    guard = UpstreamGuard(retry=RetryPolicy(max_attempts=3, base_delay=0), breaker=CircuitBreaker(failure_threshold=2))
+    guard.breaker.record_failure()
+    for error in (api_error(openai.BadRequestError, 400), KeyError("content")):
+        with pytest.raises(type(error)):
+            guard.call("analyze", failing(error), hedge=False)
+    assert guard.breaker.failures == 1 and guard.retries == 0
+
+    # A probe ending in a bad request is released, not left claimed
+    guard = half_open_guard()
+    with pytest.raises(openai.BadRequestError):
+        guard.call("analyze", failing(api_error(openai.BadRequestError, 400)), hedge=False)
+    assert guard.breaker.available()
+
+def test_auth_errors_open_breaker():
+    guard = UpstreamGuard(retry=RetryPolicy(max_attempts=3, base_delay=0), breaker=CircuitBreaker(failure_threshold=2))
+    for cls, status in ((openai.AuthenticationError, 401), (openai.PermissionDeniedError, 403)):
+        with pytest.raises(cls):
+            guard.call("analyze", failing(api_error(cls, status)), hedge=False)
+    assert guard.breaker.state == "open" and guard.retries == 0
+
+def test_retry_after_is_honoured_up_to_its_own_cap():
+    policy = RetryPolicy(max_delay=0.5, max_retry_after=10.0)
+    assert policy.delay(0, api_error(openai.RateLimitError, 429, {"retry-after": "6"})) == 6.0
+    assert policy.delay(0, api_error(openai.RateLimitError, 429, {"retry-after-ms": "1500"})) == 1.5
+    assert policy.delay(0, api_error(openai.RateLimitError, 429, {"retry-after": "60"})) is None
+    assert 0 <= policy.delay(5, api_error(openai.InternalServerError, 500)) <= 0.5
+
+    # Giving up on a long Retry-After counts as a failed call
+    guard = UpstreamGuard(retry=policy, breaker=CircuitBreaker(failure_threshold=1))
+    with pytest.raises(openai.RateLimitError):
+        guard.call("analyze", failing(api_error(openai.RateLimitError, 429, {"retry-after": "60"})), hedge=False)
+    assert guard.retries == 0 and guard.breaker.state == "open"
+
+def test_retryable_errors_are_retried():
+    attempts = []
+
+    def flaky(timeout):
+        attempts.append(timeout)
+        if len(attempts) < 3:
+            raise api_error(openai.InternalServerError, 503)
+        return "ok"
+
+    guard = UpstreamGuard(retry=RetryPolicy(max_attempts=3, base_delay=0.001))
+    assert guard.call("analyze", flaky, hedge=False) == "ok"
+    assert len(attempts) == 3 and guard.retries == 2 and guard.breaker.failures == 0
+
+def test_open_breaker_serves_degraded_response():
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30.0)
+    breaker.record_failure()
+    service = LLMService(use_cache=False, local_classifier=False, guard=UpstreamGuard(breaker=breaker))
+    response = service.process_search_query("books on confidence")
+    assert response.analysis.reasoning.startswith(DEGRADED_REASONING)
+    assert response.content_cards
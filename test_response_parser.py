@@ -0,0 +1,41 @@
+import json
+import pytest
+from models import QueryType, UserIntentCategory
+from response_parser import (
+    JsonArrayStreamParser, loads_first, parse_batch_analysis, parse_cards, parse_query_analysis, parse_search_response
+)
+
+ANALYSIS = {"query_type": "general", "user_intent_category": "emotional_theme", "confidence_score": 0.8, "reasoning": "Mood"}
+CARD = {"type": "theme", "title": "Grief", "description": "Books on loss", "clickable_link": "#"}
+
+def test_parsers_recover_json_around_prose():
+    fenced = f"Here is the analysis [as requested]:\n```json\n{json.dumps(ANALYSIS)}\n```\nAnything else?"
+    assert parse_query_analysis(fenced).user_intent_category == UserIntentCategory.EMOTIONAL_THEME
+    assert parse_cards(f"Cards [1 of 1]: {json.dumps([CARD])} Enjoy [reading]!", [])[0].title == "Grief"
+    assert loads_first('Note {not json} then {"a": 1} trailing', "{") == {"a": 1}
+
+def test_stream_parser_yields_objects_across_chunks():
+    text = "```json\n" + json.dumps([CARD, {**CARD, "title": "Loss {and} \"hope\""}]) + "\n```"
+    parser = JsonArrayStreamParser()
+    cards = [found for position in range(0, len(text), 7) for found in parser.feed(text[position:position + 7])]
+    assert [found["title"] for found in cards] == ["Grief", "Loss {and} \"hope\""]
+
+def test_batch_analysis_drops_missing_and_invalid_entries():
+    """Missing and invalid batch entries become None so those queries fall back to their own request"""
+    batch = parse_batch_analysis(json.dumps([{"index": 1, **ANALYSIS}, {"index": 0, "query_type": "unknown"}]), 3)
+    assert batch[0] is None and batch[1].reasoning == "Mood" and batch[2] is None
+
+@pytest.mark.parametrize("text", ["", "I cannot help with that.", '{"query_type": "general"}', '{"query_type": "general", "confid'])
+def test_invalid_analysis_raises_value_error(text):
+    with pytest.raises(ValueError):
+        parse_query_analysis(text)
+
+def test_empty_intent_category_is_none():
+    """Specific-book analyses may send "" for the category; it parses as None"""
+    analysis = parse_query_analysis(json.dumps({**ANALYSIS, "query_type": "specific_book", "user_intent_category": ""}))
+    assert analysis.query_type == QueryType.SPECIFIC_BOOK
+    assert analysis.user_intent_category is None
+
+def test_combined_response_parses():
+    response = parse_search_response(json.dumps({"analysis": ANALYSIS, "book_recommendation": None, "content_cards": [CARD]}))
+    assert response.content_cards[0].title == "Grief"
@@ -0,0 +1,38 @@
+import pytest
+from llm_service import LLMService
+from models import QueryAnalysis, QueryType, UserIntentCategory
+from routing import MODEL_PRICES, ModelRouter, RoutingPolicy
+
+def test_unparseable_small_model_answer_escalates_and_is_costed(monkeypatch):
+    router = ModelRouter(RoutingPolicy(small_model="gpt-4o-mini", large_model="gpt-4o"))
+    service = LLMService(use_cache=False, local_classifier=False, router=router)
+    create = service.client.chat.completions.create
+
+    def small_model_rambles(**kwargs):
+        response = create(**kwargs)
+        if kwargs["model"] == "gpt-4o-mini":
+            response.choices[0].message.content = "Sorry, here are some thoughts about books."
+        return response
+
+    monkeypatch.setattr(service.client.chat.completions, "create", small_model_rambles)
+    analysis = QueryAnalysis(query_type=QueryType.GENERAL, user_intent_category=UserIntentCategory.EMOTIONAL_THEME,
+                             confidence_score=0.9, reasoning="Mood")
+    with service.tracer.trace("books that make me cry") as trace:
+        cards = service.generate_content_cards("books that make me cry", UserIntentCategory.EMOTIONAL_THEME, analysis)
+
+    [stage] = [span for span in trace.spans if span.name == "cards"]
+    assert cards and not stage.fallback
+    assert stage.model == "gpt-4o" and stage.attributes["escalated_from"] == "gpt-4o-mini"
+
+    routes = router.stats()["routes"]
+    small, large = routes["cards/gpt-4o-mini"], routes["cards/gpt-4o"]
+    assert (small["calls"], small["failures"], small["escalations"]) == (1, 1, 0)
+    assert (large["calls"], large["failures"], large["escalations"]) == (1, 0, 1)
+    for model, route in (("gpt-4o-mini", small), ("gpt-4o", large)):
+        prompt_price, cached_price, completion_price = MODEL_PRICES[model]
+        uncached = route["prompt_tokens"] - route["cached_tokens"]
+        assert route["prompt_tokens"] > 0 and route["completion_tokens"] > 0
+        assert route["cost_usd"] == pytest.approx((uncached * prompt_price + route["cached_tokens"] * cached_price
+                                                   + route["completion_tokens"] * completion_price) / 1e6)
+    assert router.stats()["total_cost_usd"] == pytest.approx(small["cost_usd"] + large["cost_usd"])
+    assert stage.prompt_tokens == small["prompt_tokens"] + large["prompt_tokens"]
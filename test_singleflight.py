@@ -0,0 +1,42 @@
+import threading
+from llm_service import LLMService
+from models import ContentCard, QueryAnalysis
+from singleflight import SingleFlight
+
+def test_concurrent_identical_queries_share_one_upstream_search(monkeypatch):
+    service = LLMService(use_cache=False, local_classifier=False)
+    calls = []
+    create = service.client.chat.completions.create
+    monkeypatch.setattr(service.client.chat.completions, "create", lambda **kwargs: calls.append(1) or create(**kwargs))
+
+    flights, started, release = SingleFlight(), [], threading.Event()
+
+    def produce(query):
+        def stream():
+            started.append(query)
+            release.wait(5)
+            yield from service.stream_search_query(query)
+        return stream
+
+    queries = ["Books about flow state", "books about flow state?", "  BOOKS about Flow-State "]
+    joined = [flights.join(query, produce(query)) for query in queries]
+    results = [None] * len(queries)
+
+    def consume(i):
+        results[i] = list(joined[i].subscribe())
+
+    threads = [threading.Thread(target=consume, args=(i,)) for i in range(len(queries))]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(10)
+
+    assert len(started) == 1 and len({id(flight) for flight in joined}) == 1
+    assert results[0] == results[1] == results[2]
+    assert isinstance(results[0][0], QueryAnalysis) and any(isinstance(item, ContentCard) for item in results[0])
+    assert flights.stats()["started"] == 1 and flights.stats()["coalesced"] == 2
+
+    upstream_calls = len(calls)
+    list(service.stream_search_query(queries[0]))
+    assert upstream_calls == len(calls) - upstream_calls
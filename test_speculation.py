@@ -0,0 +1,44 @@
+import asyncio
+from async_llm_service import AsyncLLMService
+from intent_classifier import classify_by_rules
+from llm_backend import get_mock_server
+from llm_service import LLMService, is_fallback_response, same_branch
+from mock_llm_server import mock_analysis
+
+def queries_by_guess() -> tuple[str, str]:
+    """A query the mock labels as the rules guess, and one it relabels to another branch"""
+    server = get_mock_server()
+    right = wrong = None
+    for i in range(200):
+        query = f"books that make me cry number {i}"
+        hit = same_branch(mock_analysis(query, server.label_noise, server.seed), classify_by_rules(query))
+        if hit and right is None:
+            right = query
+        if not hit and wrong is None:
+            wrong = query
+    assert right and wrong
+    return right, wrong
+
+def test_speculation_right_and_wrong_guess():
+    right, wrong = queries_by_guess()
+    service = LLMService(use_cache=False, local_classifier=False, speculative=True)
+    for query in (right, wrong):
+        response = service.process_search_query(query)
+        assert not is_fallback_response(response)
+        assert same_branch(response.analysis, mock_analysis(query, get_mock_server().label_noise, get_mock_server().seed))
+    # The wrong guess was already generating when the analysis came back, so it ran to completion unused
+    assert service.speculation.as_dict() == {"hits": 1, "misses": 1, "wasted": 1, "hit_rate": 0.5}
+    service.close()
+
+def test_async_speculation_right_and_wrong_guess():
+    right, wrong = queries_by_guess()
+
+    async def run():
+        service = AsyncLLMService(use_cache=False, local_classifier=False, speculative=True)
+        responses = [await service.process_search_query(query) for query in (right, wrong)]
+        await service.close()
+        return service, responses
+
+    service, responses = asyncio.run(run())
+    assert not any(is_fallback_response(response) for response in responses)
+    assert service.speculation.as_dict() == {"hits": 1, "misses": 1, "wasted": 1, "hit_rate": 0.5}
@@ -0,0 +1,59 @@
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from tracing import (LogSink, PrometheusSink, RingBufferSink, Tracer, current_trace, last_trace,
+                     percentile, span, submit_in_context)
+
+def test_spans_join_the_trace_across_threads_and_tasks():
+    tracer = Tracer([])
+
+    def in_thread():
+        with span("thread"):
+            return current_trace()
+
+    async def in_task():
+        with span("task"):
+            await asyncio.sleep(0)
+
+    with tracer.trace("query") as trace:
+        with span("outer"), tracer.trace("nested") as nested:
+            assert nested is trace
+            with ThreadPoolExecutor(1) as executor:
+                assert submit_in_context(executor, in_thread).result() is trace
+                # Without the copied context the span has no trace and is dropped
+                executor.submit(in_thread).result()
+
+            async def tasks():
+                await asyncio.gather(in_task(), in_task())
+            asyncio.run(tasks())
+
+    assert sorted(item.name for item in trace.spans) == ["outer", "task", "task", "thread"]
+    assert last_trace() is trace and current_trace() is None
+    assert trace.total_ms is not None
+
+def test_sink_formats(caplog):
+    ring, prometheus = RingBufferSink(), PrometheusSink()
+    tracer = Tracer([LogSink(), ring, prometheus])
+    with caplog.at_level(logging.INFO, logger="ai_search.trace"), tracer.trace("query"):
+        with span("analyze") as stage:
+            stage.prompt_tokens, stage.completion_tokens = 10, 5
+        with span('cards"\\\n') as stage:
+            stage.fail(ValueError("bad"))
+
+    record = json.loads(caplog.records[-1].getMessage())
+    assert record["query"] == "query" and [item["name"] for item in record["spans"]] == ["analyze", 'cards"\\\n']
+
+    summary = ring.stage_summary()
+    assert summary["analyze"]["count"] == 1 and summary['cards"\\\n']["fallbacks"] == 1
+
+    text = prometheus.render()
+    assert 'ai_search_tokens_total{kind="prompt",stage="analyze"} 10' in text
+    assert 'ai_search_stage_fallbacks_total{stage="cards\\"\\\\\\n"} 1' in text
+    assert "ai_search_requests_total 1" in text
+    assert all(line.startswith(("ai_search_", "# TYPE")) for line in text.splitlines())
+
+def test_percentile():
+    assert percentile([], 0.5) == 0.0
+    assert percentile([3.0, 1.0, 2.0], 0.5) == 2.0
+    assert percentile(list(range(100)), 0.95) == 95
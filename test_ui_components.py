@@ -0,0 +1,18 @@
+from models import ContentCard
+from ui_components import _recommendation_html, card_html
+
+PAYLOAD = '<img src=x onerror="alert(1)">'
+
+def test_llm_text_in_cards_is_escaped():
+    card = ContentCard(type="quote", title=PAYLOAD, description=f"</p>{PAYLOAD}", book_title=PAYLOAD,
+                       book_author="A & B", quote=f'"{PAYLOAD}"', source_page="<b>p. 4</b>")
+    rendered = card_html(card)
+    assert "<img" not in rendered and "</p><img" not in rendered and "<b>p. 4</b>" not in rendered
+    assert "&lt;img src=x onerror=&quot;alert(1)&quot;&gt;" in rendered
+    assert "by A &amp; B" in rendered and "&lt;b&gt;p. 4&lt;/b&gt;" in rendered
+    assert rendered.startswith('<div class="content-card"') and rendered.count("<div") == rendered.count("</div>")
+
+def test_llm_text_in_recommendations_is_escaped():
+    rendered = _recommendation_html(PAYLOAD, "<script>x</script>", PAYLOAD, 0.9)
+    assert "<img" not in rendered and "<script>" not in rendered
+    assert "&lt;script&gt;x&lt;/script&gt;" in rendered
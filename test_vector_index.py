@@ -0,0 +1,68 @@
+import os
+import numpy as np
+from llm_service import degraded_response
+from vector_index import HashingEmbedder, VectorIndex, normalize_rows, quantize
+
+TOPICS = ["dragons", "gardening", "chess", "baking", "sailing", "astronomy", "jazz", "mountaineering"]
+
+def catalog(count: int = 200) -> list[dict]:
+    return [
+        {"id": str(i), "title": f"Book {i} about {TOPICS[i % len(TOPICS)]}", "author": f"Author {i % 13}",
+         "summary": f"A story of {TOPICS[i % len(TOPICS)]} and {TOPICS[(i * 3) % len(TOPICS)]}"}
+        for i in range(count)
+    ]
+
+def test_build_and_load_round_trip(tmp_path):
+    path = str(tmp_path / "index")
+    built = VectorIndex.build(path, catalog(20), HashingEmbedder(64))
+    loaded = VectorIndex(path)
+    assert loaded.items == built.items and loaded.meta == built.meta
+    assert loaded.embedder.name == "hashing-64"
+    item = loaded.items[3]
+    assert loaded.search(f"{item['title']} {item['author']} {item['summary']}", 1)[0][0]["id"] == "3"
+    assert not [name for name in os.listdir(tmp_path) if name != "index"]
+
+def test_int8_scores_match_float32(tmp_path):
+    items, embedder = catalog(50), HashingEmbedder(128)
+    exact = VectorIndex.build(str(tmp_path / "f32"), items, embedder)
+    int8 = VectorIndex.build(str(tmp_path / "int8"), items, embedder, dtype="int8")
+    assert int8.embeddings.dtype == np.int8
+    assert np.abs(quantize(normalize_rows(np.eye(2)), "int8")).max() == 127
+    query = exact.embed(["a story of chess and baking"])
+    exact_scores = [score for _, score in exact.search_vectors(query, 10)[0]]
+    int8_scores = [score for _, score in int8.search_vectors(query, 10)[0]]
+    assert np.allclose(exact_scores, int8_scores, atol=0.02)
+
+def test_ivf_recall_against_exact_search(tmp_path):
+    index = VectorIndex.build(str(tmp_path / "index"), catalog(), HashingEmbedder(128), n_lists=16)
+    queries = index.embed([f"{topic} and {other}" for topic in TOPICS for other in TOPICS[:3]])
+    exact = index.search_vectors(queries, 10)
+    probed = index.search_vectors(queries, 10, n_probe=8)
+    everything = index.search_vectors(queries, 10, n_probe=16)
+    recall = np.mean([
+        len({i["id"] for i, _ in a} & {i["id"] for i, _ in b}) / 10 for a, b in zip(exact, probed)
+    ])
+    assert recall >= 0.8
+    assert np.allclose([[s for _, s in r] for r in everything], [[s for _, s in r] for r in exact], atol=1e-6)
+
+def test_rebuild_without_ivf_drops_old_lists(tmp_path):
+    path = str(tmp_path / "index")
+    VectorIndex.build(path, catalog(), HashingEmbedder(64), n_lists=8)
+    rebuilt = VectorIndex.build(path, catalog(10), HashingEmbedder(64))
+    assert not [name for name in os.listdir(path) if name.startswith("ivf_")]
+    reloaded = VectorIndex(path)
+    assert reloaded.centroids is None and reloaded.n_probe is None
+    assert len(reloaded.search("dragons", 5)) == 5 == len(rebuilt.search("dragons", 5))
+
+class BrokenIndex:
+    n_probe = None
+
+    def __len__(self) -> int:
+        return 1
+
+    def search(self, query, k, n_probe):
+        raise IndexError("index 200 is out of bounds")
+
+def test_degraded_response_survives_broken_index():
+    response = degraded_response("books about dragons", None, BrokenIndex())
+    assert response.analysis and (response.content_cards or response.book_recommendation)
@@ -0,0 +1,291 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+logger = logging.getLogger("ai_search.trace")
+
+def percentile(samples: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of a list of samples"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def cached_tokens_of(usage) -> int:
+    """Cached prompt tokens reported in an API usage object (0 when not reported)"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    return (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+
+class Span:
+    """Wall time, token usage and outcome of one pipeline stage"""
+
+    def __init__(self, name: str, **attributes):
+        self.name = name
+        self.model: Optional[str] = None
+        self.wall_ms: Optional[float] = None
+        self.ttft_ms: Optional[float] = None
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+        # Prompt tokens served from the provider's prompt cache
+        self.cached_tokens: Optional[int] = None
+        self.cache: Optional[str] = None
+        self.fallback = False
+        self.error: Optional[str] = None
+        self.attributes: dict = {}
+        for key, value in attributes.items():
+            self.set(key, value)
+        self._start = time.perf_counter()
+
+    def set(self, key: str, value) -> None:
+        if key in self.__dict__ and key != "attributes":
+            setattr(self, key, value)
+        else:
+            self.attributes[key] = value
+
+    def first_token(self) -> None:
+        """Mark the arrival of the first streamed token"""
+        if self.ttft_ms is None:
+            self.ttft_ms = (time.perf_counter() - self._start) * 1000
+
+    def record_usage(self, usage) -> None:
+        """Add prompt/completion/cached token counts from an API usage object"""
+        if usage is None:
+            return
+        self.prompt_tokens = (self.prompt_tokens or 0) + usage.prompt_tokens
+        self.completion_tokens = (self.completion_tokens or 0) + usage.completion_tokens
+        self.cached_tokens = (self.cached_tokens or 0) + cached_tokens_of(usage)
+
+    def fail(self, error: Exception) -> None:
+        """Mark the stage as served by a fallback"""
+        self.fallback = True
+        self.error = str(error)
+
+    def finish(self) -> None:
+        if self.wall_ms is None:
+            self.wall_ms = (time.perf_counter() - self._start) * 1000
+
+    def as_dict(self) -> dict:
+        data = {key: value for key, value in self.__dict__.items() if not key.startswith("_") and key != "attributes"}
+        return {**data, **self.attributes}
+
+class Trace:
+    """All spans of one search request"""
+
+    def __init__(self, query: str):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.query = query
+        self.started_at = time.time()
+        self.total_ms: Optional[float] = None
+        self.spans: list[Span] = []
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def finish(self) -> None:
+        self.total_ms = (time.perf_counter() - self._start) * 1000
+
+    @property
+    def fallback(self) -> bool:
+        return any(span.fallback for span in self.spans)
+
+    def as_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "query": self.query,
+            "started_at": self.started_at,
+            "total_ms": self.total_ms,
+            "fallback": self.fallback,
+            "spans": [span.as_dict() for span in self.spans],
+        }
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+_last_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("last_trace", default=None)
+
+def current_trace() -> Optional[Trace]:
+    """Trace of the request running in this context"""
+    return _current_trace.get()
+
+def last_trace() -> Optional[Trace]:
+    """Most recently finished trace in this context"""
+    return _last_trace.get()
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Span]:
+    """Time a stage and attach it to the current trace; outside a trace the span is discarded"""
+    current = Span(name, **attributes)
+    try:
+        yield current
+    except BaseException as e:
+        if not isinstance(e, GeneratorExit):
+            current.fail(e)
+        raise
+    finally:
+        current.finish()
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(current)
+
+class LogSink:
+    """Writes each finished trace as one JSON log line"""
+
+    def __init__(self, level: int = logging.INFO):
+        self.level = level
+
+    def emit(self, trace: Trace) -> None:
+        logger.log(self.level, json.dumps(trace.as_dict()))
+
+class RingBufferSink:
+    """Keeps the most recent traces in memory"""
+
+    def __init__(self, maxlen: int = 500):
+        self.traces: deque[Trace] = deque(maxlen=maxlen)
+
+    def emit(self, trace: Trace) -> None:
+        self.traces.append(trace)
+
+    def recent(self, n: int = 20) -> list[Trace]:
+        return list(self.traces)[-n:]
+
+    def stage_summary(self) -> dict:
+        """Count, p50/p95 wall time and fallbacks per stage over the buffered traces"""
+        by_stage: dict[str, list[Span]] = {}
+        for trace in list(self.traces):
+            for item in trace.spans:
+                by_stage.setdefault(item.name, []).append(item)
+        summary = {}
+        for name, spans in by_stage.items():
+            walls = [item.wall_ms for item in spans]
+            summary[name] = {
+                "count": len(spans),
+                "p50_ms": percentile(walls, 0.5),
+                "p95_ms": percentile(walls, 0.95),
+                "fallbacks": sum(item.fallback for item in spans),
+            }
+        return summary
+
+class PrometheusSink:
+    """Aggregates spans into counters and latency histograms in Prometheus text format"""
+
+    BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+    def __init__(self, prefix: str = "ai_search"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters: dict[tuple[str, tuple], float] = {}
+        self._histograms: dict[str, list] = {}
+
+    def _inc(self, name: str, labels: dict, value: float = 1) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def _observe(self, stage: str, value_ms: float) -> None:
+        buckets, total = self._histograms.setdefault(stage, [[0] * len(self.BUCKETS_MS), [0.0, 0]])
+        for i, bound in enumerate(self.BUCKETS_MS):
+            if value_ms <= bound:
+                buckets[i] += 1
+        total[0] += value_ms / 1000
+        total[1] += 1
+
+    def emit(self, trace: Trace) -> None:
+        with self._lock:
+            self._inc("requests_total", {})
+            if trace.fallback:
+                self._inc("fallback_requests_total", {})
+            self._observe("request", trace.total_ms or 0.0)
+            for item in trace.spans:
+                self._inc("stage_calls_total", {"stage": item.name})
+                self._observe(item.name, item.wall_ms or 0.0)
+                if item.fallback:
+                    self._inc("stage_fallbacks_total", {"stage": item.name})
+                if item.cache:
+                    self._inc("cache_lookups_total", {"outcome": item.cache})
+                if item.prompt_tokens is not None:
+                    self._inc("tokens_total", {"stage": item.name, "kind": "prompt"}, item.prompt_tokens)
+                    self._inc("tokens_total", {"stage": item.name, "kind": "completion"}, item.completion_tokens or 0)
+                    self._inc("tokens_total", {"stage": item.name, "kind": "cached"}, item.cached_tokens or 0)
+
+    def render(self) -> str:
+        """Current metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            names = sorted({name for name, _ in self._counters})
+            for name in names:
+                lines.append(f"# TYPE {self.prefix}_{name} counter")
+                for (counter, labels), value in sorted(self._counters.items()):
+                    if counter == name:
+                        lines.append(f"{self.prefix}_{name}{_labels(dict(labels))} {value:g}")
+            if self._histograms:
+                lines.append(f"# TYPE {self.prefix}_stage_seconds histogram")
+            for stage, (buckets, (total, count)) in sorted(self._histograms.items()):
+                for bound, bucket_count in zip(self.BUCKETS_MS, buckets):
+                    lines.append(f"{self.prefix}_stage_seconds_bucket{_labels({'stage': stage, 'le': f'{bound / 1000:g}'})} {bucket_count}")
+                lines.append(f"{self.prefix}_stage_seconds_bucket{_labels({'stage': stage, 'le': '+Inf'})} {count}")
+                lines.append(f"{self.prefix}_stage_seconds_sum{_labels({'stage': stage})} {total:g}")
+                lines.append(f"{self.prefix}_stage_seconds_count{_labels({'stage': stage})} {count}")
+        return "\n".join(lines) + "\n" if lines else ""
+
+def _escape(value) -> str:
+    """Label value escaped for the Prometheus text format"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+SINKS = {"log": LogSink, "ring": RingBufferSink, "prometheus": PrometheusSink}
+
+class Tracer:
+    """Opens a trace per request and hands finished traces to its sinks"""
+
+    def __init__(self, sinks: Optional[list] = None):
+        self.sinks = sinks if sinks is not None else [RingBufferSink()]
+
+    @classmethod
+    def from_env(cls) -> "Tracer":
+        """Build a tracer from TRACE_SINKS, a comma-separated list of log, ring and prometheus"""
+        names = [name.strip() for name in os.getenv("TRACE_SINKS", "ring").split(",") if name.strip()]
+        return cls([SINKS[name]() for name in names])
+
+    def sink(self, sink_type: type):
+        """First sink of the given type, or None"""
+        return next((sink for sink in self.sinks if isinstance(sink, sink_type)), None)
+
+    @contextmanager
+    def trace(self, query: str) -> Iterator[Trace]:
+        """Collect the spans of one request; nested calls join the outer trace"""
+        existing = _current_trace.get()
+        if existing is not None:
+            yield existing
+            return
+        trace = Trace(query)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            try:
+                _current_trace.reset(token)
+            except ValueError:
+                # A streaming generator closed from another context
+                pass
+            trace.finish()
+            _last_trace.set(trace)
+            for sink in self.sinks:
+                try:
+                    sink.emit(trace)
+                except Exception as e:
+                    print(f"Error emitting trace: {str(e)}")
+
+def submit_in_context(executor, fn, *args):
+    """Submit to an executor so the task's spans land in the caller's trace"""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
@@ -1,6 +1,95 @@
+import html
+from functools import lru_cache
 import streamlit as st
 from models import ContentCard, BookRecommendation, PlaceholderFeature, UserIntentCategory
 
+# Notion-like minimalistic page styling, injected by app.py on every run
+APP_CSS = """
+<style>
+    .main .block-container {
+        max-width: 800px;
+        padding-top: 2rem;
+        padding-bottom: 2rem;
+    }
+    
+    .main-header {
+        text-align: center;
+        background: #f7f6f3;
+        padding: 24px;
+        border-radius: 8px;
+        border: 1px solid #e9e9e7;
+        margin-bottom: 24px;
+    }
+    
+    .main-header h1 {
+        margin: 0;
+        font-size: 2.2em;
+        color: #2d2d2d;
+        font-weight: 600;
+    }
+    
+    .main-header p {
+        margin: 8px 0 0 0;
+        font-size: 1em;
+        color: #6b6b6b;
+    }
+    
+    .stTextInput input {
+        border-radius: 6px;
+        border: 1px solid #e9e9e7;
+        padding: 12px 16px;
+        font-size: 14px;
+        height: 44px;
+        background-color: white;
+    }
+    
+    .stTextInput input:focus {
+        border-color: #2383e2;
+        box-shadow: 0 0 0 1px #2383e2;
+    }
+    
+    .stButton button {
+        background: #2383e2;
+        color: white;
+        border: none;
+        border-radius: 6px;
+        padding: 10px 16px;
+        font-weight: 500;
+        font-size: 14px;
+        width: 100%;
+        height: 44px;
+        transition: background-color 0.2s;
+    }
+    
+    .stButton button:hover {
+        background: #1a73d1;
+    }
+    
+    .results-section {
+        margin-top: 32px;
+    }
+    
+    /* Make overall content more compact */
+    .element-container {
+        margin-bottom: 0.75rem !important;
+    }
+    
+    .stMarkdown {
+        margin-bottom: 0.75rem !important;
+    }
+    
+    /* Footer styling */
+    .footer {
+        text-align: center;
+        color: #8b8b8b;
+        font-size: 14px;
+        margin: 40px 0 20px 0;
+        padding-top: 24px;
+        border-top: 1px solid #e9e9e7;
+    }
+</style>
+"""
+
 def render_suggestion_card():
     """Render the suggestion card showing query types"""
     
@@ -43,95 +132,113 @@ def render_suggestion_card():
     </div>
     """, unsafe_allow_html=True)
 
+# Card styling configuration for colors and icons
+CARD_STYLES = {
+    "quote": {"icon": "💬", "color": "#2383e2"},
+    "summary": {"icon": "📄", "color": "#10b981"},
+    "recommendation": {"icon": "⭐", "color": "#8b5cf6"},
+    "theme": {"icon": "🎭", "color": "#f59e0b"},
+    "podcast": {"icon": "🎧", "color": "#e74c3c"},
+    "error": {"icon": "⚠️", "color": "#ef4444"}
+}
+
+# Templates hold no blank lines or indentation, so markdown passes them through as one HTML block.
+# Every value is escaped before it is substituted.
+CARD_TEMPLATE = (
+    '<div class="content-card" style="margin-bottom: 8px;">'
+    '<h2 style="color: #2d2d2d; font-weight: 600;">{icon} {title}</h2>'
+    '<p style="color: #2d2d2d;"><strong>Why this content:</strong> {description}</p>'
+    '{book}{quote}'
+    '<hr style="margin: 16px 0; border: none; border-top: 1px solid #e9e9e7;">'
+    '</div>'
+)
+
+CARD_BOOK_TEMPLATE = '<p style="margin: 4px 0;"><strong>📖 {book_title}</strong>{author}{page}</p>'
+
+CARD_QUOTE_TEMPLATE = (
+    '<blockquote style="border-left: 3px solid {color}; margin: 12px 0; padding: 4px 12px; color: #6b6b6b;">'
+    '<em>&quot;{quote}&quot;</em></blockquote>'
+)
+
+RECOMMENDATION_TEMPLATE = (
+    '<div style="background: white; border: 1px solid #e9e9e7; border-left: 4px solid #2383e2; '
+    'padding: 24px; border-radius: 8px; margin: 20px 0;">'
+    '<div style="display: flex; align-items: center; margin-bottom: 15px;">'
+    '<span style="font-size: 1.5em; margin-right: 15px;">📚</span>'
+    '<div>'
+    '<h2 style="margin: 0; color: #2d2d2d; font-weight: 700; font-size: 1.4em;">{title}</h2>'
+    '<h4 style="margin: 5px 0; color: #6b6b6b; font-weight: 500;">by {author}</h4>'
+    '</div>'
+    '</div>'
+    '<div style="background: #f8f9fa; padding: 16px; border-radius: 6px; margin: 15px 0;">'
+    '<h4 style="color: #2d2d2d; margin-top: 0; margin-bottom: 8px; font-weight: 600;">Why this content?</h4>'
+    '<p style="line-height: 1.6; margin-bottom: 0; color: #6b6b6b; font-size: 0.9em;">{reason}</p>'
+    '</div>'
+    '<div style="display: flex; align-items: center; justify-content: space-between; margin-top: 20px;">'
+    '<div style="background: {confidence_color}; color: white; padding: 6px 12px; '
+    'border-radius: 20px; font-weight: 600; font-size: 0.8em;">Relevance: {relevance:.0%}</div>'
+    '<div style="background: #2383e2; color: white; padding: 8px 16px; border-radius: 6px; '
+    'cursor: pointer; font-weight: 500; font-size: 0.85em;">View Details</div>'
+    '</div>'
+    '</div>'
+)
+
+def _escape(value) -> str:
+    return html.escape(str(value)) if value is not None else ""
+
+@lru_cache(maxsize=1024)
+def _card_html(card_type: str, title: str, description: str, book_title, book_author, source_page, quote) -> str:
+    style = CARD_STYLES.get(card_type, CARD_STYLES["recommendation"])
+    book = ""
+    if book_title:
+        book = CARD_BOOK_TEMPLATE.format(
+            book_title=_escape(book_title),
+            author=f"<br><em>by {_escape(book_author)}</em>" if book_author else "",
+            page=f"<br><em>{_escape(source_page)}</em>" if source_page else "",
+        )
+    return CARD_TEMPLATE.format(
+        icon=style["icon"],
+        title=_escape(title),
+        description=_escape(description),
+        book=book,
+        quote=CARD_QUOTE_TEMPLATE.format(color=style["color"], quote=_escape(quote)) if card_type == "quote" and quote else "",
+    )
+
+def card_html(card: ContentCard) -> str:
+    """Escaped HTML for one card, memoized on the fields it displays"""
+    return _card_html(card.type, card.title, card.description, card.book_title,
+                      card.book_author, card.source_page, card.quote)
+
 def render_content_card(card: ContentCard, is_main: bool = False):
     """Render individual content card with three simple components: title, reason, book info"""
-    
-    # Card styling configuration for colors and icons
-    card_styles = {
-        "quote": {"icon": "💬", "color": "#2383e2"},
-        "summary": {"icon": "📄", "color": "#10b981"},
-        "recommendation": {"icon": "⭐", "color": "#8b5cf6"},
-        "theme": {"icon": "🎭", "color": "#f59e0b"},
-        "podcast": {"icon": "🎧", "color": "#e74c3c"},
-        "error": {"icon": "⚠️", "color": "#ef4444"}
-    }
-    
-    style = card_styles.get(card.type, card_styles["recommendation"])
-    
-    # 1. TITLE COMPONENT
-    with st.container():
-        st.markdown(f"## {style['icon']} {card.title}")
-    
-    # 2. RECOMMENDATION REASON COMPONENT  
-    with st.container():
-        st.markdown(f"**Why this content:** {card.description}")
-    
-    # 3. BOOK/CONTENT COMPONENT
-    with st.container():
-        if card.book_title:
-            st.markdown(f"**📖 {card.book_title}**")
-            if card.book_author:
-                st.markdown(f"*by {card.book_author}*")
-            if card.source_page:
-                st.markdown(f"*{card.source_page}*")
-        
-        # Quote section (if applicable)
-        if card.type == "quote" and card.quote:
-            st.markdown(f"> *\"{card.quote}\"*")
-    
-    # Add some spacing
-    st.markdown("---")
+    st.markdown(card_html(card), unsafe_allow_html=True)
 
-def render_book_recommendation(recommendation: BookRecommendation):
-    """Render specific content recommendation"""
-    
+def render_content_cards(cards: list[ContentCard]):
+    """Render a whole card list as a single element"""
+    st.markdown("".join(card_html(card) for card in cards), unsafe_allow_html=True)
+
+@lru_cache(maxsize=256)
+def _recommendation_html(title: str, author: str, reason: str, relevance_score: float) -> str:
     # Determine confidence color based on relevance score
-    if recommendation.relevance_score > 0.7:
+    if relevance_score > 0.7:
         confidence_color = "#10b981"
-    elif recommendation.relevance_score > 0.4:
+    elif relevance_score > 0.4:
         confidence_color = "#f59e0b"
     else:
         confidence_color = "#ef4444"
-    
-    # Build the recommendation HTML
-    recommendation_html = f"""
-    <div style="background: white; border: 1px solid #e9e9e7; border-left: 4px solid #2383e2; 
-                padding: 24px; border-radius: 8px; margin: 20px 0;">
-        <div style="display: flex; align-items: center; margin-bottom: 15px;">
-            <span style="font-size: 1.5em; margin-right: 15px;">📚</span>
-            <div>
-                <h2 style="margin: 0; color: #2d2d2d; font-weight: 700; font-size: 1.4em;">
-                    {recommendation.title}
-                </h2>
-                <h4 style="margin: 5px 0; color: #6b6b6b; font-weight: 500;">
-                    by {recommendation.author}
-                </h4>
-            </div>
-        </div>
-        
-        <div style="background: #f8f9fa; padding: 16px; border-radius: 6px; margin: 15px 0;">
-            <h4 style="color: #2d2d2d; margin-top: 0; margin-bottom: 8px; font-weight: 600;">
-                Why this content?
-            </h4>
-            <p style="line-height: 1.6; margin-bottom: 0; color: #6b6b6b; font-size: 0.9em;">
-                {recommendation.reason}
-            </p>
-        </div>
-        
-        <div style="display: flex; align-items: center; justify-content: space-between; margin-top: 20px;">
-            <div style="background: {confidence_color}; color: white; padding: 6px 12px; 
-                        border-radius: 20px; font-weight: 600; font-size: 0.8em;">
-                Relevance: {recommendation.relevance_score:.0%}
-            </div>
-            <div style="background: #2383e2; color: white; padding: 8px 16px; border-radius: 6px; 
-                        cursor: pointer; font-weight: 500; font-size: 0.85em;">
-                View Details
-            </div>
-        </div>
-    </div>
-    """
-    
-    st.markdown(recommendation_html, unsafe_allow_html=True)
+    return RECOMMENDATION_TEMPLATE.format(
+        title=_escape(title),
+        author=_escape(author),
+        reason=_escape(reason),
+        confidence_color=confidence_color,
+        relevance=relevance_score,
+    )
+
+def render_book_recommendation(recommendation: BookRecommendation):
+    """Render specific content recommendation"""
+    st.markdown(_recommendation_html(recommendation.title, recommendation.author,
+                                     recommendation.reason, recommendation.relevance_score),
+                unsafe_allow_html=True)
 
 def render_placeholder_feature(feature: PlaceholderFeature):
     """Render work-in-progress placeholder feature"""
@@ -192,7 +299,7 @@ def render_placeholder_feature(feature: PlaceholderFeature):
     </div>
     """, unsafe_allow_html=True)
 
-def render_analysis_debug(analysis):
+def render_analysis_debug(analysis, time_to_first_card=None, trace=None):
     """Render query analysis for debugging (optional)"""
     
     with st.expander("🔍 Query Analysis (Debug)"):
@@ -201,8 +308,29 @@ def render_analysis_debug(analysis):
         with col1:
             st.write("**Query Type:**", analysis.query_type.value)
             st.write("**Confidence:**", f"{analysis.confidence_score:.0%}")
+            if time_to_first_card is not None:
+                st.write("**Time to first result:**", f"{time_to_first_card:.2f}s")
         
         with col2:
             if analysis.user_intent_category:
                 st.write("**Intent Category:**", analysis.user_intent_category.value.replace('_', ' ').title())
-            st.write("**Reasoning:**", analysis.reasoning) 
\ No newline at end of file
+            st.write("**Reasoning:**", analysis.reasoning)
+        
+        if trace is not None:
+            st.write("**Stages:**", f"{trace.total_ms:.0f} ms total")
+            st.dataframe(
+                [
+                    {
+                        "stage": span.name,
+                        "ms": round(span.wall_ms or 0),
+                        "first token ms": round(span.ttft_ms) if span.ttft_ms is not None else None,
+                        "tokens in/out": f"{span.prompt_tokens}/{span.completion_tokens}" if span.prompt_tokens is not None else "",
+                        "cached in": span.cached_tokens,
+                        "model": span.model or "",
+                        "cache": span.cache or "",
+                        "fallback": span.fallback,
+                    }
+                    for span in trace.spans
+                ],
+                hide_index=True
+            )
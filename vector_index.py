@@ -0,0 +1,324 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import tempfile
+import time
+from typing import Callable, Iterable, Optional
+import numpy as np
+
+# Maps a batch of texts to an (n, dim) float32 matrix
+EmbeddingFunction = Callable[[list[str]], np.ndarray]
+
+_WORD = re.compile(r"[a-z0-9']+")
+
+class HashingEmbedder:
+    """Deterministic offline embedding via feature hashing of words, bigrams and character trigrams.
+
+    It captures lexical rather than true semantic similarity, but needs no model
+    or network, which makes it suitable for tests and for bootstrapping an index.
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str) -> Iterable[tuple[str, float]]:
+        words = _WORD.findall(text.casefold())
+        for word in words:
+            yield word, 1.0
+            padded = f" {word} "
+            for i in range(len(padded) - 2):
+                yield "#" + padded[i:i + 3], 0.5
+        for a, b in zip(words, words[1:]):
+            yield f"{a} {b}", 1.0
+
+    def __call__(self, texts: list[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, weight in self._features(text):
+                digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+                bucket = int.from_bytes(digest[:4], "little") % self.dim
+                sign = 1.0 if digest[4] & 1 else -1.0
+                matrix[row, bucket] += sign * weight
+        return matrix
+
+class OpenAIEmbedder:
+    """Embeddings from the OpenAI API, batched per request"""
+
+    def __init__(self, model: str = "text-embedding-3-small", batch_size: int = 256):
+        from llm_backend import create_client
+        self.client = create_client()
+        self.model = model
+        self.batch_size = batch_size
+        self.name = f"openai-{model}"
+
+    def __call__(self, texts: list[str]) -> np.ndarray:
+        rows = []
+        for start in range(0, len(texts), self.batch_size):
+            response = self.client.embeddings.create(model=self.model, input=texts[start:start + self.batch_size])
+            rows.extend(item.embedding for item in response.data)
+        return np.asarray(rows, dtype=np.float32)
+
+def get_embedder(name: str) -> EmbeddingFunction:
+    """Build an embedder from the name recorded in an index"""
+    if name.startswith("hashing-"):
+        return HashingEmbedder(int(name.split("-", 1)[1]))
+    if name.startswith("openai-"):
+        return OpenAIEmbedder(name.split("-", 1)[1])
+    raise ValueError(f"Unknown embedder: {name}")
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize each row so dot products are cosine similarities"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def quantize(matrix: np.ndarray, dtype: str) -> np.ndarray:
+    """Store unit vectors as float32, float16 or symmetric int8"""
+    if dtype == "float32":
+        return matrix.astype(np.float32)
+    if dtype == "float16":
+        return matrix.astype(np.float16)
+    if dtype == "int8":
+        return np.clip(np.rint(matrix * 127), -127, 127).astype(np.int8)
+    raise ValueError(f"Unsupported dtype: {dtype}")
+
+def _top_k(scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """Row-wise top-k (indices, scores) sorted by descending score"""
+    k = min(k, scores.shape[1])
+    if k == 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(np.int64), empty
+    indices = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, indices, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    return np.take_along_axis(indices, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+def _kmeans(vectors: np.ndarray, n_clusters: int, iterations: int = 15, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on unit vectors, returning unit centroids"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].astype(np.float32)
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        for cluster in range(n_clusters):
+            members = vectors[assignments == cluster]
+            if len(members):
+                centroids[cluster] = members.sum(axis=0)
+        centroids = normalize_rows(centroids)
+    return centroids
+
+class VectorIndex:
+    """Memory-mapped embedding matrix over a catalog with exact and IVF top-k search.
+
+    An index directory holds ``embeddings.npy`` (float32, float16 or int8 unit
+    vectors), ``items.jsonl`` with one catalog record per row, ``meta.json`` and,
+    when built with ``n_lists``, the IVF centroids and inverted lists. ``n_probe``
+    is the number of lists retrieval scans on an IVF index (VECTOR_INDEX_N_PROBE,
+    default the square root of the list count; 0 searches exhaustively).
+    """
+
+    def __init__(self, path: str, embedder: Optional[EmbeddingFunction] = None, n_probe: Optional[int] = None):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.embedder = embedder or get_embedder(self.meta["embedder"])
+        self.embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+        self._scale = 1 / 127 if self.embeddings.dtype == np.int8 else 1.0
+        with open(os.path.join(path, "items.jsonl")) as f:
+            self.items = [json.loads(line) for line in f if line.strip()]
+        self.centroids = None
+        if os.path.exists(os.path.join(path, "ivf_centroids.npy")):
+            self.centroids = np.load(os.path.join(path, "ivf_centroids.npy"))
+            self.list_offsets = np.load(os.path.join(path, "ivf_offsets.npy"))
+            self.list_rows = np.load(os.path.join(path, "ivf_rows.npy"), mmap_mode="r")
+        self.n_probe = None
+        if self.centroids is not None:
+            if n_probe is None and os.getenv("VECTOR_INDEX_N_PROBE"):
+                n_probe = int(os.environ["VECTOR_INDEX_N_PROBE"])
+            if n_probe is None:
+                n_probe = max(1, round(math.sqrt(len(self.centroids))))
+            self.n_probe = n_probe or None
+
+    @classmethod
+    def from_env(cls) -> Optional["VectorIndex"]:
+        """Load the index at VECTOR_INDEX_PATH if it has been built"""
+        path = os.getenv("VECTOR_INDEX_PATH", "catalog_index")
+        return cls(path) if os.path.exists(os.path.join(path, "meta.json")) else None
+
+    @classmethod
+    def build(cls, path: str, items: list[dict], embedder: EmbeddingFunction, dtype: str = "float32",
+              n_lists: int = 0, batch_size: int = 512, text_fields: tuple[str, ...] = ("title", "author", "summary")) -> "VectorIndex":
+        """Embed catalog items and write an index directory.
+
+        The index is written to a sibling temporary directory that then replaces
+        ``path``, so a rebuild never mixes in files (such as IVF lists) left over
+        from the previous index and readers never see a half-written one.
+        """
+        target = path
+        parent = os.path.dirname(os.path.abspath(target))
+        os.makedirs(parent, exist_ok=True)
+        path = tempfile.mkdtemp(prefix=f".{os.path.basename(target)}.", dir=parent)
+        try:
+            cls._write(path, items, embedder, dtype, n_lists, batch_size, text_fields)
+            if os.path.exists(target):
+                previous = tempfile.mkdtemp(prefix=f".{os.path.basename(target)}.old.", dir=parent)
+                os.replace(target, previous)
+                os.replace(path, target)
+                shutil.rmtree(previous, ignore_errors=True)
+            else:
+                os.replace(path, target)
+        except BaseException:
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+        return cls(target, embedder)
+
+    @staticmethod
+    def _write(path: str, items: list[dict], embedder: EmbeddingFunction, dtype: str, n_lists: int,
+               batch_size: int, text_fields: tuple[str, ...]) -> None:
+        texts = [" ".join(str(item.get(field, "")) for field in text_fields) for item in items]
+        vectors = np.concatenate([
+            normalize_rows(embedder(texts[start:start + batch_size]))
+            for start in range(0, len(texts), batch_size)
+        ]) if texts else np.zeros((0, 0), dtype=np.float32)
+
+        np.save(os.path.join(path, "embeddings.npy"), quantize(vectors, dtype))
+        with open(os.path.join(path, "items.jsonl"), "w") as f:
+            for item in items:
+                f.write(json.dumps(item) + "\n")
+
+        if n_lists:
+            centroids = _kmeans(vectors, min(n_lists, len(vectors)))
+            assignments = np.argmax(vectors @ centroids.T, axis=1)
+            rows = np.argsort(assignments, kind="stable")
+            offsets = np.searchsorted(assignments[rows], np.arange(len(centroids) + 1))
+            np.save(os.path.join(path, "ivf_centroids.npy"), centroids)
+            np.save(os.path.join(path, "ivf_rows.npy"), rows.astype(np.int64))
+            np.save(os.path.join(path, "ivf_offsets.npy"), offsets.astype(np.int64))
+
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({
+                "embedder": getattr(embedder, "name", "custom"),
+                "dim": int(vectors.shape[1]) if len(vectors) else 0,
+                "dtype": dtype,
+                "count": len(items),
+                "n_lists": int(min(n_lists, len(vectors))) if n_lists else 0,
+                "text_fields": list(text_fields),
+            }, f, indent=2)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        return normalize_rows(self.embedder(texts))
+
+    def search_vectors(self, queries: np.ndarray, k: int = 10, n_probe: Optional[int] = None,
+                       chunk_size: int = 65536) -> list[list[tuple[dict, float]]]:
+        """Top-k cosine search for a batch of unit query vectors.
+
+        With ``n_probe`` set on an IVF index only the ``n_probe`` closest lists are
+        scanned; otherwise every row is scored in chunks of the memory map.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if self.centroids is not None and n_probe:
+            return [self._search_ivf(query, k, n_probe) for query in queries]
+
+        best_rows, best_scores = None, None
+        for start in range(0, len(self.items), chunk_size):
+            block = np.asarray(self.embeddings[start:start + chunk_size], dtype=np.float32)
+            rows, scores = _top_k(queries @ block.T * self._scale, k)
+            rows = rows + start
+            if best_rows is not None:
+                rows = np.concatenate([best_rows, rows], axis=1)
+                positions, scores = _top_k(np.concatenate([best_scores, scores], axis=1), k)
+                rows = np.take_along_axis(rows, positions, axis=1)
+            best_rows, best_scores = rows, scores
+        return [
+            [(self.items[row], float(score)) for row, score in zip(row_ids, row_scores)]
+            for row_ids, row_scores in zip(best_rows, best_scores)
+        ]
+
+    def _search_ivf(self, query: np.ndarray, k: int, n_probe: int) -> list[tuple[dict, float]]:
+        lists = np.argsort(-(self.centroids @ query))[:n_probe]
+        candidates = np.concatenate([
+            self.list_rows[self.list_offsets[i]:self.list_offsets[i + 1]] for i in lists
+        ])
+        if not len(candidates):
+            return []
+        candidates = np.sort(candidates)
+        scores = np.asarray(self.embeddings[candidates], dtype=np.float32) @ query * self._scale
+        positions, top_scores = _top_k(scores[None, :], k)
+        return [(self.items[candidates[p]], float(s)) for p, s in zip(positions[0], top_scores[0])]
+
+    def search(self, query: str, k: int = 10, n_probe: Optional[int] = None) -> list[tuple[dict, float]]:
+        """Top-k catalog items for a text query"""
+        return self.search_batch([query], k, n_probe)[0]
+
+    def search_batch(self, queries: list[str], k: int = 10, n_probe: Optional[int] = None) -> list[list[tuple[dict, float]]]:
+        """Top-k catalog items for each of a batch of text queries"""
+        if not len(self.items):
+            return [[] for _ in queries]
+        return self.search_vectors(self.embed(queries), k, n_probe)
+
+    def stats(self) -> dict:
+        return {
+            "indexed_books": len(self.items),
+            "embedding_dimensions": self.meta["dim"],
+            "dtype": self.meta["dtype"],
+            "embedder": self.meta["embedder"],
+            "ivf_lists": self.meta["n_lists"],
+            "n_probe": self.n_probe,
+        }
+
+def read_catalog(path: str) -> list[dict]:
+    """Read a JSONL catalog, assigning sequential ids to rows without one"""
+    items = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                item.setdefault("id", str(len(items)))
+                items.append(item)
+    return items
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query the local catalog vector index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest = subparsers.add_parser("ingest", help="Embed a JSONL catalog (title, author, summary, ...) into an index")
+    ingest.add_argument("catalog")
+    ingest.add_argument("--index", default=os.getenv("VECTOR_INDEX_PATH", "catalog_index"))
+    ingest.add_argument("--embedder", default="hashing-512", help="hashing-<dim> (offline) or openai-<model>")
+    ingest.add_argument("--dtype", choices=["float32", "float16", "int8"], default="float32")
+    ingest.add_argument("--n-lists", type=int, default=0, help="IVF lists for approximate search (0 = exact only)")
+
+    search = subparsers.add_parser("search", help="Query an index")
+    search.add_argument("query")
+    search.add_argument("--index", default=os.getenv("VECTOR_INDEX_PATH", "catalog_index"))
+    search.add_argument("-k", type=int, default=5)
+    search.add_argument("--n-probe", type=int, default=None)
+
+    args = parser.parse_args()
+
+    if args.command == "ingest":
+        items = read_catalog(args.catalog)
+        start = time.perf_counter()
+        index = VectorIndex.build(args.index, items, get_embedder(args.embedder), dtype=args.dtype, n_lists=args.n_lists)
+        print(f"Indexed {len(index)} items in {time.perf_counter() - start:.1f}s -> {args.index}")
+        print(json.dumps(index.stats(), indent=2))
+        return
+
+    index = VectorIndex(args.index)
+    start = time.perf_counter()
+    results = index.search(args.query, args.k, args.n_probe)
+    elapsed = (time.perf_counter() - start) * 1000
+    for item, score in results:
+        print(f"{score:.3f}  {item.get('title')} — {item.get('author')}")
+    print(f"({elapsed:.1f} ms)")
+
+if __name__ == "__main__":
+    main()